@@ -0,0 +1,177 @@
+import math
+import os
+import time
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+import redis
+
+# Per-user and per-session budgets; buckets refill continuously (capacity per minute).
+RATE_USER_RPM = int(os.getenv("RATE_USER_RPM", "30"))
+RATE_SESSION_RPM = int(os.getenv("RATE_SESSION_RPM", "20"))
+RATE_USER_TPM = int(os.getenv("RATE_USER_TPM", "20000"))
+RATE_SESSION_TPM = int(os.getenv("RATE_SESSION_TPM", "10000"))
+# Shed new generations once the expected wait for the model passes this many seconds.
+SHED_WAIT_SECONDS = float(os.getenv("SHED_WAIT_SECONDS", "30"))
+
+# Checks (and, when every bucket allows it, charges) several token buckets atomically.
+# KEYS: bucket keys. ARGV[1]: now in ms, ARGV[2]: 1 to charge unconditionally (post-hoc debit),
+# then per key: capacity, refill per ms, cost, minimum balance required to pass.
+# Returns {allowed, retry_after_ms}.
+TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local force = tonumber(ARGV[2]) == 1
+local balances = {}
+local retry = 0
+for i = 1, #KEYS do
+  local base = 2 + (i - 1) * 4
+  local capacity = tonumber(ARGV[base + 1])
+  local rate = tonumber(ARGV[base + 2])
+  local cost = tonumber(ARGV[base + 3])
+  local need = tonumber(ARGV[base + 4])
+  local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local tokens = tonumber(data[1]) or capacity
+  local ts = tonumber(data[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+  balances[i] = tokens
+  local required = math.max(cost, need)
+  if not force and tokens < required then
+    retry = math.max(retry, math.ceil((required - tokens) / rate))
+  end
+end
+local allowed = 0
+if retry == 0 then allowed = 1 end
+for i = 1, #KEYS do
+  local base = 2 + (i - 1) * 4
+  local capacity = tonumber(ARGV[base + 1])
+  local rate = tonumber(ARGV[base + 2])
+  local tokens = balances[i]
+  if allowed == 1 then tokens = tokens - tonumber(ARGV[base + 3]) end
+  redis.call('HSET', KEYS[i], 'tokens', tostring(tokens), 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], math.ceil((capacity - tokens) / rate) + 1000)
+end
+return {allowed, retry}
+"""
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is over its rate limit (429) or the server is shedding load (503).
+    """
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Redis-backed admission control for chat:
+    - token buckets for requests/minute and generated tokens/minute, per user and per session,
+      checked in a single Lua round trip;
+    - global load shedding once the expected wait for the model passes SHED_WAIT_SECONDS;
+    - per-user usage counters for the admin dashboard.
+    All keys live under "rl:" and "usage:", apart from the cache's keys (cache clears leave them alone).
+    Redis errors fail open: rate limiting must never take chat down.
+    """
+
+    def __init__(self, redis_client: redis.Redis):
+        self.redis_client = redis_client
+        self._bucket_script = redis_client.register_script(TOKEN_BUCKET_LUA)
+
+    @staticmethod
+    def _bucket(key: str, per_minute: int, cost: float, need: float = 0) -> Tuple[str, list]:
+        return key, [per_minute, per_minute / 60000.0, cost, need]
+
+    def _run(self, buckets: List[Tuple[str, list]], force: bool, usage_user: Optional[UUID] = None, **usage) -> Tuple[int, int]:
+        keys = [key for key, _ in buckets]
+        args = [int(time.time() * 1000), 1 if force else 0]
+        for _, bucket_args in buckets:
+            args.extend(bucket_args)
+        pipe = self.redis_client.pipeline(transaction=False)
+        self._bucket_script(keys=keys, args=args, client=pipe)
+        if usage_user is not None:
+            for field, amount in usage.items():
+                if amount:
+                    pipe.hincrby(f"usage:user:{usage_user}", field, amount)
+            # Adding 0 still registers the user in the ranking used by usage().
+            pipe.zincrby("usage:tokens", usage.get("tokens", 0), str(usage_user))
+        allowed, retry_ms = pipe.execute()[0]
+        return int(allowed), int(retry_ms)
+
+    def admit(self, user_id: UUID, session_id: UUID) -> None:
+        """
+        Charge one request to the user and session request buckets, and require that neither
+        token bucket is exhausted. Raises AdmissionRejected (429) when over budget.
+        """
+        buckets = [
+            self._bucket(f"rl:req:user:{user_id}", RATE_USER_RPM, 1),
+            self._bucket(f"rl:req:session:{session_id}", RATE_SESSION_RPM, 1),
+            # Token usage is only known after generation: here we just require a positive balance.
+            self._bucket(f"rl:tok:user:{user_id}", RATE_USER_TPM, 0, 1),
+            self._bucket(f"rl:tok:session:{session_id}", RATE_SESSION_TPM, 0, 1),
+        ]
+        try:
+            allowed, retry_ms = self._run(buckets, force=False, usage_user=user_id, requests=1)
+        except redis.RedisError as e:
+            print(f"Admission control unavailable, allowing request: {e}")
+            return
+        if not allowed:
+            try:
+                self.redis_client.hincrby(f"usage:user:{user_id}", "rejected", 1)
+            except redis.RedisError:
+                pass
+            raise AdmissionRejected(429, "Rate limit exceeded", max(1, math.ceil(retry_ms / 1000)))
+
+    def check_load(self, expected_wait_seconds: float) -> None:
+        """
+        Shed a new generation (503) while the model queue is too long to serve it in time.
+        """
+        if expected_wait_seconds > SHED_WAIT_SECONDS:
+            raise AdmissionRejected(
+                503,
+                "Server is busy, please retry later",
+                max(1, math.ceil(expected_wait_seconds - SHED_WAIT_SECONDS)),
+            )
+
+    def record_generation(self, user_id: UUID, session_id: UUID, tokens: int) -> None:
+        """
+        Debit generated tokens from the user and session token buckets (balances may go negative,
+        which blocks the next request until they refill) and update usage counters.
+        """
+        buckets = [
+            self._bucket(f"rl:tok:user:{user_id}", RATE_USER_TPM, tokens),
+            self._bucket(f"rl:tok:session:{session_id}", RATE_SESSION_TPM, tokens),
+        ]
+        try:
+            self._run(buckets, force=True, usage_user=user_id, tokens=tokens, generations=1)
+        except redis.RedisError as e:
+            print(f"Failed to record token usage: {e}")
+
+    def record_cache_hit(self, user_id: UUID) -> None:
+        try:
+            self.redis_client.hincrby(f"usage:user:{user_id}", "cache_hits", 1)
+        except redis.RedisError:
+            pass
+
+    def usage(self, limit: int = 50) -> List[dict]:
+        """
+        Per-user usage counters, heaviest token users first.
+        """
+        top = self.redis_client.zrevrange("usage:tokens", 0, limit - 1)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id in top:
+            pipe.hgetall(f"usage:user:{user_id}")
+        result = []
+        for user_id, counters in zip(top, pipe.execute()):
+            result.append({
+                "user_id": user_id,
+                "requests": int(counters.get("requests", 0)),
+                "generations": int(counters.get("generations", 0)),
+                "cache_hits": int(counters.get("cache_hits", 0)),
+                "tokens": int(counters.get("tokens", 0)),
+                "rejected": int(counters.get("rejected", 0)),
+            })
+        return result
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .content_store import intern_body
+from .database import MaintenanceSessionLocal
+from .embeddings import embedding_store
+from .migrations import ensure_partitions
+from .session_activity import refresh_sessions
+
+# Sessions without any activity for this many days are moved to the cold store.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH_SESSIONS = int(os.getenv("ARCHIVE_BATCH_SESSIONS", "50"))
+
+
+def _serialize(messages: List[models.Message]) -> bytes:
+    # Content is resolved so the archive does not keep response bodies alive; it is
+    # re-interned on rehydration.
+    return json.dumps([
+        {
+            "id": str(m.id),
+            "role": m.role,
+            "content": m.content,
+            "rating": m.rating,
+            "pinned": bool(m.pinned),
+            "created_at": m.created_at.isoformat(),
+        }
+        for m in messages
+    ]).encode("utf-8")
+
+
+def archive_session(db: Session, session_id: UUID, cutoff: datetime) -> int:
+    """
+    Move a session's messages into archived_sessions if it has been idle since `cutoff`.
+    Returns the number of messages archived (0 if it became active again or was already archived).
+    """
+    session = (
+        db.query(models.Session)
+        .filter(models.Session.id == session_id)
+        .with_for_update()
+        .first()
+    )
+    if session is None or session.archived_at is not None:
+        db.rollback()
+        return 0
+    messages = (
+        db.query(models.Message)
+        .filter(models.Message.session_id == session_id)
+        .order_by(models.Message.created_at.asc())
+        .all()
+    )
+    if not messages or messages[-1].created_at >= cutoff:
+        db.rollback()
+        return 0
+
+    raw = _serialize(messages)
+    db.add(models.ArchivedSession(
+        session_id=session_id,
+        payload=zlib.compress(raw, 6),
+        message_count=len(messages),
+        raw_bytes=len(raw),
+    ))
+    db.query(models.Message).filter(models.Message.session_id == session_id).delete(synchronize_session=False)
+    session.archived_at = datetime.utcnow()
+    db.commit()
+    embedding_store.forget_session(session_id)
+    return len(messages)
+
+
+def rehydrate_session(db: Session, session: models.Session) -> bool:
+    """
+    Move an archived session's messages back into messages. Safe to call concurrently:
+    the archive row is locked and only the first caller restores it.
+    """
+    archived = (
+        db.query(models.ArchivedSession)
+        .filter(models.ArchivedSession.session_id == session.id)
+        .with_for_update()
+        .first()
+    )
+    if archived is None:
+        db.rollback()
+        db.refresh(session)
+        return False
+
+    rows = []
+    for m in json.loads(zlib.decompress(archived.payload)):
+        row = {
+            "id": UUID(m["id"]),
+            "session_id": session.id,
+            "role": m["role"],
+            "rating": m["rating"],
+            "pinned": m["pinned"],
+            "created_at": datetime.fromisoformat(m["created_at"]),
+        }
+        if m["role"] == "assistant" and m["content"] is not None:
+            row["body_hash"] = intern_body(db, m["content"])
+        else:
+            row["inline_content"] = m["content"]
+        rows.append(row)
+    db.bulk_insert_mappings(models.Message, rows)
+    db.delete(archived)
+    db.flush()
+    # Counters are kept while archived; recomputing also covers sessions archived before they existed.
+    refresh_sessions(db, [session.id])
+    session.archived_at = None
+    # Opening the session is activity: without this it would look idle (last message long ago)
+    # and be archived again on the next run.
+    session.last_activity_at = func.current_timestamp()
+    db.commit()
+    archive_worker.stats["rehydrated_sessions"] += 1
+    return True
+
+
+class ArchiveWorker:
+    """
+    Background worker that keeps upcoming messages partitions created and moves sessions idle
+    for ARCHIVE_AFTER_DAYS to the cold store, keeping the hot partitions and their indexes small.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"archived_sessions": 0, "archived_messages": 0, "rehydrated_sessions": 0}
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="archive-worker", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                ensure_partitions()
+                while self.run_once() == ARCHIVE_BATCH_SESSIONS:
+                    pass
+            except Exception as e:
+                print(f"Archive worker error: {e}")
+            self._stop.wait(ARCHIVE_INTERVAL_SECONDS)
+
+    def run_once(self, limit: int = ARCHIVE_BATCH_SESSIONS) -> int:
+        """
+        Archive up to `limit` idle sessions. Returns how many were archived.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+        db = MaintenanceSessionLocal()
+        try:
+            archived = 0
+            for session_id in self.find_candidates(db, cutoff, limit):
+                count = archive_session(db, session_id, cutoff)
+                if count:
+                    archived += 1
+                    self.stats["archived_sessions"] += 1
+                    self.stats["archived_messages"] += count
+            return archived
+        finally:
+            db.close()
+
+    @staticmethod
+    def find_candidates(db: Session, cutoff: datetime, limit: int) -> List[UUID]:
+        """
+        Hot sessions with messages and no activity since the cutoff. Reads the activity summary
+        on sessions (kept up to date with message writes), not the messages themselves.
+        """
+        rows = (
+            db.query(models.Session.id)
+            .filter(
+                models.Session.archived_at.is_(None),
+                models.Session.message_count > 0,
+                models.Session.last_activity_at < cutoff,
+            )
+            .order_by(models.Session.last_activity_at.asc())
+            .limit(limit)
+            .all()
+        )
+        return [row[0] for row in rows]
+
+
+archive_worker = ArchiveWorker()
@@ -1,23 +1,114 @@
 import bcrypt
 import jwt
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Deque, Dict, Optional, Tuple
 import os
 
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
 # 获取环境变量，如果不存在则使用默认值（开发环境）
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 TOKEN_EXPIRE_HOURS = 24
 
+# bcrypt 放到独立的进程池里，登录高峰最多占用 BCRYPT_WORKERS 个核，不抢推理线程的 CPU
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+# Hashes allowed to wait for a worker; beyond that callers get 503 instead of queueing forever.
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", str(BCRYPT_WORKERS * 8)))
+BCRYPT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("BCRYPT_QUEUE_TIMEOUT_SECONDS", "5"))
+# 每个 IP / 邮箱在窗口内允许的注册+登录次数
+AUTH_MAX_ATTEMPTS = int(os.getenv("AUTH_MAX_ATTEMPTS", "10"))
+AUTH_WINDOW_SECONDS = int(os.getenv("AUTH_WINDOW_SECONDS", "60"))
+# 已解码 token 的 LRU 缓存大小
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class AuthBusyError(Exception):
+    """bcrypt 进程池排队已满"""
+
+
+def _bcrypt_hash(password: bytes) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt())
+
+
+def _bcrypt_check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(BCRYPT_MAX_PENDING)
+
+
+def _run_in_pool(fn, *args):
+    """在 bcrypt 进程池中执行并等待结果"""
+    global _pool
+    if not _pending.acquire(timeout=BCRYPT_QUEUE_TIMEOUT_SECONDS):
+        raise AuthBusyError("Too many concurrent password operations")
+    try:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: never fork a process that already runs model loader/inference threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=BCRYPT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+        return _pool.submit(fn, *args).result()
+    finally:
+        _pending.release()
+
+
 def hash_password(password: str) -> str:
     """用 bcrypt 哈希密码"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode(), salt)
-    return hashed.decode()
+    return _run_in_pool(_bcrypt_hash, password.encode()).decode()
+
 
 def verify_password(password: str, hashed: str) -> bool:
     """验证密码是否匹配"""
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+    return _run_in_pool(_bcrypt_check, password.encode(), hashed.encode())
+
+
+class AttemptThrottle:
+    """
+    按 key（IP 或邮箱）统计滑动窗口内的尝试次数。
+    """
+
+    def __init__(self, max_attempts: int, window_seconds: int):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self._attempts: Dict[str, Deque[float]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def hit(self, *keys: str) -> Optional[int]:
+        """记录一次尝试；超限时返回需要等待的秒数（此次不计数），否则返回 None"""
+        now = time.time()
+        with self._lock:
+            windows = []
+            for key in keys:
+                window = self._attempts[key]
+                while window and window[0] <= now - self.window_seconds:
+                    window.popleft()
+                if len(window) >= self.max_attempts:
+                    return int(window[0] + self.window_seconds - now) + 1
+                windows.append(window)
+            for window in windows:
+                window.append(now)
+            if len(self._attempts) > 10 * TOKEN_CACHE_SIZE:
+                # Drop keys whose whole window has expired so memory stays bounded.
+                for key in [k for k, w in self._attempts.items() if not w or w[-1] <= now - self.window_seconds]:
+                    del self._attempts[key]
+        return None
+
+
+auth_throttle = AttemptThrottle(AUTH_MAX_ATTEMPTS, AUTH_WINDOW_SECONDS)
+
 
 def create_token(user_id: str) -> str:
     """创建 JWT token"""
@@ -29,13 +120,60 @@ def create_token(user_id: str) -> str:
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
+
+# token -> (user_id, exp timestamp)
+_token_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
 def verify_token(token: str) -> Optional[str]:
-    """验证 JWT token，返回 user_id 或 None"""
+    """验证 JWT token，返回 user_id 或 None（已解码的 token 走 LRU 缓存，过期后失效）"""
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+        if cached is not None:
+            if cached[1] > now:
+                _token_cache.move_to_end(token)
+                return cached[0]
+            del _token_cache[token]
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("user_id")
-        return user_id
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+
+    if user_id is not None and "exp" in payload:
+        with _token_cache_lock:
+            _token_cache[token] = (user_id, float(payload["exp"]))
+            if len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return user_id
+
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def get_current_user_id(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> uuid.UUID:
+    """FastAPI 依赖：校验 Authorization: Bearer <token>，返回当前用户 ID"""
+    if credentials is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user_id = verify_token(credentials.credentials)
+    if user_id is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        return uuid.UUID(user_id)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid token subject")
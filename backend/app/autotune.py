@@ -0,0 +1,210 @@
+"""
+Autotuner for llama.cpp runtime parameters.
+
+Benchmarks prompt-eval and decode throughput over a grid of n_threads / n_batch on this machine
+and stores the best config in AUTOTUNE_FILE, keyed by CPU model and model file. ModelManager
+picks the stored config up automatically when loading.
+
+Usage (from the backend directory):
+    python -m app.autotune --model /app/models/qwen2.5-1.5b-instruct-q4_k_m.gguf
+    python -m app.autotune --threads 2,4,6,8 --batches 128,256,512
+"""
+import argparse
+import json
+import os
+import platform
+import threading
+import time
+from typing import Dict, List, Optional
+
+from llama_cpp import Llama
+
+# off: ignore stored configs | use: apply a stored config if present |
+# startup: like use, and benchmark at model load when no config is stored for this host/model yet
+AUTOTUNE = os.getenv("AUTOTUNE", "use")
+AUTOTUNE_FILE = os.getenv(
+    "AUTOTUNE_FILE",
+    os.path.join(os.getenv("MODELS_DIR", "/app/models"), ".autotune.json"),
+)
+# A typical chat turn: cost = prompt tokens / prompt-eval rate + reply tokens / decode rate.
+# The prompt is longer than the largest n_batch in the default grid, so batch sizes differ in
+# how many chunks it is evaluated in.
+BENCH_PROMPT_TOKENS = 1024
+BENCH_DECODE_TOKENS = 64
+BENCH_N_CTX = 2048
+DEFAULT_BATCH_GRID = [128, 256, 512]
+
+_file_lock = threading.Lock()
+
+
+def cpu_model() -> str:
+    """
+    Human-readable CPU identifier plus logical core count, e.g. 'AMD EPYC 7B13 x8'.
+    """
+    name = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{name} x{os.cpu_count()}"
+
+
+def config_key(model_path: str) -> str:
+    """
+    Stored configs are only valid for the same CPU and the same model file (name and size).
+    """
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    return f"{cpu_model()}|{os.path.basename(model_path)}|{size}"
+
+
+def _read_configs() -> Dict[str, dict]:
+    try:
+        with open(AUTOTUNE_FILE) as f:
+            configs = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return configs if isinstance(configs, dict) else {}
+
+
+def load_config(model_path: str) -> Optional[dict]:
+    """
+    Return the stored {"n_threads", "n_batch", ...} for this host and model, or None.
+    """
+    if AUTOTUNE == "off":
+        return None
+    return _read_configs().get(config_key(model_path))
+
+
+def save_config(model_path: str, config: dict) -> None:
+    """
+    Store a config for this host and model. Raises OSError if AUTOTUNE_FILE is not writable.
+    """
+    with _file_lock:
+        configs = _read_configs()
+        configs[config_key(model_path)] = config
+        tmp_path = f"{AUTOTUNE_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(configs, f, indent=2)
+        os.replace(tmp_path, AUTOTUNE_FILE)
+
+
+def default_thread_grid() -> List[int]:
+    cores = os.cpu_count() or 4
+    grid = {1, 2, 4, cores, max(cores // 2, 1)}
+    grid.update(range(6, cores, 2))
+    return sorted(t for t in grid if t <= cores)
+
+
+def benchmark(model_path: str, n_threads: int, n_batch: int) -> dict:
+    """
+    Measure prompt-eval and decode tokens/s for one parameter combination.
+    """
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=BENCH_N_CTX,
+        n_threads=n_threads,
+        n_threads_batch=n_threads,
+        n_batch=n_batch,
+        verbose=False,
+    )
+    try:
+        text = "The quick brown fox jumps over the lazy dog. " * BENCH_PROMPT_TOKENS
+        prompt = llm.tokenize(text.encode())[:BENCH_PROMPT_TOKENS]
+
+        start = time.perf_counter()
+        llm.eval(prompt)
+        prompt_seconds = time.perf_counter() - start
+
+        # Decode one token at a time, as generation does.
+        token = prompt[-1]
+        start = time.perf_counter()
+        for _ in range(BENCH_DECODE_TOKENS):
+            llm.eval([token])
+        decode_seconds = time.perf_counter() - start
+    finally:
+        llm.close()
+
+    return {
+        "n_threads": n_threads,
+        "n_batch": n_batch,
+        "prompt_tokens_per_second": BENCH_PROMPT_TOKENS / prompt_seconds,
+        "decode_tokens_per_second": BENCH_DECODE_TOKENS / decode_seconds,
+        # Seconds for a typical turn; lower is better.
+        "turn_seconds": prompt_seconds + decode_seconds,
+    }
+
+
+def best_config(results: List[dict]) -> dict:
+    """
+    The config to store: the benchmarked combination with the fastest typical turn.
+    """
+    best = min(results, key=lambda r: r["turn_seconds"])
+    return {
+        "n_threads": best["n_threads"],
+        "n_batch": best["n_batch"],
+        "prompt_tokens_per_second": round(best["prompt_tokens_per_second"], 1),
+        "decode_tokens_per_second": round(best["decode_tokens_per_second"], 1),
+        "cpu": cpu_model(),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def autotune(model_path: str, threads: Optional[List[int]] = None, batches: Optional[List[int]] = None) -> dict:
+    """
+    Benchmark the grid, persist the best config for this host and model, and return it.
+    Combinations that fail to run are skipped; raises RuntimeError if none ran. A config that
+    cannot be saved is still returned.
+    """
+    threads = threads or default_thread_grid()
+    batches = batches or DEFAULT_BATCH_GRID
+    results = []
+    for n_threads in threads:
+        for n_batch in batches:
+            try:
+                result = benchmark(model_path, n_threads, n_batch)
+            except Exception as e:
+                print(f"autotune n_threads={n_threads} n_batch={n_batch} failed: {e}")
+                continue
+            print(
+                f"autotune n_threads={n_threads:<3} n_batch={n_batch:<5} "
+                f"prompt {result['prompt_tokens_per_second']:8.1f} tok/s  "
+                f"decode {result['decode_tokens_per_second']:6.1f} tok/s"
+            )
+            results.append(result)
+
+    if not results:
+        raise RuntimeError("no n_threads / n_batch combination could be benchmarked")
+
+    config = best_config(results)
+    try:
+        save_config(model_path, config)
+        print(f"autotune best: n_threads={config['n_threads']} n_batch={config['n_batch']} (saved to {AUTOTUNE_FILE})")
+    except OSError as e:
+        print(f"autotune best: n_threads={config['n_threads']} n_batch={config['n_batch']} (not saved: {e})")
+    return config
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    from .llm import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--threads", type=_int_list, default=None, help="comma-separated n_threads grid")
+    parser.add_argument("--batches", type=_int_list, default=None, help="comma-separated n_batch grid")
+    args = parser.parse_args()
+    autotune(args.model, args.threads, args.batches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+
+from . import models
+from .cache import CacheService
+from .database import SessionLocal
+from .llm import model_registry, ModelNotReadyError
+from .prefix_cache import system_messages
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+# How long the worker sleeps when the queue is empty (new jobs wake it up immediately).
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "5"))
+BATCH_TEMPERATURE = 0.2
+
+cache_service = CacheService()
+
+
+class BatchInputError(ValueError):
+    """
+    Raised when a submitted NDJSON body cannot be turned into batch items.
+    """
+
+
+def parse_ndjson(body: bytes) -> List[dict]:
+    """
+    Parse one JSON object per line: {"prompt": "...", "custom_id": "optional"}.
+    Blank lines are skipped.
+    """
+    items = []
+    for line_no, line in enumerate(body.decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            raise BatchInputError(f"Line {line_no}: invalid JSON ({e})")
+        if not isinstance(obj, dict) or not isinstance(obj.get("prompt"), str) or not obj["prompt"].strip():
+            raise BatchInputError(f"Line {line_no}: expected an object with a non-empty 'prompt'")
+        custom_id = obj.get("custom_id")
+        items.append({"prompt": obj["prompt"], "custom_id": str(custom_id) if custom_id is not None else None})
+    if not items:
+        raise BatchInputError("No prompts submitted")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchInputError(f"Too many prompts ({len(items)} > {BATCH_MAX_ITEMS})")
+    return items
+
+
+def job_progress(job: models.BatchJob) -> dict:
+    """
+    Throughput and ETA derived from the job counters.
+    """
+    done = job.completed_items + job.failed_items
+    remaining = job.total_items - done
+    items_per_second = 0.0
+    tokens_per_second = 0.0
+    eta_seconds: Optional[float] = None
+    if job.started_at is not None:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+        if elapsed > 0:
+            items_per_second = done / elapsed
+            tokens_per_second = job.tokens_generated / elapsed
+    if remaining == 0:
+        eta_seconds = 0.0
+    elif items_per_second > 0 and job.status in ("queued", "running"):
+        eta_seconds = remaining / items_per_second
+    return {
+        "items_per_second": items_per_second,
+        "tokens_per_second": tokens_per_second,
+        "eta_seconds": eta_seconds,
+    }
+
+
+class BatchWorker:
+    """
+    Drains batch items one at a time in job submission order.
+    Generation only starts while no interactive chat request wants the model, and is
+    abandoned (the item stays pending) as soon as one arrives, so chat latency is unaffected.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        # Item whose generation was preempted; its cache lookup is not counted again on retry.
+        self._retry_item_id: Optional[int] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="batch-worker", daemon=True)
+        self._thread.start()
+
+    def notify(self) -> None:
+        """
+        Wake the worker up after a job has been submitted.
+        """
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                processed = self.process_next()
+            except Exception as e:
+                print(f"Batch worker error: {e}")
+                processed = False
+            if not processed:
+                self._wakeup.wait(BATCH_POLL_SECONDS)
+                self._wakeup.clear()
+
+    def process_next(self) -> bool:
+        """
+        Process the oldest pending item. Returns False when the queue is empty.
+        """
+        db = SessionLocal()
+        try:
+            item = (
+                db.query(models.BatchItem)
+                .join(models.BatchJob, models.BatchJob.id == models.BatchItem.job_id)
+                .filter(
+                    models.BatchJob.status.in_(["queued", "running"]),
+                    models.BatchItem.status == "pending",
+                )
+                .order_by(models.BatchJob.created_at.asc(), models.BatchItem.idx.asc())
+                .first()
+            )
+            if item is None:
+                return False
+            job = item.job
+            if job.status == "queued":
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                db.commit()
+
+            # Context-free prompts go to the global cache tier; entries are shared by items of
+            # any batch with the same model, max_tokens and prompt.
+            messages = system_messages() + [{"role": "user", "content": item.prompt}]
+            params = {"max_tokens": job.max_tokens, "temperature": BATCH_TEMPERATURE}
+            retry = item.id == self._retry_item_id
+            self._retry_item_id = None
+            cached = cache_service.get(job.model, messages, params, record_stats=not retry)
+            if cached is not None:
+                item.result = cached
+                item.cached = True
+                job.cached_items += 1
+            else:
+                try:
+                    generated = model_registry.generate_background(
+                        messages,
+                        max_tokens=job.max_tokens,
+                        name=job.model,
+                        temperature=BATCH_TEMPERATURE,
+                    )
+                    result, tokens = generated if generated is not None else (None, 0)
+                except ModelNotReadyError:
+                    # Model still loading (or missing): keep the queue intact and back off.
+                    db.rollback()
+                    return False
+                except Exception as e:
+                    # Unknown model, prompt longer than the context window, ...: fail this item
+                    # only, so the queue moves on.
+                    result, tokens = None, 0
+                    item.error = str(e) or type(e).__name__
+                if result is None and item.error is None:
+                    # Preempted by interactive traffic: leave the item pending and retry later.
+                    self._retry_item_id = item.id
+                    db.rollback()
+                    return True
+                if result is not None:
+                    item.result = result
+                    item.tokens = tokens
+                    job.tokens_generated += tokens
+                    cache_service.set(job.model, messages, params, result)
+
+            item.completed_at = datetime.utcnow()
+            if item.error is not None:
+                item.status = "failed"
+                job.failed_items += 1
+            else:
+                item.status = "done"
+                job.completed_items += 1
+            if job.completed_items + job.failed_items >= job.total_items:
+                job.status = "completed"
+                job.finished_at = datetime.utcnow()
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+batch_worker = BatchWorker()
+
+
+def create_job(db, user_id: UUID, model: str, max_tokens: int, items: List[dict]) -> models.BatchJob:
+    """
+    Persist a job and its items in one transaction, then wake the worker.
+    """
+    job = models.BatchJob(
+        user_id=user_id,
+        model=model,
+        max_tokens=max_tokens,
+        status="queued",
+        total_items=len(items),
+    )
+    db.add(job)
+    db.flush()
+    db.bulk_insert_mappings(
+        models.BatchItem,
+        [
+            {"job_id": job.id, "idx": idx, "custom_id": item["custom_id"], "prompt": item["prompt"], "status": "pending"}
+            for idx, item in enumerate(items)
+        ],
+    )
+    db.commit()
+    db.refresh(job)
+    batch_worker.notify()
+    return job
@@ -1,8 +1,42 @@
 import redis 
 import os
+import json
 import hashlib
 from uuid import UUID
-from typing import Optional
+from typing import Dict, List, Optional
+
+from .prefix_cache import system_messages
+
+# Cache tiers: "global" entries are shared by every session and user and hold answers to
+# context-free prompts (nothing but the prompt itself); "session" entries depend on history
+# and stay scoped to their session.
+GLOBAL_TIER = "global"
+SESSION_TIER = "session"
+CACHE_TIERS = (GLOBAL_TIER, SESSION_TIER)
+GLOBAL_KEY_PREFIX = f"cache:{GLOBAL_TIER}:"
+# Per-tier hit/miss counters (hash fields "<tier>:hits" / "<tier>:misses").
+CACHE_STATS_KEY = "cache:stats"
+# Global-tier keys ranked by hit count (mirrors their hits:<key> counters), and per entry the
+# request it answers ("recipe:<key>", expiring with the entry), so popular entries can be
+# re-created after a flush; see cache_warming.py. Session-tier entries hold private history and
+# are never ranked, recorded or snapshotted.
+POPULAR_KEY = "cache:popular"
+# Set once the cache has been warmed; if it is missing, Redis was flushed or restarted.
+WARM_MARKER_KEY = "cache:warm:marker"
+# Everything the cache owns. The same Redis DB also holds admission state ("rl:*", "usage:*"),
+# so clearing the cache deletes by prefix instead of flushing the DB.
+CACHE_KEY_PATTERNS = ("cache:*", "hits:cache:*", "recipe:cache:*")
+
+
+def cache_tier(messages: List[dict]) -> str:
+    """
+    A prompt is context-free when the effective context is just the user prompt
+    (after the configured system prompt, which every chat prompt starts with).
+    """
+    prefix = system_messages()
+    context_free = len(messages) == len(prefix) + 1 and messages[:len(prefix)] == prefix
+    return GLOBAL_TIER if context_free else SESSION_TIER
+
 
 class CacheService:
     def __init__(self):
@@ -11,41 +45,160 @@ class CacheService:
         self.redis_client = redis.from_url(redis_url, decode_responses=True)
         self.default_ttl = 3600 # Cache time to live in second = 1 hour
     
-    def _generate_key(self, session_id: UUID, prompt: str) -> str:
+    def _generate_key(self, model: str, messages: List[dict], params: dict, session_id: Optional[UUID] = None) -> str:
         """ 
-        Generate a unique cache key base on parameter via a hash to ensure key length is manageable
+        Generate a cache key from a hash of the effective context: the model, the generation
+        parameters and the exact message list sent to the model (as built by
+        context.build_messages: system prompt, rolling summary or retrieved turns, history, prompt).
+        Any change in history therefore produces a new key, so a repeated prompt is only
+        answered from cache when the conversation around it is the same.
+        Session-tier keys also include the session id; global-tier keys do not.
         """
-        raw_key = f"{str(session_id)}:{prompt.strip()}"
-        return f"cache:{hashlib.sha256(raw_key.encode()).hexdigest()}"
+        tier = cache_tier(messages)
+        context = {
+            "model": model,
+            "params": params,
+            "messages": [
+                {"role": m["role"], "content": m["content"].strip() if m["role"] == "user" else m["content"]}
+                for m in messages
+            ],
+        }
+        if tier == SESSION_TIER:
+            context["session_id"] = str(session_id)
+        raw_key = json.dumps(context, sort_keys=True, ensure_ascii=False)
+        return f"cache:{tier}:{hashlib.sha256(raw_key.encode()).hexdigest()}"
 
     def increment_hits(self, key: str) -> None:
         """
         Increamet a hit counter for analytics, stored in a separate key hits:<cache_key>
         """
         hit_key = f"hits:{key}"
-        self.redis_client.incr(hit_key)
+        pipe = self.redis_client.pipeline()
+        pipe.incr(hit_key)
+        if key.startswith(GLOBAL_KEY_PREFIX):
+            pipe.zincrby(POPULAR_KEY, 1, key)
+        pipe.execute()
 
-    def get(self, session_id: UUID, prompt: str) -> Optional[str]:
+    def get(
+        self,
+        model: str,
+        messages: List[dict],
+        params: dict,
+        session_id: Optional[UUID] = None,
+        record_stats: bool = True,
+    ) -> Optional[str]:
         """
-        Retrieve a value from cache if it exists
+        Retrieve a value from cache if it exists, and count a hit or miss for its tier
+        (unless record_stats is False, e.g. when repeating a lookup already counted).
         """
-        key = self._generate_key(session_id, prompt)
+        key = self._generate_key(model, messages, params, session_id)
+        tier = cache_tier(messages)
         cached_value = self.redis_client.get(key)
+        if not record_stats:
+            return cached_value or None
         if cached_value:
             self.increment_hits(key)
+            self.redis_client.hincrby(CACHE_STATS_KEY, f"{tier}:hits", 1)
             return cached_value
+        self.redis_client.hincrby(CACHE_STATS_KEY, f"{tier}:misses", 1)
         return None 
 
-    def set(self, session_id: UUID, prompt: str, value: str, ttl: int=None) -> bool:
+    def set(self, model: str, messages: List[dict], params: dict, value: str, session_id: Optional[UUID] = None, ttl: int=None) -> bool:
         """
-        Store a value in the cache with an expiration time
+        Store a value in the cache with an expiration time; global-tier entries also keep the
+        request they answer, for no longer than the entry itself.
         """
-        key = self._generate_key(session_id, prompt)
+        key = self._generate_key(model, messages, params, session_id)
         expiration = ttl if ttl is not None else self.default_ttl
-        return self.redis_client.set(key, value, ex=expiration)
+        pipe = self.redis_client.pipeline()
+        pipe.set(key, value, ex=expiration)
+        if key.startswith(GLOBAL_KEY_PREFIX):
+            recipe = {"model": model, "messages": messages, "params": params}
+            pipe.set(f"recipe:{key}", json.dumps(recipe, ensure_ascii=False), ex=expiration)
+        return pipe.execute()[0]
+
+    def top_entries(self, n: int) -> List[dict]:
+        """
+        The n most hit cache entries, most popular first: key, hits, cached value (None if it
+        expired) and recipe (None if unknown).
+        """
+        top = self.redis_client.zrevrange(POPULAR_KEY, 0, n - 1, withscores=True)
+        if not top:
+            return []
+        pipe = self.redis_client.pipeline()
+        for key, _ in top:
+            pipe.get(key)
+            pipe.get(f"recipe:{key}")
+        values = pipe.execute()
+        entries = []
+        for i, (key, hits) in enumerate(top):
+            recipe = values[2 * i + 1]
+            entries.append({
+                "key": key,
+                "hits": int(hits),
+                "value": values[2 * i],
+                "recipe": json.loads(recipe) if recipe else None,
+            })
+        return entries
+
+    def trim_popular(self, keep: int) -> None:
+        """
+        Drop all but the `keep` most popular keys from the ranking.
+        """
+        self.redis_client.zremrangebyrank(POPULAR_KEY, 0, -(keep + 1))
+
+    def exists(self, key: str) -> bool:
+        return bool(self.redis_client.exists(key))
+
+    def restore_entry(self, entry: dict, value: str) -> None:
+        """
+        Write a warmed entry back under its key, with its recipe and at least its previous hit count.
+        """
+        key = entry["key"]
+        pipe = self.redis_client.pipeline()
+        pipe.set(key, value, ex=self.default_ttl)
+        if entry.get("recipe"):
+            pipe.set(f"recipe:{key}", json.dumps(entry["recipe"], ensure_ascii=False), ex=self.default_ttl)
+        pipe.zadd(POPULAR_KEY, {key: entry.get("hits", 0)}, gt=True)
+        pipe.set(f"hits:{key}", entry.get("hits", 0), nx=True)
+        pipe.execute()
+
+    def is_warm(self) -> bool:
+        return self.exists(WARM_MARKER_KEY)
+
+    def mark_warm(self) -> None:
+        self.redis_client.set(WARM_MARKER_KEY, 1)
+
+    def tier_stats(self) -> Dict[str, dict]:
+        """
+        Hits, misses and hit rate per cache tier.
+        """
+        counters = self.redis_client.hgetall(CACHE_STATS_KEY)
+        stats = {}
+        for tier in CACHE_TIERS:
+            hits = int(counters.get(f"{tier}:hits", 0))
+            misses = int(counters.get(f"{tier}:misses", 0))
+            total = hits + misses
+            stats[tier] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / total if total > 0 else 0.0,
+            }
+        return stats
 
-    def clear_all(self):
+    def clear_all(self) -> int:
         """
-        Clear all keys in the current Redis database.
+        Delete every cache key (entries, hit counters, recipes, ranking, stats). Returns how many
+        keys were deleted.
         """
-        self.redis_client.flushdb()
+        deleted = 0
+        for pattern in CACHE_KEY_PATTERNS:
+            batch = []
+            for key in self.redis_client.scan_iter(match=pattern, count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    deleted += self.redis_client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += self.redis_client.unlink(*batch)
+        return deleted
@@ -0,0 +1,190 @@
+"""
+Cache warming for popular prompts.
+
+The warmer periodically writes the CACHE_WARM_TOP_N most hit global-tier cache entries (ranking, cached
+value and the request each one answers) to CACHE_WARM_FILE. When Redis comes back empty (startup,
+restart, flush) or an admin triggers it, the entries are restored most popular first: still-valid
+values are reloaded as they are, the rest are regenerated at low priority (only while no chat
+request wants the model).
+"""
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+from .cache import CacheService, GLOBAL_KEY_PREFIX
+from .llm import model_registry
+
+CACHE_WARMING = os.getenv("CACHE_WARMING", "1") == "1"
+CACHE_WARM_TOP_N = int(os.getenv("CACHE_WARM_TOP_N", "200"))
+CACHE_WARM_FILE = os.getenv(
+    "CACHE_WARM_FILE",
+    os.path.join(os.getenv("MODELS_DIR", "/app/models"), ".cache_warm.json"),
+)
+CACHE_WARM_INTERVAL_SECONDS = float(os.getenv("CACHE_WARM_INTERVAL_SECONDS", "300"))
+# The popularity ranking keeps this many times CACHE_WARM_TOP_N keys; the long tail is dropped.
+POPULAR_KEEP_FACTOR = 10
+
+
+class CacheWarmer:
+    """
+    Background worker that snapshots the popular cache entries and re-creates them after a flush.
+    """
+
+    def __init__(self, cache: CacheService):
+        self.cache = cache
+        self._thread: Optional[threading.Thread] = None
+        self._warm_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.last_snapshot_at: Optional[float] = None
+        self.progress = self._new_progress("idle", None, 0)
+
+    @staticmethod
+    def _new_progress(state: str, reason: Optional[str], total: int) -> dict:
+        return {
+            "state": state,  # idle | running | done | failed
+            "reason": reason,
+            "total": total,
+            "done": 0,
+            "reloaded": 0,
+            "regenerated": 0,
+            "skipped": 0,  # still cached
+            "failed": 0,
+            "started_at": time.time() if state == "running" else None,
+            "finished_at": None,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._warm_thread is not None and self._warm_thread.is_alive()
+
+    def start(self) -> None:
+        if not CACHE_WARMING or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        reason = "startup"
+        while not self._stop.is_set():
+            try:
+                if not self.cache.is_warm():
+                    self.trigger(reason)  # no-op while a run is in progress
+                elif not self.running:
+                    self.snapshot()
+            except Exception as e:
+                print(f"Cache warmer error: {e}")
+            reason = "flush"
+            self._stop.wait(CACHE_WARM_INTERVAL_SECONDS)
+
+    def snapshot(self) -> int:
+        """
+        Write the top CACHE_WARM_TOP_N entries to CACHE_WARM_FILE. Returns how many were written;
+        an empty ranking (right after a flush) leaves the previous snapshot in place.
+        """
+        entries = [
+            e for e in self.cache.top_entries(CACHE_WARM_TOP_N)
+            if e["key"].startswith(GLOBAL_KEY_PREFIX) and (e["value"] is not None or e["recipe"] is not None)
+        ]
+        if not entries:
+            return 0
+        self.cache.trim_popular(CACHE_WARM_TOP_N * POPULAR_KEEP_FACTOR)
+        directory = os.path.dirname(CACHE_WARM_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{CACHE_WARM_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"created_at": time.time(), "entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, CACHE_WARM_FILE)
+        self.last_snapshot_at = time.time()
+        return len(entries)
+
+    @staticmethod
+    def load_snapshot() -> List[dict]:
+        try:
+            with open(CACHE_WARM_FILE) as f:
+                entries = json.load(f).get("entries", [])
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read cache warm snapshot {CACHE_WARM_FILE}: {e}")
+            return []
+        entries = [e for e in entries if e.get("key", "").startswith(GLOBAL_KEY_PREFIX)]
+        return sorted(entries, key=lambda e: e.get("hits", 0), reverse=True)
+
+    def trigger(self, reason: str = "manual", reload: bool = True) -> bool:
+        """
+        Warm in a background thread. Returns False if warming is already running.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._warm_thread = threading.Thread(
+                target=self.warm, args=(reason, reload), name="cache-warm", daemon=True
+            )
+            self._warm_thread.start()
+            return True
+
+    def warm(self, reason: str, reload: bool = True) -> dict:
+        """
+        Restore the snapshot entries that are not cached, most popular first. With reload=False
+        (after an explicit clear) values are always regenerated instead of reloaded.
+        """
+        entries = self.load_snapshot()
+        self.progress = progress = self._new_progress("running", reason, len(entries))
+        try:
+            for entry in entries:
+                if self._stop.is_set():
+                    break
+                if self.cache.exists(entry["key"]):
+                    progress["skipped"] += 1
+                elif reload and entry.get("value") is not None:
+                    self.cache.restore_entry(entry, entry["value"])
+                    progress["reloaded"] += 1
+                else:
+                    value = self._regenerate(entry.get("recipe"))
+                    if value is None:
+                        progress["failed"] += 1
+                    else:
+                        self.cache.restore_entry(entry, value)
+                        progress["regenerated"] += 1
+                progress["done"] += 1
+            self.cache.mark_warm()
+            progress["state"] = "done"
+        except Exception as e:
+            print(f"Cache warming failed: {e}")
+            progress["state"] = "failed"
+        progress["finished_at"] = time.time()
+        print(
+            f"Cache warming ({reason}): {progress['reloaded']} reloaded, {progress['regenerated']} regenerated, "
+            f"{progress['skipped']} still cached, {progress['failed']} failed"
+        )
+        return progress
+
+    def _regenerate(self, recipe: Optional[dict]) -> Optional[str]:
+        if not recipe:
+            return None
+        params = recipe.get("params", {})
+        while not self._stop.is_set():
+            try:
+                generated = model_registry.generate_background(
+                    recipe["messages"],
+                    max_tokens=params.get("max_tokens", 512),
+                    name=recipe.get("model"),
+                    temperature=params.get("temperature", 0.2),
+                )
+            except Exception as e:
+                # Model not loaded, unknown model, prompt over the context window, ...: this
+                # entry fails, the run goes on with the next one.
+                print(f"Cannot regenerate cache entry: {e}")
+                return None
+            if generated is not None:
+                return generated[0]
+            # Preempted by chat traffic; retry once the model is idle again.
+            self._stop.wait(1.0)
+        return None
+
+
+cache_warmer = CacheWarmer(CacheService())
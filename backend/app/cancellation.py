@@ -0,0 +1,69 @@
+import time
+from typing import Callable, Optional
+
+# How often the client connection is polled during generation (polling hops to the event loop).
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class GenerationCancelled(Exception):
+    """
+    Raised when a generation is aborted because the client went away or its deadline passed.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason  # "timeout" | "disconnected"
+
+
+class CancelToken:
+    """
+    Per-request cancellation state, checked between tokens and while waiting for the model.
+    The deadline is checked on every call; the disconnect callback at most every
+    DISCONNECT_POLL_SECONDS.
+    """
+
+    def __init__(self, timeout_ms: Optional[int] = None, is_disconnected: Optional[Callable[[], bool]] = None):
+        self.deadline = time.time() + timeout_ms / 1000 if timeout_ms else None
+        self._is_disconnected = is_disconnected
+        self._next_poll = 0.0
+        self.reason: Optional[str] = None
+        self.tokens_generated = 0
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left until the deadline, or None without a deadline.
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0.0)
+
+    def cancelled(self) -> bool:
+        if self.reason is not None:
+            return True
+        now = time.time()
+        if self.deadline is not None and now >= self.deadline:
+            self.reason = "timeout"
+        elif self._is_disconnected is not None and now >= self._next_poll:
+            self._next_poll = now + DISCONNECT_POLL_SECONDS
+            try:
+                if self._is_disconnected():
+                    self.reason = "disconnected"
+            except Exception:
+                # Polling is best effort; the deadline still applies.
+                pass
+        return self.reason is not None
+
+    def check(self) -> None:
+        """
+        Raise GenerationCancelled if the request should stop.
+        """
+        if self.cancelled():
+            raise GenerationCancelled(self.reason)
+
+    def on_token(self) -> bool:
+        """
+        Count one generated token and report whether generation should stop
+        (the on_token callback of llm.stream_chat_completion).
+        """
+        self.tokens_generated += 1
+        return self.cancelled()
@@ -0,0 +1,267 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+from .llm import model_registry, ModelNotReadyError, N_CTX
+
+# Budgets are in model tokens. A session is compacted once the messages not covered by its
+# summary exceed COMPACTION_TRIGGER_TOKENS; the newest COMPACTION_KEEP_RECENT_TOKENS always stay
+# verbatim, so chat prompts keep summary + at most the trigger budget of history.
+COMPACTION_TRIGGER_TOKENS = int(os.getenv("COMPACTION_TRIGGER_TOKENS", str(N_CTX * 3 // 8)))
+COMPACTION_KEEP_RECENT_TOKENS = int(os.getenv("COMPACTION_KEEP_RECENT_TOKENS", str(N_CTX // 4)))
+COMPACTION_SUMMARY_TOKENS = int(os.getenv("COMPACTION_SUMMARY_TOKENS", "384"))
+# How much of one message the summarizer sees.
+COMPACTION_MAX_CHARS_PER_MESSAGE = int(os.getenv("COMPACTION_MAX_CHARS_PER_MESSAGE", "1200"))
+# Chat template tokens around each message, and slack for the template around the whole prompt.
+MESSAGE_OVERHEAD_TOKENS = 8
+PROMPT_MARGIN_TOKENS = 64
+COMPACTION_INTERVAL_SECONDS = float(os.getenv("COMPACTION_INTERVAL_SECONDS", "60"))
+# Only sessions with messages this recent are considered; idle sessions need no new summary.
+COMPACTION_ACTIVE_HOURS = int(os.getenv("COMPACTION_ACTIVE_HOURS", "24"))
+
+SUMMARIZER_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the previous summary and the new messages into one concise summary. Keep facts, "
+    "decisions, names, numbers, code identifiers and open questions; drop small talk. "
+    "Write plain prose, at most 250 words."
+)
+
+
+def summary_line(msg: models.Message) -> str:
+    """
+    One message as the summarizer sees it.
+    """
+    content = msg.content or ""
+    if len(content) > COMPACTION_MAX_CHARS_PER_MESSAGE:
+        content = content[:COMPACTION_MAX_CHARS_PER_MESSAGE] + " [...]"
+    return f"{msg.role.capitalize()}: {content}"
+
+
+def summarization_messages(previous_summary: Optional[str], lines: List[str]) -> List[dict]:
+    """
+    Prompt asking the model to fold a chunk of messages (see summary_line) into the previous summary.
+    """
+    body = (
+        f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+        "New messages:\n" + "\n".join(lines)
+    )
+    return [
+        {"role": "system", "content": SUMMARIZER_INSTRUCTIONS},
+        {"role": "user", "content": body},
+    ]
+
+
+def _count_tokens(llm, text: str) -> int:
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+
+def plan_chunk(llm, previous_summary: Optional[str], pending: List[models.Message]) -> List[tuple]:
+    """
+    Choose the oldest messages to fold into the summary, as (message, line) pairs, by token count:
+    nothing unless the pending messages exceed COMPACTION_TRIGGER_TOKENS; never the newest
+    COMPACTION_KEEP_RECENT_TOKENS; and only as many as fit in the summarization prompt next to the
+    instructions, the previous summary and COMPACTION_SUMMARY_TOKENS of output within N_CTX.
+    A single line too long for the prompt on its own is cut to fit.
+    """
+    sizes = [_count_tokens(llm, msg.content or "") + MESSAGE_OVERHEAD_TOKENS for msg in pending]
+    if sum(sizes) <= COMPACTION_TRIGGER_TOKENS:
+        return []
+    keep, recent_tokens = 0, 0
+    for size in reversed(sizes):
+        if recent_tokens + size > COMPACTION_KEEP_RECENT_TOKENS:
+            break
+        recent_tokens += size
+        keep += 1
+    older = pending[: len(pending) - keep]
+
+    fixed = sum(
+        _count_tokens(llm, m["content"]) + MESSAGE_OVERHEAD_TOKENS
+        for m in summarization_messages(previous_summary, [])
+    )
+    budget = N_CTX - COMPACTION_SUMMARY_TOKENS - PROMPT_MARGIN_TOKENS - fixed
+    chunk, used = [], 0
+    for msg in older:
+        line = summary_line(msg)
+        tokens = llm.tokenize(line.encode("utf-8"), add_bos=False, special=False)
+        size = len(tokens) + 1  # newline
+        if used + size > budget:
+            if chunk or budget - used <= 1:
+                break
+            line = llm.detokenize(tokens[: budget - used - 1]).decode("utf-8", errors="ignore") + " [...]"
+            size = budget - used
+        chunk.append((msg, line))
+        used += size
+    return chunk
+
+
+class CompactionWorker:
+    """
+    Background worker that keeps rolling summaries of long sessions up to date.
+    Summaries are generated at low priority (only while no chat request wants the model)
+    and stored in session_summaries; messages are never modified.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"compacted_sessions": 0, "summarized_messages": 0}
+        # Sessions left out until they get new messages (nothing to do, or compaction failed):
+        # session_id -> its last_message_at when it was set aside.
+        self._skipped: Dict[UUID, Optional[datetime]] = {}
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="compaction-worker", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                compacted = self.run_once()
+            except Exception as e:
+                print(f"Compaction worker error: {e}")
+                compacted = 0
+            if compacted == 0:
+                self._stop.wait(COMPACTION_INTERVAL_SECONDS)
+
+    def run_once(self, limit: int = 10) -> int:
+        """
+        Compact up to `limit` candidate sessions by one chunk each. Returns how many were compacted.
+        """
+        db = SessionLocal()
+        try:
+            self._prune_skipped(db)
+            compacted = 0
+            for session_id, last_message_at in self.find_candidates(db, limit, exclude=list(self._skipped)):
+                try:
+                    result = self.compact_session(db, session_id)
+                    if result:
+                        compacted += 1
+                    elif result is False:
+                        self._skipped[session_id] = last_message_at
+                except ModelNotReadyError:
+                    return compacted
+                except Exception as e:
+                    # One bad session must not stall the others: set it aside until it changes.
+                    db.rollback()
+                    print(f"Compaction of session {session_id} failed: {e}")
+                    self._skipped[session_id] = last_message_at
+            return compacted
+        finally:
+            db.close()
+
+    def _prune_skipped(self, db: Session) -> None:
+        """
+        Bring set-aside sessions back once they have new messages (or forget them once deleted).
+        """
+        if not self._skipped:
+            return
+        current = dict(
+            db.query(models.Session.id, models.Session.last_message_at)
+            .filter(models.Session.id.in_(list(self._skipped)))
+            .all()
+        )
+        self._skipped = {
+            session_id: at for session_id, at in self._skipped.items()
+            if session_id in current and current[session_id] == at
+        }
+
+    @staticmethod
+    def find_candidates(db: Session, limit: int, exclude: Optional[List[UUID]] = None) -> List[tuple]:
+        """
+        Recently active sessions whose unsummarized messages may exceed COMPACTION_TRIGGER_TOKENS,
+        as (session_id, last_message_at). A token takes at least one character, so characters
+        plus per-message overhead is a cheap upper bound; compact_session counts exactly.
+        """
+        cutoff = datetime.utcnow() - timedelta(hours=COMPACTION_ACTIVE_HOURS)
+        query = (
+            db.query(models.Message.session_id, models.Session.last_message_at)
+            .join(models.Session, models.Session.id == models.Message.session_id)
+            .outerjoin(models.ResponseBody, models.ResponseBody.hash == models.Message.body_hash)
+            .outerjoin(
+                models.SessionSummary,
+                models.SessionSummary.session_id == models.Message.session_id,
+            )
+            .filter(
+                models.Session.last_activity_at > cutoff,
+                or_(
+                    models.SessionSummary.summarized_until.is_(None),
+                    models.Message.created_at > models.SessionSummary.summarized_until,
+                ),
+            )
+        )
+        if exclude:
+            query = query.filter(models.Message.session_id.notin_(exclude))
+        rows = (
+            query.group_by(models.Message.session_id, models.Session.last_message_at)
+            .having(
+                func.sum(func.coalesce(
+                    func.length(func.coalesce(models.ResponseBody.content, models.Message.inline_content)), 0
+                ) + MESSAGE_OVERHEAD_TOKENS)
+                > COMPACTION_TRIGGER_TOKENS
+            )
+            .limit(limit)
+            .all()
+        )
+        return [(row[0], row[1]) for row in rows]
+
+    def compact_session(self, db: Session, session_id: UUID) -> Optional[bool]:
+        """
+        Fold the oldest unsummarized chunk (outside the recent window) into the session summary.
+        Returns True once compacted, False if there was nothing to do, and None if chat traffic
+        preempted the generation (try again later). Raises ModelNotReadyError if the model is not loaded.
+        """
+        summary = (
+            db.query(models.SessionSummary)
+            .filter(models.SessionSummary.session_id == session_id)
+            .first()
+        )
+        query = db.query(models.Message).filter(models.Message.session_id == session_id)
+        if summary is not None and summary.summarized_until is not None:
+            query = query.filter(models.Message.created_at > summary.summarized_until)
+        pending = query.order_by(models.Message.created_at.asc()).all()
+        previous = summary.summary if summary else None
+        with model_registry.acquire_background() as (_, llm):
+            planned = plan_chunk(llm, previous, pending)
+        # Messages written in one transaction share created_at; never split such a group,
+        # because the summary boundary is a timestamp.
+        if planned and len(planned) < len(pending):
+            boundary = planned[-1][0].created_at
+            if pending[len(planned)].created_at == boundary:
+                planned = [(m, line) for m, line in planned if m.created_at < boundary]
+        if not planned:
+            return False
+        chunk = [m for m, _ in planned]
+
+        generated = model_registry.generate_background(
+            summarization_messages(previous, [line for _, line in planned]),
+            max_tokens=COMPACTION_SUMMARY_TOKENS,
+            temperature=0.0,
+        )
+        if generated is None:
+            return None
+        text, _ = generated
+
+        if summary is None:
+            summary = models.SessionSummary(session_id=session_id, summarized_count=0)
+            db.add(summary)
+        summary.summary = text.strip()
+        summary.summarized_until = chunk[-1].created_at
+        summary.summarized_count = (summary.summarized_count or 0) + len(chunk)
+        summary.updated_at = datetime.utcnow()
+        db.commit()
+
+        self.stats["compacted_sessions"] += 1
+        self.stats["summarized_messages"] += len(chunk)
+        return True
+
+
+compaction_worker = CompactionWorker()
@@ -0,0 +1,94 @@
+"""
+Content-addressed storage for assistant responses.
+
+Each distinct response text is stored once in response_bodies, keyed by its SHA-256; assistant
+messages only carry the hash. Message.content resolves the body transparently, so API schemas
+are unchanged. Existing rows are deduplicated by migration 0001 (python -m app.migrations).
+
+Unreferenced bodies (after message deletion) are removed with:
+    python -m app.content_store --gc
+"""
+import argparse
+import hashlib
+from uuid import UUID
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import MaintenanceSessionLocal
+
+
+def content_hash(content: str) -> str:
+    """
+    SHA-256 hex digest of the UTF-8 text; matches encode(sha256(convert_to(content, 'UTF8')), 'hex').
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def intern_body(db: Session, content: str) -> str:
+    """
+    Make sure the body exists (concurrent writers of the same text are fine) and return its hash.
+    Runs in the caller's transaction and keeps the body row locked (FOR KEY SHARE) until it
+    commits, so collect_garbage cannot delete it before the referencing message is inserted.
+    """
+    digest = content_hash(content)
+    while True:
+        db.execute(
+            insert(models.ResponseBody)
+            .values(hash=digest, content=content)
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+        locked = db.execute(
+            select(models.ResponseBody.hash)
+            .where(models.ResponseBody.hash == digest)
+            .with_for_update(key_share=True)
+        ).first()
+        if locked is not None:
+            return digest
+        # Deleted by a concurrent garbage collection between the insert and the lock: insert again.
+
+
+def assistant_message(db: Session, session_id: UUID, content: str) -> models.Message:
+    """
+    New assistant message referencing the shared body of its content (not yet added to db).
+    """
+    return models.Message(
+        session_id=session_id,
+        role="assistant",
+        body_hash=intern_body(db, content),
+    )
+
+
+def collect_garbage(db: Session) -> int:
+    """
+    Delete bodies no message references any more. Returns the number removed.
+    Bodies locked by an in-flight intern_body are skipped (collected on a later run).
+    """
+    result = db.execute(text(
+        "DELETE FROM response_bodies WHERE hash IN ("
+        " SELECT b.hash FROM response_bodies b"
+        " WHERE NOT EXISTS (SELECT 1 FROM messages m WHERE m.body_hash = b.hash)"
+        " FOR UPDATE SKIP LOCKED)"
+    ))
+    db.commit()
+    return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gc", action="store_true", help="delete unreferenced response bodies")
+    args = parser.parse_args()
+    if not args.gc:
+        parser.print_help()
+        return
+    db = MaintenanceSessionLocal()
+    try:
+        print(f"Removed {collect_garbage(db)} unreferenced response bodies.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+from typing import List
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .embeddings import embedding_store
+from .prefix_cache import system_messages
+
+# Retrieval mode: the most recent turns are always included verbatim, plus the older turns
+# most similar to the new prompt.
+RETRIEVAL_RECENT_MESSAGES = int(os.getenv("RETRIEVAL_RECENT_MESSAGES", "8"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+
+
+def summary_message(summary: str) -> dict:
+    """
+    System message that stands in for the compacted part of the conversation.
+    """
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier conversation:\n{summary}",
+    }
+
+
+def _get_summary(db: Session, session_id: UUID):
+    return (
+        db.query(models.SessionSummary)
+        .filter(models.SessionSummary.session_id == session_id)
+        .first()
+    )
+
+
+def build_messages(db: Session, session_id: UUID, prompt: str, mode: str = "full") -> List[dict]:
+    """
+    Assemble the chat prompt for a session: the configured system prompt, the rolling summary of older turns (if the
+    compaction worker has written one), the history, and the new user prompt.
+    In "full" mode the history is every turn after the summary; in "retrieval" mode it is the
+    last RETRIEVAL_RECENT_MESSAGES turns plus the RETRIEVAL_TOP_K older turns most similar to
+    the prompt, in chronological order.
+    """
+    summary = _get_summary(db, session_id)
+    if mode == "retrieval":
+        history_msgs = _retrieved_history(db, session_id, prompt)
+    else:
+        query = db.query(models.Message).filter(models.Message.session_id == session_id)
+        if summary is not None and summary.summarized_until is not None:
+            query = query.filter(models.Message.created_at > summary.summarized_until)
+        history_msgs = query.order_by(models.Message.created_at.asc()).all()
+
+    messages_payload = system_messages()
+    if summary is not None and summary.summary:
+        messages_payload.append(summary_message(summary.summary))
+    messages_payload.extend({"role": msg.role, "content": msg.content} for msg in history_msgs)
+    # Add the current prompt
+    messages_payload.append({"role": "user", "content": prompt})
+    return messages_payload
+
+
+def _retrieved_history(db: Session, session_id: UUID, prompt: str) -> List[models.Message]:
+    recent = (
+        db.query(models.Message)
+        .filter(models.Message.session_id == session_id)
+        .order_by(models.Message.created_at.desc())
+        .limit(RETRIEVAL_RECENT_MESSAGES)
+        .all()
+    )
+    recent_ids = {msg.id for msg in recent}
+    similar_ids = embedding_store.search(db, session_id, prompt, RETRIEVAL_TOP_K, exclude=recent_ids)
+    similar = []
+    if similar_ids:
+        # Re-read from messages so vectors of deleted messages never leak into the prompt.
+        similar = (
+            db.query(models.Message)
+            .filter(
+                models.Message.session_id == session_id,
+                models.Message.id.in_(similar_ids),
+            )
+            .all()
+        )
+    return sorted(similar + recent, key=lambda msg: msg.created_at)
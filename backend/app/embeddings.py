@@ -0,0 +1,252 @@
+"""
+Per-message embedding store for retrieval over session history.
+
+Vectors are stored in message_embeddings (float32 bytes), filled incrementally when messages are
+inserted and backfilled in bulk for existing rows:
+    python -m app.embeddings --backfill
+Similarity search loads a session's vectors into one NumPy matrix (kept in an LRU) and scores
+all of them with a single matrix-vector product.
+"""
+import argparse
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import MaintenanceSessionLocal
+
+# hashing: feature-hashed word unigrams + bigrams, no model needed and microseconds per message.
+# llama: a GGUF embedding model at EMBEDDING_MODEL_PATH (e.g. bge-small / nomic-embed).
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing")
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))  # hashing backend only
+# Sessions whose matrices are kept in memory.
+EMBEDDING_CACHE_SESSIONS = int(os.getenv("EMBEDDING_CACHE_SESSIONS", "256"))
+BACKFILL_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Feature-hashing embedder: each unigram and bigram is hashed into one of `dim` buckets with a
+    sign, and the vector is L2-normalised. Cheap and deterministic; good enough for recall of
+    past turns that share vocabulary with the new prompt.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        words = _TOKEN_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text or ""):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                matrix[row, digest % self.dim] += 1.0 if (digest >> 63) & 1 else -1.0
+        return _normalise(matrix)
+
+
+class LlamaEmbedder:
+    """
+    Embeddings from a GGUF embedding model, loaded on first use.
+    """
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.name = os.path.splitext(os.path.basename(model_path))[0]
+        self._llm = None
+        self._lock = threading.Lock()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        from llama_cpp import Llama
+
+        with self._lock:
+            if self._llm is None:
+                self._llm = Llama(model_path=self.model_path, embedding=True, verbose=False)
+            vectors = self._llm.embed(list(texts))
+        return _normalise(np.asarray(vectors, dtype=np.float32))
+
+
+def _normalise(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _build_embedder():
+    if EMBEDDING_BACKEND == "llama":
+        if EMBEDDING_MODEL_PATH and os.path.exists(EMBEDDING_MODEL_PATH):
+            return LlamaEmbedder(EMBEDDING_MODEL_PATH)
+        print(f"Warning: embedding model not found at {EMBEDDING_MODEL_PATH!r}, using hashing embeddings")
+    return HashingEmbedder(EMBEDDING_DIM)
+
+
+class EmbeddingStore:
+    """
+    Writes message embeddings and answers top-k similarity queries per session.
+    """
+
+    def __init__(self, embedder, cache_sessions: int = EMBEDDING_CACHE_SESSIONS):
+        self.embedder = embedder
+        self.cache_sessions = cache_sessions
+        # session_id -> (message ids, matrix with one normalised row per message)
+        self._matrices: "OrderedDict[UUID, Tuple[List[UUID], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_messages(self, db: Session, messages: Sequence[models.Message]) -> None:
+        """
+        Embed freshly inserted messages and store their vectors (called after the insert commits).
+        """
+        if not messages:
+            return
+        matrix = self.embedder.embed([m.content or " " for m in messages])
+        db.bulk_insert_mappings(models.MessageEmbedding, [
+            {
+                "message_id": m.id,
+                "session_id": m.session_id,
+                "model": self.embedder.name,
+                "vector": matrix[i].tobytes(),
+            }
+            for i, m in enumerate(messages)
+        ])
+        db.commit()
+
+        with self._lock:
+            for i, m in enumerate(messages):
+                cached = self._matrices.get(m.session_id)
+                if cached is not None:
+                    ids, existing = cached
+                    row = matrix[i:i + 1]
+                    self._matrices[m.session_id] = (ids + [m.id], np.vstack([existing, row]) if ids else row)
+
+    def forget_session(self, session_id: UUID) -> None:
+        """
+        Drop a session's cached matrix (the session was deleted or archived).
+        """
+        with self._lock:
+            self._matrices.pop(session_id, None)
+
+    def _session_matrix(self, db: Session, session_id: UUID) -> Tuple[List[UUID], np.ndarray]:
+        with self._lock:
+            cached = self._matrices.get(session_id)
+            if cached is not None:
+                self._matrices.move_to_end(session_id)
+                return cached
+
+        rows = (
+            db.query(models.MessageEmbedding.message_id, models.MessageEmbedding.vector)
+            .filter(
+                models.MessageEmbedding.session_id == session_id,
+                models.MessageEmbedding.model == self.embedder.name,
+            )
+            .all()
+        )
+        ids = [row[0] for row in rows]
+        if rows:
+            matrix = np.frombuffer(b"".join(bytes(row[1]) for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            self._matrices[session_id] = (ids, matrix)
+            if len(self._matrices) > self.cache_sessions:
+                self._matrices.popitem(last=False)
+        return ids, matrix
+
+    def search(
+        self,
+        db: Session,
+        session_id: UUID,
+        query: str,
+        k: int,
+        exclude: Optional[set] = None,
+    ) -> List[UUID]:
+        """
+        Ids of the k messages in the session most similar to the query (best first).
+        """
+        ids, matrix = self._session_matrix(db, session_id)
+        if not ids or k <= 0:
+            return []
+        scores = matrix @ self.embedder.embed([query])[0]
+        if exclude:
+            for i, message_id in enumerate(ids):
+                if message_id in exclude:
+                    scores[i] = -np.inf
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [ids[i] for i in top if np.isfinite(scores[i])]
+
+    def backfill(self, db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+        """
+        Embed every message that has no vector yet, in batches. Returns the number embedded.
+        Vectors written by a different embedder are dropped first and recomputed.
+        """
+        db.query(models.MessageEmbedding).filter(
+            models.MessageEmbedding.model != self.embedder.name
+        ).delete(synchronize_session=False)
+        db.commit()
+        total = 0
+        while True:
+            batch = (
+                db.query(models.Message)
+                .outerjoin(
+                    models.MessageEmbedding,
+                    models.MessageEmbedding.message_id == models.Message.id,
+                )
+                .filter(models.MessageEmbedding.message_id.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                return total
+            self.add_messages(db, batch)
+            total += len(batch)
+            print(f"Backfilled {total} message embeddings...")
+
+    @staticmethod
+    def delete_messages(db: Session, message_ids: Sequence[UUID]) -> None:
+        """
+        Drop the vectors of deleted messages (no FK to messages, so this is explicit).
+        Cached matrices may keep stale rows; search results are always re-read from messages.
+        """
+        if message_ids:
+            db.query(models.MessageEmbedding).filter(
+                models.MessageEmbedding.message_id.in_(list(message_ids))
+            ).delete(synchronize_session=False)
+
+
+embedding_store = EmbeddingStore(_build_embedder())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true", help="embed all messages that have no vector yet")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return
+    db = MaintenanceSessionLocal()
+    try:
+        total = embedding_store.backfill(db, args.batch_size)
+        print(f"Done: {total} messages embedded with '{embedding_store.embedder.name}'.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,610 @@
+import glob
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llama_cpp import Llama
+
+from . import autotune
+from .cancellation import CancelToken
+from .prefix_cache import PrefixCache
+from .speculative import SPECULATIVE_MODE, build_draft_model, draft_model_file
+
+MODEL_PATH = os.getenv("MODEL_PATH", "/app/models/qwen2.5-1.5b-instruct-q4_k_m.gguf")
+N_THREADS = int(os.getenv("N_THREADS", "4"))
+N_CTX = int(os.getenv("N_CTX", "2048"))
+N_BATCH = int(os.getenv("N_BATCH", "512"))
+# mmap lets the OS page the GGUF in lazily; mlock pins it in RAM so it is never swapped out.
+USE_MMAP = os.getenv("LLM_USE_MMAP", "1") == "1"
+USE_MLOCK = os.getenv("LLM_USE_MLOCK", "0") == "1"
+# A short generation right after loading touches the weights and compute buffers,
+# so the first real request does not pay for it. Set LLM_WARMUP_TOKENS=0 to disable.
+WARMUP_PROMPT = os.getenv("LLM_WARMUP_PROMPT", "Hello")
+WARMUP_TOKENS = int(os.getenv("LLM_WARMUP_TOKENS", "8"))
+# Every *.gguf file in MODELS_DIR can be selected per request; the file name without
+# extension is the model name. Resident models are kept under MODEL_RAM_BUDGET_MB
+# (estimated from the model and draft model file sizes, prefix snapshots and, with speculative
+# decoding, the logits buffer) by unloading the least recently used ones.
+MODELS_DIR = os.getenv("MODELS_DIR", os.path.dirname(MODEL_PATH))
+MODEL_RAM_BUDGET_MB = int(os.getenv("MODEL_RAM_BUDGET_MB", "4096"))
+# Vocabulary size assumed for the logits buffer until a model has loaded (Qwen2.5's).
+N_VOCAB_ESTIMATE = int(os.getenv("N_VOCAB_ESTIMATE", "151936"))
+# How long a request waits for an on-demand model load before giving up with 503.
+MODEL_LOAD_WAIT_SECONDS = float(os.getenv("MODEL_LOAD_WAIT_SECONDS", "120"))
+# Granularity at which queued requests re-check cancellation while waiting for a model.
+WAIT_POLL_SECONDS = 0.25
+
+
+class ModelNotReadyError(Exception):
+    """
+    Raised when inference is requested before a model has finished loading.
+    """
+
+
+class UnknownModelError(Exception):
+    """
+    Raised when a request selects a model that is not in MODELS_DIR.
+    """
+
+
+def model_name(model_path: str) -> str:
+    """
+    Model name used in requests, cache keys and stats: the GGUF file name without extension.
+    """
+    return os.path.splitext(os.path.basename(model_path))[0]
+
+
+def stream_chat_completion(
+    llm: Llama,
+    messages: List[dict],
+    on_token: Callable[[], bool],
+    **params,
+) -> Tuple[str, int, bool]:
+    """
+    Run a chat completion as a stream so it can be abandoned between tokens
+    (create_chat_completion takes no stopping criteria). on_token() is called after every
+    generated chunk (one token, give or take multi-byte characters); returning True stops.
+    Returns (content, completion_tokens, stopped).
+    """
+    parts: List[str] = []
+    tokens = 0
+    stream = llm.create_chat_completion(messages=messages, stream=True, **params)
+    try:
+        for chunk in stream:
+            content = chunk["choices"][0].get("delta", {}).get("content")
+            if not content:
+                continue
+            parts.append(content)
+            tokens += 1
+            if on_token():
+                return "".join(parts), tokens, True
+    finally:
+        stream.close()
+    return "".join(parts), tokens, False
+
+
+def file_size(model_path: str) -> int:
+    """
+    Estimated resident size of a model: the GGUF file size (weights are mmap'd as-is).
+    """
+    try:
+        return os.path.getsize(model_path)
+    except OSError:
+        return 0
+
+
+class ModelManager:
+    """
+    Owns the lifecycle of the local Llama model.
+    Loading and warmup run in a background thread, so importing the app and starting
+    the server never block on the GGUF file. A reload builds the new model next to the
+    old one and swaps it in once warm, so requests keep being served during a reload.
+    """
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.name = model_name(model_path)
+        self.state = "not_loaded"  # not_loaded | tuning | loading | warming | ready | failed
+        self.loading_path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.runtime_params: dict = {}
+        self._llm: Optional[Llama] = None
+        self.draft_model = None
+        self.prefix_cache: Optional[PrefixCache] = None
+        self.n_vocab = N_VOCAB_ESTIMATE
+        self._state_lock = threading.Lock()
+        # Llama instances are not thread-safe: one generation at a time.
+        self._inference_lock = threading.Lock()
+        self._loader: Optional[threading.Thread] = None
+        # Requests currently holding or waiting for this model; pinned models are never evicted.
+        self.users = 0
+        # Interactive (chat) requests among them; background work only runs while this is 0.
+        self.interactive = 0
+        self.last_used = time.time()
+        self.tokens_generated = 0
+        self.generation_seconds = 0.0
+        # Moving average of how long one request holds the model, for queue wait estimates.
+        self.avg_hold_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._llm is not None
+
+    @property
+    def loading(self) -> bool:
+        return self._loader is not None and self._loader.is_alive()
+
+    @property
+    def size_bytes(self) -> int:
+        """
+        Estimated resident size: the weights, the draft model's weights (SPECULATIVE_MODE=draft),
+        the logits buffer speculative decoding needs and the in-memory prefix snapshots.
+        """
+        size = file_size(self.model_path)
+        draft_path = draft_model_file(self.model_path)
+        if draft_path is not None:
+            size += file_size(draft_path)
+        if self.draft_model is not None or draft_path is not None or SPECULATIVE_MODE == "prompt_lookup":
+            # With a draft model Llama keeps float32 logits for every position (logits_all).
+            size += N_CTX * self.n_vocab * 4
+        prefix_cache = self.prefix_cache
+        return size + (prefix_cache.nbytes if prefix_cache else 0)
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.generation_seconds <= 0:
+            return 0.0
+        return self.tokens_generated / self.generation_seconds
+
+    def start(self) -> None:
+        """
+        Begin loading the configured model in the background (no-op if already loaded or loading).
+        """
+        if self.ready:
+            return
+        self.reload()
+
+    def reload(self, model_path: Optional[str] = None) -> bool:
+        """
+        Load a model (the current MODEL_PATH by default) in the background and swap it in when warm.
+        Returns False if another load is already in progress.
+        """
+        with self._state_lock:
+            if self._loader is not None and self._loader.is_alive():
+                return False
+            target = model_path or self.model_path
+            self.loading_path = target
+            self.state = "loading"
+            self.error = None
+            self._loader = threading.Thread(
+                target=self._load, args=(target,), name="model-loader", daemon=True
+            )
+            self._loader.start()
+            return True
+
+    def _load(self, model_path: str) -> None:
+        start_ts = time.time()
+        if not os.path.exists(model_path):
+            print(f"Warning: Model file not found at {model_path}")
+            self._finish_failed(f"Model file not found at {model_path}")
+            return
+
+        try:
+            params = self._runtime_params(model_path)
+            print(
+                f"Loading local LLM from {model_path} with {params['n_threads']} threads, "
+                f"n_batch={params['n_batch']} ({params['source']})..."
+            )
+            self.state = "loading"
+            draft_model = build_draft_model(model_path, N_CTX)
+            llm = Llama(
+                model_path=model_path,
+                n_ctx=N_CTX,                         # Context window size
+                n_threads=params["n_threads"],       # Number of CPU threads to use
+                n_threads_batch=params["n_threads"],
+                n_batch=params["n_batch"],
+                use_mmap=USE_MMAP,
+                use_mlock=USE_MLOCK,
+                draft_model=draft_model,  # speculative decoding, see speculative.py
+                verbose=False,
+            )
+            if WARMUP_TOKENS > 0:
+                self.state = "warming"
+                llm.create_completion(WARMUP_PROMPT, max_tokens=WARMUP_TOKENS, temperature=0.0)
+            # Shared prompt prefixes are evaluated (or loaded from disk) once per model, see prefix_cache.py.
+            self.state = "warming"
+            prefix_cache = PrefixCache.build(llm, model_path)
+            if draft_model is not None:
+                # Warmup and snapshot calls are not in tokens_generated, so they must not count here.
+                draft_model.reset()
+        except Exception as e:
+            print(f"Failed to load model: {e}")
+            self._finish_failed(str(e))
+            return
+
+        # Wait for any in-flight generation on the old model before swapping.
+        with self._inference_lock:
+            old_llm, old_draft = self._llm, self.draft_model
+            self._llm = llm
+            self.draft_model = draft_model
+            self.prefix_cache = prefix_cache
+            self.model_path = model_path
+            self.name = model_name(model_path)
+            self.runtime_params = params
+            if draft_model is not None:
+                self.n_vocab = llm.n_vocab()
+        self._close(old_llm, old_draft)
+
+        with self._state_lock:
+            self.state = "ready"
+            self.loading_path = None
+            self.load_seconds = time.time() - start_ts
+        print(f"Model loaded successfully in {self.load_seconds:.1f}s.")
+
+    def _runtime_params(self, model_path: str) -> dict:
+        """
+        n_threads / n_batch for this host: the autotuned config if one is stored (or, with
+        AUTOTUNE=startup, benchmarked now), otherwise N_THREADS / N_BATCH.
+        """
+        config = autotune.load_config(model_path)
+        if config is None and autotune.AUTOTUNE == "startup":
+            self.state = "tuning"
+            try:
+                config = autotune.autotune(model_path)
+            except Exception as e:
+                print(f"Warning: autotune failed ({e}); using N_THREADS / N_BATCH")
+        if config is not None:
+            return {"n_threads": config["n_threads"], "n_batch": config["n_batch"], "source": "autotune"}
+        return {"n_threads": N_THREADS, "n_batch": N_BATCH, "source": "env"}
+
+    def _finish_failed(self, error: str) -> None:
+        with self._state_lock:
+            # A failed hot reload leaves the previous model serving.
+            self.state = "ready" if self.ready else "failed"
+            self.loading_path = None
+            self.error = error
+
+    def wait_ready(self, timeout: float) -> bool:
+        """
+        Block until an in-progress load finishes (or timeout) and report whether the model is ready.
+        """
+        loader = self._loader
+        if loader is not None:
+            loader.join(timeout)
+        return self.ready
+
+    def unload(self) -> None:
+        """
+        Free the model once any in-flight generation on it has finished.
+        """
+        self._close_detached(self._detach())
+
+    def _detach(self) -> Tuple[Optional[Llama], object]:
+        """
+        Mark the model unloaded (after any in-flight generation) and return it for closing.
+        """
+        with self._inference_lock:
+            old_llm, old_draft = self._llm, self.draft_model
+            self._llm = None
+            self.draft_model = None
+            self.prefix_cache = None
+        with self._state_lock:
+            self.state = "not_loaded"
+        return old_llm, old_draft
+
+    def _close_detached(self, detached: Tuple[Optional[Llama], object]) -> None:
+        old_llm, old_draft = detached
+        if old_llm is not None:
+            self._close(old_llm, old_draft)
+            print(f"Unloaded model {self.name}.")
+
+    @staticmethod
+    def _close(llm: Optional[Llama], draft_model) -> None:
+        if llm is not None:
+            llm.close()
+        if draft_model is not None:
+            draft_model.close()
+
+    def expected_wait_seconds(self) -> float:
+        """
+        Estimated queueing delay for a new request: requests ahead of it times the average hold time.
+        """
+        return max(self.interactive, 0) * self.avg_hold_seconds
+
+    def record_generation(self, tokens: int, seconds: float) -> None:
+        """
+        Accumulate decode throughput for admin stats.
+        """
+        self.tokens_generated += tokens
+        self.generation_seconds += seconds
+
+    @contextmanager
+    def acquire(self, cancel: Optional[CancelToken] = None):
+        """
+        Hold the model exclusively for one generation.
+        Raises ModelNotReadyError if no model has been loaded yet, and GenerationCancelled
+        if the request is cancelled while queued behind other generations.
+        """
+        if cancel is None:
+            self._inference_lock.acquire()
+        else:
+            while not self._inference_lock.acquire(timeout=WAIT_POLL_SECONDS):
+                cancel.check()
+        held_at = time.time()
+        try:
+            if cancel is not None:
+                cancel.check()
+            if self._llm is None:
+                raise ModelNotReadyError(self.error or "Model is still loading")
+            yield self._llm
+        finally:
+            held = time.time() - held_at
+            self.avg_hold_seconds = held if self.avg_hold_seconds == 0 else 0.8 * self.avg_hold_seconds + 0.2 * held
+            self._inference_lock.release()
+
+    @contextmanager
+    def acquire_idle(self):
+        """
+        Hold the model for low-priority background work.
+        Waits until no interactive request is holding or waiting for the model, so background
+        work only ever fills idle time. Holders should also stop early once `interactive` > 0.
+        """
+        while True:
+            if self.interactive == 0 and self._inference_lock.acquire(blocking=False):
+                if self.interactive == 0:
+                    break
+                self._inference_lock.release()
+            time.sleep(WAIT_POLL_SECONDS)
+        try:
+            if self._llm is None:
+                raise ModelNotReadyError(self.error or "Model is still loading")
+            yield self._llm
+        finally:
+            self._inference_lock.release()
+
+    def prepare_prefix(self, llm: Llama, messages: List[dict]) -> bool:
+        """
+        Restore the snapshot of a shared prefix of `messages` into `llm` before generating.
+        Must be called while holding the model (acquire / acquire_idle).
+        """
+        if self.prefix_cache is None:
+            return False
+        try:
+            return self.prefix_cache.restore(llm, messages)
+        except Exception as e:
+            print(f"Warning: prefix restore failed, evaluating the full prompt: {e}")
+            llm.reset()
+            return False
+
+    def status(self) -> dict:
+        """
+        Snapshot of the loader state for readiness probes and admin stats.
+        """
+        return {
+            "name": self.name,
+            "ready": self.ready,
+            "state": self.state,
+            "model_path": self.model_path,
+            "loading_path": self.loading_path,
+            "load_seconds": self.load_seconds,
+            "runtime_params": self.runtime_params,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    """
+    Serves every GGUF model found in MODELS_DIR, loading them on demand.
+    Each model gets its own ModelManager; resident models are tracked in LRU order and the
+    least recently used idle ones are unloaded when the RAM budget would be exceeded.
+    """
+
+    def __init__(self, models_dir: str, default_model_path: str, ram_budget_mb: int):
+        self.models_dir = models_dir
+        self.default_model = model_name(default_model_path)
+        self.ram_budget_bytes = ram_budget_mb * 1024 * 1024
+        self._extra_paths: Dict[str, str] = {self.default_model: default_model_path}
+        self._managers: "OrderedDict[str, ModelManager]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def available(self) -> Dict[str, str]:
+        """
+        Map model name -> path for every *.gguf in MODELS_DIR plus explicitly registered paths.
+        """
+        found = dict(self._extra_paths)
+        for path in sorted(glob.glob(os.path.join(self.models_dir, "*.gguf"))):
+            found.setdefault(model_name(path), path)
+        return found
+
+    @property
+    def default(self) -> ModelManager:
+        return self.get(self.default_model)
+
+    def resolve(self, name: Optional[str]) -> str:
+        """
+        Map a requested model name (None means the default) to a known model name.
+        """
+        name = name or self.default_model
+        if name not in self._managers and name not in self.available():
+            raise UnknownModelError(f"Unknown model '{name}'")
+        return name
+
+    def get(self, name: Optional[str] = None, load: bool = True, pin: bool = False) -> ModelManager:
+        """
+        Return the manager for a model, starting its load if it is not resident yet.
+        With pin=True the model is protected from eviction until the caller calls release().
+        """
+        with self._lock:
+            name = self.resolve(name)
+            manager = self._managers.get(name)
+            if manager is None:
+                manager = ModelManager(self.available()[name])
+                self._managers[name] = manager
+            self._managers.move_to_end(name)
+            manager.last_used = time.time()
+            if pin:
+                manager.users += 1
+        if load and not manager.ready and not manager.loading:
+            self._make_room(manager)
+            manager.start()
+        return manager
+
+    def release(self, manager: ModelManager) -> None:
+        with self._lock:
+            manager.users -= 1
+
+    def _make_room(self, incoming: ModelManager) -> None:
+        """
+        Unload least recently used idle models until the incoming one fits the RAM budget.
+        Victims are checked for pins and detached under the registry lock, so a concurrent get()
+        either pins a model first (and it is kept) or finds it unloaded and loads it again;
+        only closing the freed models happens outside the lock.
+        """
+        detached = []
+        with self._lock:
+            resident = [
+                m for m in self._managers.values()
+                if m is not incoming and (m.ready or m.loading)
+            ]
+            used = sum(m.size_bytes for m in resident)
+            for m in resident:  # OrderedDict order: least recently used first
+                if used + incoming.size_bytes <= self.ram_budget_bytes:
+                    break
+                if m.users > 0 or m.loading:
+                    continue
+                used -= m.size_bytes
+                # Unpinned, so no generation holds its inference lock: detaching is immediate.
+                detached.append((m, m._detach()))
+        for m, models in detached:
+            m._close_detached(models)
+
+    @contextmanager
+    def acquire(
+        self,
+        name: Optional[str] = None,
+        wait_seconds: float = MODEL_LOAD_WAIT_SECONDS,
+        cancel: Optional[CancelToken] = None,
+        messages: Optional[List[dict]] = None,
+    ):
+        """
+        Hold a model exclusively for one generation, loading it first if needed.
+        With `messages`, the snapshot of their shared prefix is restored first.
+        Yields (manager, llm). Raises UnknownModelError, ModelNotReadyError or GenerationCancelled.
+        """
+        manager = self.get(name, pin=True)
+        with self._lock:
+            manager.interactive += 1
+        try:
+            give_up_at = time.time() + wait_seconds
+            while not manager.wait_ready(WAIT_POLL_SECONDS):
+                if cancel is not None:
+                    cancel.check()
+                if not manager.loading or time.time() >= give_up_at:
+                    raise ModelNotReadyError(manager.error or f"Model '{manager.name}' is still loading")
+            with manager.acquire(cancel) as llm:
+                manager.last_used = time.time()
+                if messages is not None:
+                    manager.prepare_prefix(llm, messages)
+                yield manager, llm
+        finally:
+            with self._lock:
+                manager.interactive -= 1
+            self.release(manager)
+
+    @contextmanager
+    def acquire_background(self, name: Optional[str] = None, wait_seconds: float = MODEL_LOAD_WAIT_SECONDS):
+        """
+        Like acquire(), but at low priority: only once no interactive request wants the model.
+        """
+        manager = self.get(name, pin=True)
+        try:
+            if not manager.wait_ready(wait_seconds):
+                raise ModelNotReadyError(manager.error or f"Model '{manager.name}' is still loading")
+            with manager.acquire_idle() as llm:
+                yield manager, llm
+        finally:
+            self.release(manager)
+
+    def generate_background(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        name: Optional[str] = None,
+        temperature: float = 0.2,
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Run one chat completion for background work (batches, compaction) at low priority.
+        Returns (content, completion_tokens), or None if an interactive request arrived and the
+        generation was abandoned; the caller should simply retry later.
+        """
+        with self.acquire_background(name) as (manager, llm):
+            manager.prepare_prefix(llm, messages)
+            gen_start = time.time()
+            content, tokens, preempted = stream_chat_completion(
+                llm,
+                messages,
+                lambda: manager.interactive > 0,
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+            if preempted:
+                return None
+            manager.record_generation(tokens, time.time() - gen_start)
+        return content, tokens
+
+    def start(self) -> None:
+        """
+        Preload the default model in the background.
+        """
+        self.get(self.default_model)
+
+    def reload(self, model_path: Optional[str] = None) -> bool:
+        """
+        Hot-reload a model from disk. With a new path, it is registered and becomes the default model.
+        """
+        if model_path is None:
+            return self.get(self.default_model, load=False).reload()
+        name = model_name(model_path)
+        with self._lock:
+            self._extra_paths[name] = model_path
+            self.default_model = name
+        manager = self.get(name, load=False)
+        self._make_room(manager)
+        return manager.reload(model_path)
+
+    def stats(self) -> List[dict]:
+        """
+        Per-model residency, load time and decode throughput for admin stats.
+        """
+        with self._lock:
+            managers = dict(self._managers)
+        result = []
+        for name, path in self.available().items():
+            m = managers.get(name)
+            result.append({
+                "name": name,
+                "path": m.model_path if m else path,
+                "size_mb": round(file_size(m.model_path if m else path) / (1024 * 1024), 1),
+                "state": m.state if m else "not_loaded",
+                "resident": bool(m and m.ready),
+                "is_default": name == self.default_model,
+                "load_seconds": m.load_seconds if m else None,
+                "tokens_generated": m.tokens_generated if m else 0,
+                "tokens_per_second": m.tokens_per_second if m else 0.0,
+                "n_threads": m.runtime_params.get("n_threads") if m else None,
+                "n_batch": m.runtime_params.get("n_batch") if m else None,
+                "speculative_mode": m.draft_model.mode if m and m.draft_model else "off",
+                "draft_acceptance_rate": (
+                    m.draft_model.acceptance_rate(m.tokens_generated) if m and m.draft_model else None
+                ),
+                "prefix_snapshots": len(m.prefix_cache.snapshots) if m and m.prefix_cache else 0,
+                "prefix_restores": m.prefix_cache.restores if m and m.prefix_cache else 0,
+            })
+        return result
+
+
+model_registry = ModelRegistry(MODELS_DIR, MODEL_PATH, MODEL_RAM_BUDGET_MB)
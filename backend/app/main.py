@@ -1,9 +1,31 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from . import routes
+from .llm import model_registry
+from .batches import batch_worker
+from .compaction import compaction_worker
+from .archive import archive_worker
+from .cache_warming import cache_warmer
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # optional: without brotli-asgi responses are gzip-compressed only
+    BrotliMiddleware = None
+
+# Responses at least this large are compressed (brotli if the client accepts it, else gzip).
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
 
 app = FastAPI(title="PocketLLM Portal API")
 
+# 压缩较大的响应（会话历史、搜索结果），优先 brotli，不支持时回退到 gzip
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_BYTES, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+
 # ✅ 添加 CORS 设置，允许 React 前端访问
 app.add_middleware(
     CORSMiddleware,
@@ -11,7 +33,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # 注册路由
 app.include_router(routes.router)
+
+
+@app.on_event("startup")
+def start_background_services():
+    # 在后台线程加载模型，服务启动不再被模型加载阻塞；用 /api/v1/ready 判断是否可用
+    model_registry.start()
+    # 批量任务在模型空闲时以低优先级处理
+    batch_worker.start()
+    # 长会话的旧消息在模型空闲时滚动压缩成摘要
+    compaction_worker.start()
+    # 创建未来月份的 messages 分区，并把长期不活跃的会话归档到冷存储
+    archive_worker.start()
+    # 把热门缓存条目定期快照到本地，Redis 清空或重启后以低优先级重新加载/生成
+    cache_warmer.start()
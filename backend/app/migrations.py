@@ -0,0 +1,368 @@
+"""
+Schema and data migrations for existing databases.
+
+Fresh databases are created from db/init.sql, which already contains every migration below and
+records them in schema_migrations. Databases created before a migration was added are upgraded
+with:
+    python -m app.migrations            # apply pending migrations
+    python -m app.migrations --list     # show applied / pending migrations
+    python -m app.migrations --partitions  # only create upcoming messages partitions
+Each migration is idempotent and can be re-run after an interruption.
+"""
+import argparse
+import os
+import time
+from datetime import date, datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .database import maintenance_engine
+
+MIGRATION_BATCH_SIZE = 5000
+# messages is range-partitioned by created_at into monthly partitions (messages_pYYYYMM, plus
+# messages_default for anything outside them); this many future months are kept created.
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+
+def _relation_bytes(conn, *tables: str) -> int:
+    total = 0
+    for table in tables:
+        exists = conn.execute(text("SELECT to_regclass(:t)"), {"t": table}).scalar()
+        if exists:
+            total += conn.execute(text("SELECT pg_total_relation_size(:t)"), {"t": table}).scalar()
+    return total
+
+
+def migrate_feature_tables(db_engine: Engine, batch_size: int) -> None:
+    """
+    Tables added to db/init.sql before migrations existed: batch jobs (batches.py), rolling
+    session summaries (compaction.py) and message embeddings (embeddings.py).
+    """
+    with db_engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS batch_jobs ("
+            " id UUID PRIMARY KEY,"
+            " user_id UUID,"
+            " model VARCHAR(255),"
+            " max_tokens INTEGER DEFAULT 256,"
+            " status VARCHAR(20) DEFAULT 'queued',"
+            " total_items INTEGER DEFAULT 0,"
+            " completed_items INTEGER DEFAULT 0,"
+            " failed_items INTEGER DEFAULT 0,"
+            " cached_items INTEGER DEFAULT 0,"
+            " tokens_generated INTEGER DEFAULT 0,"
+            " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,"
+            " started_at TIMESTAMP,"
+            " finished_at TIMESTAMP)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS batch_items ("
+            " id SERIAL PRIMARY KEY,"
+            " job_id UUID REFERENCES batch_jobs(id) ON DELETE CASCADE,"
+            " idx INTEGER,"
+            " custom_id VARCHAR(255),"
+            " prompt TEXT,"
+            " status VARCHAR(20) DEFAULT 'pending',"
+            " result TEXT,"
+            " error TEXT,"
+            " cached BOOLEAN DEFAULT FALSE,"
+            " tokens INTEGER DEFAULT 0,"
+            " completed_at TIMESTAMP)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_batch_jobs_user ON batch_jobs (user_id, created_at)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_batch_items_pending ON batch_items (job_id, idx)"
+            " WHERE status = 'pending'"
+        ))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS session_summaries ("
+            " session_id UUID PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,"
+            " summary TEXT,"
+            " summarized_until TIMESTAMP,"
+            " summarized_count INTEGER DEFAULT 0,"
+            " updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS message_embeddings ("
+            " message_id UUID PRIMARY KEY,"
+            " session_id UUID NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,"
+            " model VARCHAR(255) NOT NULL,"
+            " vector BYTEA NOT NULL,"
+            " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_message_embeddings_session ON message_embeddings (session_id)"
+        ))
+
+
+def migrate_response_bodies(db_engine: Engine, batch_size: int) -> None:
+    """
+    Move assistant message text into content-addressed response_bodies, deduplicating it.
+    """
+    with db_engine.begin() as conn:
+        before = _relation_bytes(conn, "messages", "response_bodies")
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS response_bodies ("
+            " hash CHAR(64) PRIMARY KEY,"
+            " content TEXT NOT NULL,"
+            " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        conn.execute(text(
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS body_hash CHAR(64) REFERENCES response_bodies(hash)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_messages_body_hash ON messages (body_hash)"))
+
+    moved = 0
+    while True:
+        with db_engine.begin() as conn:
+            result = conn.execute(text(
+                "WITH batch AS ("
+                "  SELECT id, content, encode(sha256(convert_to(content, 'UTF8')), 'hex') AS hash"
+                "  FROM messages"
+                "  WHERE role = 'assistant' AND body_hash IS NULL AND content IS NOT NULL"
+                "  LIMIT :batch_size"
+                "), bodies AS ("
+                "  INSERT INTO response_bodies (hash, content)"
+                "  SELECT DISTINCT ON (hash) hash, content FROM batch"
+                "  ON CONFLICT (hash) DO NOTHING"
+                ")"
+                "UPDATE messages m SET body_hash = batch.hash, content = NULL"
+                " FROM batch WHERE m.id = batch.id"
+            ), {"batch_size": batch_size})
+        if result.rowcount == 0:
+            break
+        moved += result.rowcount
+        print(f"  deduplicated {moved} assistant messages...")
+
+    with db_engine.connect() as conn:
+        after = _relation_bytes(conn, "messages", "response_bodies")
+        bodies = conn.execute(text("SELECT count(*) FROM response_bodies")).scalar()
+    print(
+        f"  {moved} messages now reference {bodies} unique bodies; "
+        f"messages+response_bodies {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+        "(run VACUUM FULL messages to return the freed space to the OS)"
+    )
+
+
+def _month_start(day: date, offset: int = 0) -> date:
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _is_partitioned(conn) -> bool:
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = 'messages'::regclass")).scalar() == "p"
+
+
+def _create_month_partition(conn, month: date) -> bool:
+    """
+    Create the partition for one month if missing. Rows that already landed in the default
+    partition for that range are moved into it before it is attached. Returns True if created.
+    """
+    name = f"messages_p{month:%Y%m}"
+    if conn.execute(text("SELECT to_regclass(:t)"), {"t": name}).scalar():
+        return False
+    lower, upper = month.isoformat(), _month_start(month, 1).isoformat()
+    conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM messages_default WHERE created_at >= '{lower}' AND created_at < '{upper}' "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ))
+    conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+    return True
+
+
+def ensure_partitions(db_engine: Engine = maintenance_engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """
+    Create monthly messages partitions from the current month up to `months_ahead` months ahead.
+    Idempotent and cheap; run periodically by the archive worker. Returns the partitions created.
+    """
+    created = []
+    today = datetime.utcnow().date()
+    with db_engine.begin() as conn:
+        if not _is_partitioned(conn):
+            return created
+        for offset in range(months_ahead + 1):
+            month = _month_start(today, offset)
+            if _create_month_partition(conn, month):
+                created.append(f"messages_p{month:%Y%m}")
+    return created
+
+
+def migrate_partition_messages(db_engine: Engine, batch_size: int) -> None:
+    """
+    Rebuild messages as a table range-partitioned by created_at. Runs in one transaction (the
+    old table is renamed, copied month by month into the new partitions, then dropped), so it
+    either completes or leaves the database untouched; writes to messages wait until it commits.
+    """
+    with db_engine.begin() as conn:
+        if _is_partitioned(conn):
+            return
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+        conn.execute(text("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey"))
+        for index in ("idx_messages_session_created", "idx_messages_body_hash", "idx_messages_content_search"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        conn.execute(text(
+            "CREATE TABLE messages ("
+            " id UUID NOT NULL,"
+            " session_id UUID REFERENCES sessions(id) ON DELETE CASCADE,"
+            " role VARCHAR(20),"
+            " content TEXT,"
+            " body_hash CHAR(64) REFERENCES response_bodies(hash),"
+            " rating VARCHAR(10),"
+            " pinned BOOLEAN DEFAULT FALSE,"
+            " created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+            " PRIMARY KEY (id, created_at)"
+            ") PARTITION BY RANGE (created_at)"
+        ))
+        conn.execute(text("CREATE TABLE messages_default PARTITION OF messages DEFAULT"))
+
+        oldest = conn.execute(text("SELECT min(created_at) FROM messages_unpartitioned")).scalar()
+        today = datetime.utcnow().date()
+        month = _month_start(oldest.date() if oldest else today)
+        last = _month_start(today, PARTITION_MONTHS_AHEAD)
+        copied = 0
+        while month <= last:
+            _create_month_partition(conn, month)
+            result = conn.execute(text(
+                "INSERT INTO messages (id, session_id, role, content, body_hash, rating, pinned, created_at) "
+                "SELECT id, session_id, role, content, body_hash, rating, pinned, created_at "
+                "FROM messages_unpartitioned WHERE created_at >= :lower AND created_at < :upper"
+            ), {"lower": month, "upper": _month_start(month, 1)})
+            copied += result.rowcount
+            print(f"  copied {copied} messages (through {month:%Y-%m})...")
+            month = _month_start(month, 1)
+        # Rows without a timestamp get one; they land in the current month.
+        conn.execute(text(
+            "INSERT INTO messages (id, session_id, role, content, body_hash, rating, pinned, created_at) "
+            "SELECT id, session_id, role, content, body_hash, rating, pinned, CURRENT_TIMESTAMP "
+            "FROM messages_unpartitioned WHERE created_at IS NULL"
+        ))
+
+        conn.execute(text("CREATE INDEX idx_messages_session_created ON messages (session_id, created_at)"))
+        conn.execute(text("CREATE INDEX idx_messages_body_hash ON messages (body_hash)"))
+        conn.execute(text(
+            "CREATE INDEX idx_messages_content_search ON messages USING GIN (to_tsvector('english', content))"
+        ))
+        conn.execute(text("DROP TABLE messages_unpartitioned"))
+
+
+def migrate_session_archive(db_engine: Engine, batch_size: int) -> None:
+    """
+    Cold store for idle sessions (see archive.py).
+    """
+    with db_engine.begin() as conn:
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP"))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS archived_sessions ("
+            " session_id UUID PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,"
+            " payload BYTEA NOT NULL,"
+            " message_count INTEGER NOT NULL,"
+            " raw_bytes BIGINT NOT NULL,"
+            " archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+
+
+def migrate_session_activity(db_engine: Engine, batch_size: int) -> None:
+    """
+    Session summary columns (see session_activity.py), backfilled in batches of sessions.
+    """
+    with db_engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE sessions"
+            " ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0,"
+            " ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP,"
+            " ADD COLUMN IF NOT EXISTS last_message_role VARCHAR(20),"
+            " ADD COLUMN IF NOT EXISTS last_message_preview VARCHAR(255),"
+            " ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP"
+        ))
+
+    from .session_activity import PREVIEW_CHARS, REFRESH_SQL
+
+    done = 0
+    while True:
+        with db_engine.begin() as conn:
+            ids = [str(row[0]) for row in conn.execute(text(
+                "SELECT id FROM sessions WHERE last_activity_at IS NULL LIMIT :n"
+            ), {"n": batch_size})]
+            if not ids:
+                break
+            conn.execute(REFRESH_SQL, {"ids": ids, "chars": PREVIEW_CHARS})
+        done += len(ids)
+        print(f"  summarized {done} sessions...")
+
+    with db_engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE sessions ALTER COLUMN last_activity_at SET DEFAULT CURRENT_TIMESTAMP,"
+            " ALTER COLUMN last_activity_at SET NOT NULL"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_sessions_user_activity"
+            " ON sessions (user_id, last_activity_at DESC, id DESC)"
+        ))
+
+
+# (version, description, function) in the order they must be applied.
+MIGRATIONS: List[Tuple[str, str, Callable[[Engine, int], None]]] = [
+    ("0000_feature_tables", "batch jobs, session summaries and message embeddings", migrate_feature_tables),
+    ("0001_response_bodies", "content-addressed assistant responses", migrate_response_bodies),
+    ("0002_partition_messages", "range-partition messages by created_at", migrate_partition_messages),
+    ("0003_session_archive", "cold store for idle sessions", migrate_session_archive),
+    ("0004_session_activity", "session message counts and last activity", migrate_session_activity),
+]
+
+
+def applied_versions(db_engine: Engine) -> set:
+    with db_engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version VARCHAR(255) PRIMARY KEY,"
+            " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate(db_engine: Engine = maintenance_engine, batch_size: int = MIGRATION_BATCH_SIZE) -> List[str]:
+    """
+    Apply pending migrations in order, then make sure upcoming partitions exist.
+    Returns the versions applied.
+    """
+    done = applied_versions(db_engine)
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        print(f"Applying {version}: {description}")
+        start = time.time()
+        fn(db_engine, batch_size)
+        with db_engine.begin() as conn:
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+        print(f"Applied {version} in {time.time() - start:.1f}s")
+        applied.append(version)
+    for name in ensure_partitions(db_engine):
+        print(f"Created partition {name}")
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--list", action="store_true", help="show applied and pending migrations")
+    parser.add_argument("--partitions", action="store_true", help="only create upcoming messages partitions")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+    if args.partitions:
+        created = ensure_partitions(maintenance_engine)
+        print(f"Created partitions: {', '.join(created)}" if created else "Partitions are up to date.")
+        return
+    if args.list:
+        done = applied_versions(maintenance_engine)
+        for version, description, _ in MIGRATIONS:
+            print(f"{'applied' if version in done else 'pending':8} {version}  {description}")
+        return
+    if not migrate(maintenance_engine, args.batch_size):
+        print("Database is up to date.")
+
+
+if __name__ == "__main__":
+    main()
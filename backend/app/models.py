@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Boolean, ForeignKey, DateTime, Text, text
+from sqlalchemy import Column, String, Boolean, ForeignKey, DateTime, Text, Integer, BigInteger, LargeBinary, func, select, text
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -20,17 +21,133 @@ class Session(Base):
     title = Column(String)
     created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+    archived_at = Column(DateTime, nullable=True)  # messages moved to archived_sessions (see archive.py)
+    # Summary of the session's messages, maintained with every insert / delete (session_activity.py)
+    message_count = Column(Integer, default=0)
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_role = Column(String, nullable=True)
+    last_message_preview = Column(String, nullable=True)
+    last_activity_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     
-    messages = relationship("Message", back_populates="session", cascade="all, delete")
+    # Children are removed by ON DELETE CASCADE in the database; the ORM does not load them first.
+    messages = relationship("Message", back_populates="session", cascade="all, delete", passive_deletes=True)
+    summary = relationship(
+        "SessionSummary", uselist=False, back_populates="session", cascade="all, delete", passive_deletes=True
+    )
 
 class Message(Base):
     __tablename__ = "messages"
+    # The table's primary key is (id, created_at) because it is partitioned by created_at;
+    # ids are still unique, so the ORM identifies rows by id alone.
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id", ondelete="CASCADE"))
     role = Column(String) # 'user' or 'assistant'
-    content = Column(Text)
+    # Text stored on the row itself (user messages, imported or not yet deduplicated rows).
+    inline_content = Column("content", Text)
+    # Assistant responses reference a shared body instead (see content_store.py).
+    body_hash = Column(String(64), ForeignKey("response_bodies.hash"), nullable=True)
     rating = Column(String, nullable=True) # 'up' or 'down'
     pinned = Column(Boolean, default=False)
     created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
 
     session = relationship("Session", back_populates="messages")
+    body = relationship("ResponseBody", lazy="joined")
+
+    @hybrid_property
+    def content(self):
+        return self.body.content if self.body is not None else self.inline_content
+
+    @content.setter
+    def content(self, value):
+        self.inline_content = value
+
+    @content.expression
+    def content(cls):
+        return func.coalesce(
+            select(ResponseBody.content).where(ResponseBody.hash == cls.body_hash).scalar_subquery(),
+            cls.inline_content,
+        )
+
+class ResponseBody(Base):
+    """
+    Unique assistant response text keyed by its SHA-256, shared by every message with that answer
+    (a popular cached answer is stored once, not once per cache hit).
+    """
+    __tablename__ = "response_bodies"
+    hash = Column(String(64), primary_key=True)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+class SessionSummary(Base):
+    """
+    Rolling summary of a session's older turns, maintained by the compaction worker.
+    Messages up to and including summarized_until are represented by the summary in prompts;
+    the messages themselves are never modified.
+    """
+    __tablename__ = "session_summaries"
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id", ondelete="CASCADE"), primary_key=True)
+    summary = Column(Text)
+    summarized_until = Column(DateTime)
+    summarized_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+    session = relationship("Session", back_populates="summary")
+
+class ArchivedSession(Base):
+    """
+    Cold copy of an idle session's messages: one zlib-compressed JSON document, moved back into
+    messages (partitioned, hot) the next time the session is opened.
+    """
+    __tablename__ = "archived_sessions"
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id", ondelete="CASCADE"), primary_key=True)
+    payload = Column(LargeBinary, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(BigInteger, nullable=False)
+    archived_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+class MessageEmbedding(Base):
+    """
+    Embedding of one message for retrieval over session history (float32 vector bytes).
+    Keyed by message id without a foreign key to messages; removed with its session via the
+    session FK, or explicitly when a single message is deleted.
+    """
+    __tablename__ = "message_embeddings"
+    message_id = Column(UUID(as_uuid=True), primary_key=True)
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id", ondelete="CASCADE"), nullable=False)
+    model = Column(String, nullable=False)
+    vector = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+class BatchJob(Base):
+    __tablename__ = "batch_jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True))
+    model = Column(String)
+    max_tokens = Column(Integer, default=256)
+    status = Column(String, default="queued") # 'queued', 'running', 'completed' or 'cancelled'
+    total_items = Column(Integer, default=0)
+    completed_items = Column(Integer, default=0)
+    failed_items = Column(Integer, default=0)
+    cached_items = Column(Integer, default=0)
+    tokens_generated = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    items = relationship("BatchItem", back_populates="job", passive_deletes=True)
+
+class BatchItem(Base):
+    __tablename__ = "batch_items"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(UUID(as_uuid=True), ForeignKey("batch_jobs.id", ondelete="CASCADE"))
+    idx = Column(Integer) # line number in the submitted NDJSON
+    custom_id = Column(String, nullable=True)
+    prompt = Column(Text)
+    status = Column(String, default="pending") # 'pending', 'done' or 'failed'
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    cached = Column(Boolean, default=False)
+    tokens = Column(Integer, default=0)
+    completed_at = Column(DateTime, nullable=True)
+
+    job = relationship("BatchJob", back_populates="items")
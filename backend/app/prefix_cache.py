@@ -0,0 +1,220 @@
+"""
+Shared-prefix KV snapshots.
+
+Every chat prompt starts with the same tokens: the chat template preamble, the configured
+SYSTEM_PROMPT and any fixed preambles from PREFIX_PREAMBLES_FILE (a JSON list of message
+lists). When a model is loaded, each prefix is evaluated once and the llama state is kept in
+memory and saved under PREFIX_CACHE_DIR (as plain .npz arrays, never pickles); after a restart
+the file is loaded instead of re-evaluating. Only the KV state and the last row of the logits
+buffer are kept; at most PREFIX_CACHE_MAX_SNAPSHOTS are kept per model and their size counts
+towards MODEL_RAM_BUDGET_MB. Snapshots are on by default only when a SYSTEM_PROMPT or
+PREFIX_PREAMBLES_FILE is configured (PREFIX_CACHE=1/0 overrides). Before a request whose messages start with a cached prefix, the snapshot is
+restored (unless the context already holds it), so only the session-specific tokens are
+evaluated.
+"""
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+import llama_cpp
+from llama_cpp import Llama
+
+SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "")
+PREFIX_PREAMBLES_FILE = os.getenv("PREFIX_PREAMBLES_FILE", "")
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "1" if SYSTEM_PROMPT or PREFIX_PREAMBLES_FILE else "0") == "1"
+PREFIX_CACHE_DIR = os.getenv(
+    "PREFIX_CACHE_DIR",
+    os.path.join(os.getenv("MODELS_DIR", "/app/models"), ".prefix_cache"),
+)
+PREFIX_CACHE_MAX_SNAPSHOTS = int(os.getenv("PREFIX_CACHE_MAX_SNAPSHOTS", "4"))
+
+
+def system_messages() -> List[dict]:
+    """
+    Messages every chat prompt starts with (empty when no SYSTEM_PROMPT is configured).
+    """
+    return [{"role": "system", "content": SYSTEM_PROMPT}] if SYSTEM_PROMPT else []
+
+
+def configured_prefixes() -> List[List[dict]]:
+    """
+    Prefixes to snapshot: the system prompt (or, without one, the bare chat template preamble)
+    plus the preambles file.
+    """
+    prefixes = [system_messages()]
+    if PREFIX_PREAMBLES_FILE:
+        try:
+            with open(PREFIX_PREAMBLES_FILE) as f:
+                for prefix in json.load(f):
+                    if prefix and all(isinstance(m, dict) and "role" in m and "content" in m for m in prefix):
+                        prefixes.append(prefix)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read prefix preambles from {PREFIX_PREAMBLES_FILE}: {e}")
+    return prefixes
+
+
+def _common_prefix_length(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(len(a), len(b))
+    mismatch = np.nonzero(a[:n] != b[:n])[0]
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+def _trimmed(state) -> llama_cpp.LlamaState:
+    """
+    Copy of `state` keeping only the last logits row instead of the whole n_ctx x n_vocab buffer
+    (load_state broadcasts it over the restored tokens).
+    """
+    return llama_cpp.LlamaState(
+        input_ids=state.input_ids,
+        scores=np.array(state.scores[-1:], dtype=np.single),
+        n_tokens=state.n_tokens,
+        llama_state=state.llama_state,
+        llama_state_size=state.llama_state_size,
+        seed=getattr(state, "seed", None),
+    )
+
+
+def _save_state(path: str, n_tokens: int, state: llama_cpp.LlamaState) -> None:
+    arrays = {
+        "n_tokens": np.array(n_tokens),
+        "input_ids": state.input_ids,
+        "scores": state.scores,
+        "state_n_tokens": np.array(state.n_tokens),
+        "llama_state": np.frombuffer(state.llama_state, dtype=np.uint8),
+        "llama_state_size": np.array(state.llama_state_size),
+    }
+    if getattr(state, "seed", None) is not None:
+        arrays["seed"] = np.array(state.seed)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _load_state(path: str):
+    """
+    Read a snapshot written by _save_state. Returns (n_tokens, LlamaState); only raw arrays are
+    read, so a tampered file cannot run code.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        fields = {
+            "input_ids": data["input_ids"],
+            "scores": data["scores"],
+            "n_tokens": int(data["state_n_tokens"]),
+            "llama_state": data["llama_state"].tobytes(),
+            "llama_state_size": int(data["llama_state_size"]),
+        }
+        if "seed" in data.files:
+            fields["seed"] = int(data["seed"])
+        return int(data["n_tokens"]), _trimmed(llama_cpp.LlamaState(**fields))
+
+
+class PrefixSnapshot:
+    def __init__(self, messages: List[dict], n_tokens: int, state):
+        self.messages = messages
+        self.n_tokens = n_tokens  # tokens shared by every prompt starting with `messages`
+        self.state = state  # llama_cpp.LlamaState after evaluating them
+        self.token_ids = np.array(state.input_ids[:n_tokens])
+
+    @property
+    def nbytes(self) -> int:
+        return self.state.input_ids.nbytes + self.state.scores.nbytes + self.state.llama_state_size
+
+
+class PrefixCache:
+    """
+    Snapshots for one loaded model. restore() must be called with the model's inference lock held.
+    """
+
+    def __init__(self, snapshots: List[PrefixSnapshot]):
+        # Longest prefixes first, so the most specific snapshot wins.
+        self.snapshots = sorted(snapshots, key=lambda s: len(s.messages), reverse=True)
+        self.restores = 0
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the snapshots (counted towards the model's RAM budget).
+        """
+        return sum(s.nbytes for s in self.snapshots)
+
+    @classmethod
+    def build(cls, llm: Llama, model_path: str, prefixes: Optional[List[List[dict]]] = None) -> "PrefixCache":
+        if not PREFIX_CACHE:
+            return cls([])
+        snapshots = []
+        prefixes = prefixes if prefixes is not None else configured_prefixes()
+        if len(prefixes) > PREFIX_CACHE_MAX_SNAPSHOTS:
+            print(
+                f"Warning: {len(prefixes)} prompt prefixes configured, only the first "
+                f"{PREFIX_CACHE_MAX_SNAPSHOTS} are snapshotted (PREFIX_CACHE_MAX_SNAPSHOTS)"
+            )
+            prefixes = prefixes[:PREFIX_CACHE_MAX_SNAPSHOTS]
+        for messages in prefixes:
+            try:
+                snapshots.append(cls._load_or_evaluate(llm, model_path, messages))
+            except Exception as e:
+                print(f"Warning: prefix snapshot failed ({e}); prompts will be evaluated in full")
+        return cls(snapshots)
+
+    @staticmethod
+    def _file_path(model_path: str, messages: List[dict]) -> str:
+        try:
+            stat = os.stat(model_path)
+            model_id = f"{stat.st_size}:{int(stat.st_mtime)}"
+        except OSError:
+            model_id = ""
+        key = json.dumps(
+            [os.path.basename(model_path), model_id, llama_cpp.__version__, messages],
+            sort_keys=True,
+        )
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(PREFIX_CACHE_DIR, f"{name}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.npz")
+
+    @classmethod
+    def _load_or_evaluate(cls, llm: Llama, model_path: str, messages: List[dict]) -> PrefixSnapshot:
+        path = cls._file_path(model_path, messages)
+        if os.path.exists(path):
+            try:
+                n_tokens, state = _load_state(path)
+                llm.load_state(state)  # also checks the state fits this context
+                print(f"Loaded prefix snapshot ({n_tokens} tokens) from {path}")
+                return PrefixSnapshot(messages, n_tokens, state)
+            except Exception as e:
+                print(f"Ignoring unusable prefix snapshot {path}: {e}")
+
+        # Evaluate the prefix followed by two different user turns: the tokens both prompts
+        # share are exactly what any prompt starting with this prefix shares.
+        llm.reset()
+        llm.create_chat_completion(messages=messages + [{"role": "user", "content": "a"}], max_tokens=1)
+        first = np.array(llm.input_ids[: llm.n_tokens])
+        llm.create_chat_completion(messages=messages + [{"role": "user", "content": "b"}], max_tokens=1)
+        n_tokens = _common_prefix_length(first, np.array(llm.input_ids[: llm.n_tokens]))
+        state = _trimmed(llm.save_state())
+
+        try:
+            os.makedirs(PREFIX_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            _save_state(tmp_path, n_tokens, state)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not save prefix snapshot to {path}: {e}")
+        print(f"Evaluated prefix snapshot ({n_tokens} tokens)")
+        return PrefixSnapshot(messages, n_tokens, state)
+
+    def restore(self, llm: Llama, messages: List[dict]) -> bool:
+        """
+        Load the snapshot of the longest cached prefix of `messages` unless the context already
+        starts with it. Returns True if a snapshot was restored.
+        """
+        for snapshot in self.snapshots:
+            k = len(snapshot.messages)
+            if messages[:k] != snapshot.messages or len(messages) <= k:
+                continue
+            n = snapshot.n_tokens
+            if llm.n_tokens >= n and np.array_equal(llm.input_ids[:n], snapshot.token_ids):
+                return False
+            llm.load_state(snapshot.state)
+            self.restores += 1
+            return True
+        return False
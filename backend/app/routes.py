@@ -1,21 +1,48 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response
+from anyio import from_thread
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
+from sqlalchemy import delete, select, text, tuple_, update
+from typing import List, Optional
 import uuid
+import hashlib
 import json
 import time
+import os
+from datetime import datetime
+import redis
 
 from . import models, schemas
-from .database import get_db
+from .database import get_db, open_session, pool_stats, SessionLocal
 from .cache import CacheService
-from .auth import hash_password, verify_password, create_token, verify_token
-import os
-from llama_cpp import Llama
-
-MODEL_PATH = os.getenv("MODEL_PATH", "/app/models/qwen2.5-1.5b-instruct-q4_k_m.gguf")
-N_THREADS = int(os.getenv("N_THREADS", "4"))
-llm = None
+from .auth import (
+    hash_password,
+    verify_password,
+    create_token,
+    get_current_user_id,
+    auth_throttle,
+    AuthBusyError,
+)
+from .llm import model_registry, stream_chat_completion, ModelNotReadyError, UnknownModelError
+from .cancellation import CancelToken, GenerationCancelled
+from .admission import AdmissionController, AdmissionRejected
+from . import batches
+from .context import build_messages
+from .content_store import assistant_message
+from .session_activity import record_messages, refresh_sessions, touch_sessions
+from .embeddings import embedding_store
+from .compaction import compaction_worker
+from .archive import archive_worker, rehydrate_session
+from .cache_warming import cache_warmer
+
+MAX_TOKENS = 512
+# Sampling parameters for chat; part of the cache key together with the model and context.
+GENERATION_PARAMS = {"max_tokens": MAX_TOKENS, "temperature": 0.2}
+# Server-side generation deadline when the request does not set timeout_ms (matches nginx proxy_read_timeout).
+CHAT_TIMEOUT_MS = int(os.getenv("CHAT_TIMEOUT_MS", "600000"))
+# Upper bound for message_ids in one bulk operation (filters are unbounded).
+BULK_MAX_IDS = 1000
+SESSIONS_PAGE_MAX = 200
 
 # Global Monitoring Stats
 START_TIME = time.time()
@@ -24,27 +51,16 @@ STATS = {
     "cache_hits": 0,
     "cache_misses": 0,
     "total_tokens": 0,
-    "total_latency_ms": 0
+    "total_latency_ms": 0,
+    "cancelled_requests": 0,
+    "tokens_saved": 0,
+    "rate_limited_requests": 0,
+    "shed_requests": 0,
 }
 
-# Initialize Llama model if file exists
-if os.path.exists(MODEL_PATH):
-    print(f"Loading local LLM from {MODEL_PATH} with {N_THREADS} threads...")
-    try:
-        llm = Llama(
-            model_path=MODEL_PATH,
-            n_ctx=2048,      # Context window size
-            n_threads=N_THREADS,     # Number of CPU threads to use
-            verbose=False
-        )
-        print("Model loaded successfully.")
-    except Exception as e:
-        print(f"Failed to load model: {e}")
-else:
-    print(f"Warning: Model file not found at {MODEL_PATH}")
-
 router = APIRouter(prefix="/api/v1")
 cache_service = CacheService()
+admission = AdmissionController(cache_service.redis_client)
 
 
 @router.get("/health")
@@ -55,14 +71,177 @@ def health():
     return {"status": "ok"}
 
 
+@router.get("/ready")
+def ready():
+    """
+    Readiness probe: 200 once a model is loaded and warmed up, 503 before that.
+    """
+    status = model_registry.get(load=False).status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not_ready", **status})
+    return {"status": "ready", **status}
+
+
 # ============ Auth Endpoints ============
 
+def _throttle_auth(http_request: Request, email: str) -> None:
+    """
+    Reject bursts of register/login attempts per client IP and per email before any bcrypt work.
+    """
+    client_ip = http_request.client.host if http_request.client else "unknown"
+    retry_after = auth_throttle.hit(f"ip:{client_ip}", f"email:{email.lower()}")
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many authentication attempts",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+def _run_password_op(fn, *args):
+    """
+    Run a bcrypt operation on the bounded process pool, mapping a full queue to 503.
+    """
+    try:
+        return fn(*args)
+    except AuthBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
+def get_user_db(current_user_id: uuid.UUID = Depends(get_current_user_id)):
+    """
+    Primary session for authenticated routes. Its commits keep the user's reads on the primary
+    for a few seconds (read-your-writes when a read replica is configured).
+    """
+    db = open_session(sticky_key=str(current_user_id))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_db(current_user_id: uuid.UUID = Depends(get_current_user_id)):
+    """
+    Session for read-only routes: served by the read replica (if configured) unless the user
+    has just written something.
+    """
+    db = open_session(sticky_key=str(current_user_id), read_only=True)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_admin_user_id(
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+) -> uuid.UUID:
+    """
+    Authenticated user with role 'admin'; everyone else gets 403.
+    """
+    role = db.query(models.User.role).filter(models.User.id == current_user_id).scalar()
+    if role != "admin":
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return current_user_id
+
+
+def _get_owned_session(db: Session, session_id: uuid.UUID, user_id: uuid.UUID) -> models.Session:
+    """
+    Load a session belonging to the current user; other users' sessions are reported as not found.
+    """
+    session = (
+        db.query(models.Session)
+        .filter(models.Session.id == session_id, models.Session.user_id == user_id)
+        .first()
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if session.archived_at is not None:
+        # Idle session moved to the cold store: bring its messages back before using it
+        # (a write, so read-only sessions switch to the primary).
+        db.use_primary()
+        rehydrate_session(db, session)
+    return session
+
+
+def _history_etag(session: models.Session, *extra: str) -> str:
+    """
+    Weak ETag of a session's history, from the activity columns on the session row (message
+    count, last message time, updated_at), so no message rows are read to compute it.
+    """
+    parts = [
+        str(session.id),
+        str(session.message_count or 0),
+        session.last_message_at.isoformat() if session.last_message_at else "",
+        session.updated_at.isoformat() if session.updated_at else "",
+        *extra,
+    ]
+    return f'W/"{hashlib.sha1("|".join(parts).encode()).hexdigest()}"'
+
+
+def _not_modified(http_request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Set the ETag on the response; return a 304 response if the client already has this version.
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    response.headers.update(headers)
+    if_none_match = http_request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def _get_owned_message(db: Session, message_id: uuid.UUID, user_id: uuid.UUID) -> models.Message:
+    """
+    Load a message whose session belongs to the current user.
+    """
+    message = (
+        db.query(models.Message)
+        .join(models.Session, models.Session.id == models.Message.session_id)
+        .filter(models.Message.id == message_id, models.Session.user_id == user_id)
+        .first()
+    )
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
+
+
+def _map_rating(val) -> str:
+    """
+    Support both numeric (1-5) and string ('up'/'down') ratings for compatibility.
+    """
+    if isinstance(val, int):
+        if not (1 <= val <= 5):
+            raise HTTPException(status_code=400, detail="Invalid numeric rating. Must be 1-5")
+        # Map numeric scale to 'up'/'down' for storage (>=4 => up, <=2 => down, 3 => up)
+        return 'up' if val >= 3 else 'down'
+    if isinstance(val, str):
+        if val not in ['up', 'down']:
+            raise HTTPException(status_code=400, detail="Invalid rating. Use 'up' or 'down'")
+        return val
+    raise HTTPException(status_code=400, detail="Invalid rating type")
+
+
+def _index_messages(db: Session, messages: List[models.Message]) -> None:
+    """
+    Store embeddings for newly saved messages (used by retrieval context mode).
+    Failures are logged only: the messages themselves are already committed.
+    """
+    try:
+        embedding_store.add_messages(db, messages)
+    except Exception as e:
+        db.rollback()
+        print(f"Failed to index messages for retrieval: {e}")
+
+
 @router.post("/auth/register", response_model=schemas.AuthResponse)
-def register(req: schemas.RegisterRequest, db: Session = Depends(get_db)):
+def register(req: schemas.RegisterRequest, http_request: Request, db: Session = Depends(get_db)):
     """
     Register a new user.
     Email must be unique.
     """
+    _throttle_auth(http_request, req.email)
+
     # 检查邮箱是否已存在
     existing = db.query(models.User).filter(models.User.email == req.email).first()
     if existing:
@@ -70,7 +249,7 @@ def register(req: schemas.RegisterRequest, db: Session = Depends(get_db)):
     
     # 创建新用户
     user_id = str(uuid.uuid4())
-    hashed_pwd = hash_password(req.password)
+    hashed_pwd = _run_password_op(hash_password, req.password)
     
     new_user = models.User(
         id=uuid.UUID(user_id),
@@ -93,18 +272,20 @@ def register(req: schemas.RegisterRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/auth/login", response_model=schemas.AuthResponse)
-def login(req: schemas.LoginRequest, db: Session = Depends(get_db)):
+def login(req: schemas.LoginRequest, http_request: Request, db: Session = Depends(get_db)):
     """
     Login with email and password.
     Returns JWT token if successful.
     """
+    _throttle_auth(http_request, req.email)
+
     # 查找用户
     user = db.query(models.User).filter(models.User.email == req.email).first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # 验证密码
-    if not verify_password(req.password, user.password_hash):
+    if not _run_password_op(verify_password, req.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # 生成 token
@@ -122,7 +303,12 @@ def login(req: schemas.LoginRequest, db: Session = Depends(get_db)):
 # 1. Chat
 # ======================
 @router.post("/chat", response_model=schemas.ChatResponse)
-def chat(request: schemas.ChatRequest, db: Session = Depends(get_db)):
+def chat(
+    request: schemas.ChatRequest,
+    http_request: Request,
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
     Handle a chat request:
     - Validate that the session exists.
@@ -131,28 +317,41 @@ def chat(request: schemas.ChatRequest, db: Session = Depends(get_db)):
         * Save both user and assistant messages to DB (for history).
         * Return cached answer.
     - If not cached:
-        * Generate a stub response.
+        * Generate a response with the local LLM (503 while the model is still loading).
+        * Abort generation between tokens if the client disconnects or timeout_ms passes;
+          nothing is saved or cached for an aborted generation.
         * Save both user and assistant messages to DB.
         * Cache the assistant response.
     """
     start_ts = time.time()
     STATS["total_requests"] += 1
 
-    # Check if session exists
-    session = (
-        db.query(models.Session)
-        .filter(models.Session.id == request.session_id)
-        .first()
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    # Check if session exists and belongs to the caller
+    _get_owned_session(db, request.session_id, current_user_id)
+
+    try:
+        model_name = model_registry.resolve(request.model)
+    except UnknownModelError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # 1. Try Redis cache
-    cached_response = cache_service.get(request.session_id, request.prompt)
+    # Per-user / per-session rate limits apply to cache hits as well.
+    try:
+        admission.admit(current_user_id, request.session_id)
+    except AdmissionRejected as e:
+        STATS["rate_limited_requests"] += 1
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+    # Conversation context: rolling summary of older turns (if compacted) + recent turns
+    # (or recent + retrieved turns in retrieval mode) + prompt
+    messages_payload = build_messages(db, request.session_id, request.prompt, request.context_mode)
+
+    # 1. Try Redis cache, keyed by the effective context (global tier for context-free prompts)
+    cached_response = cache_service.get(model_name, messages_payload, GENERATION_PARAMS, request.session_id)
 
     if cached_response:
         # Cache hit: still persist the interaction to DB to keep a complete history.
         STATS["cache_hits"] += 1
+        admission.record_cache_hit(current_user_id)
         STATS["total_latency_ms"] += (time.time() - start_ts) * 1000
 
         # Save user message
@@ -163,63 +362,78 @@ def chat(request: schemas.ChatRequest, db: Session = Depends(get_db)):
         )
         db.add(user_msg)
 
-        # Save assistant message (from cache)
-        assistant_msg = models.Message(
-            session_id=request.session_id,
-            role="assistant",
-            content=cached_response,
-        )
+        # Save assistant message (from cache); it references the shared body, not a copy
+        assistant_msg = assistant_message(db, request.session_id, cached_response)
         db.add(assistant_msg)
+        record_messages(db, request.session_id, [("user", request.prompt), ("assistant", cached_response)])
         db.commit()
         db.refresh(assistant_msg)
         db.refresh(user_msg)
+        _index_messages(db, [user_msg, assistant_msg])
 
         return schemas.ChatResponse(
             message_id=assistant_msg.id,
             user_message_id=user_msg.id,
             content=cached_response,
             cached=True,
+            model=model_name,
         )
 
 
     # 2. Cache miss: call local LLM
     STATS["cache_misses"] += 1
-    
-    if llm is None:
-        # If model not loaded, return error message
-        generated_content = f"Error: Local LLM not loaded. Please check if {MODEL_PATH} exists."
-    else:
-        try:
-            # Fetch conversation history from DB to provide context
-            history_msgs = (
-                db.query(models.Message)
-                .filter(models.Message.session_id == request.session_id)
-                .order_by(models.Message.created_at.asc())
-                .all()
-            )
-            
-            # Build messages list for LLM context
-            messages_payload = [
-                {"role": msg.role, "content": msg.content} for msg in history_msgs
-            ]
-            # Add the current prompt
-            messages_payload.append({"role": "user", "content": request.prompt})
-
-            completion = llm.create_chat_completion(
-                messages=messages_payload,
-                max_tokens=512,
-                temperature=0.2,
+
+    # Shed load before queueing if the model is too backed up to answer in reasonable time.
+    try:
+        admission.check_load(model_registry.get(model_name, load=False).expected_wait_seconds())
+    except AdmissionRejected as e:
+        STATS["shed_requests"] += 1
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+    # End the read transaction so its pooled connection is not held idle while queued and
+    # generating; the session opens a new one to save the reply.
+    db.commit()
+
+    generation_failed = False
+    try:
+        # Checked while queued for the model and between generated tokens.
+        cancel = CancelToken(
+            timeout_ms=request.timeout_ms or CHAT_TIMEOUT_MS,
+            is_disconnected=lambda: from_thread.run(http_request.is_disconnected),
+        )
+        with model_registry.acquire(model_name, cancel=cancel, messages=messages_payload) as (manager, llm):
+            gen_start = time.time()
+            generated_content, completion_tokens, _ = stream_chat_completion(
+                llm, messages_payload, cancel.on_token, **GENERATION_PARAMS
             )
-            # Extract assistant text
-            generated_content = completion["choices"][0]["message"]["content"] or ""
-            
-            # Track tokens
-            usage = completion.get("usage", {})
-            STATS["total_tokens"] += usage.get("total_tokens", 0)
-            
-        except Exception as e:
-            # On error, produce a safe fallback and continue
-            generated_content = f"(LLM error) {str(e)}"
+            manager.record_generation(completion_tokens, time.time() - gen_start)
+            context_tokens = llm.n_tokens  # prompt + completion
+        cancel.check()
+
+        # Track tokens
+        STATS["total_tokens"] += context_tokens
+        admission.record_generation(current_user_id, request.session_id, completion_tokens)
+
+    except GenerationCancelled as e:
+        STATS["cancelled_requests"] += 1
+        admission.record_generation(current_user_id, request.session_id, cancel.tokens_generated)
+        STATS["tokens_saved"] += max(MAX_TOKENS - cancel.tokens_generated, 0)
+        STATS["total_latency_ms"] += (time.time() - start_ts) * 1000
+        if e.reason == "timeout":
+            raise HTTPException(status_code=504, detail="Generation timed out")
+        # 499: client closed the request; nobody is reading this response.
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except ModelNotReadyError as e:
+        # Nothing is persisted or cached, so the client can simply retry once /ready passes.
+        raise HTTPException(
+            status_code=503,
+            detail=f"Local LLM not ready: {e}",
+            headers={"Retry-After": "5"},
+        )
+    except Exception as e:
+        # On error, produce a safe fallback and continue
+        generated_content = f"(LLM error) {str(e)}"
+        generation_failed = True
 
 
     # Save user message
@@ -231,18 +445,18 @@ def chat(request: schemas.ChatRequest, db: Session = Depends(get_db)):
     db.add(user_msg)
 
     # Save assistant message
-    assistant_msg = models.Message(
-        session_id=request.session_id,
-        role="assistant",
-        content=generated_content,
-    )
+    assistant_msg = assistant_message(db, request.session_id, generated_content)
     db.add(assistant_msg)
+    record_messages(db, request.session_id, [("user", request.prompt), ("assistant", generated_content)])
     db.commit()
     db.refresh(assistant_msg)
     db.refresh(user_msg)
+    _index_messages(db, [user_msg, assistant_msg])
 
-    # 3. Cache the response for future identical prompts in this session (TTL: 1 hour)
-    cache_service.set(request.session_id, request.prompt, generated_content, 3600)
+    # 3. Cache the response for future requests with the same context (TTL: 1 hour).
+    # Error fallbacks are never cached, least of all in the shared global tier.
+    if not generation_failed:
+        cache_service.set(model_name, messages_payload, GENERATION_PARAMS, generated_content, request.session_id, 3600)
 
     STATS["total_latency_ms"] += (time.time() - start_ts) * 1000
 
@@ -251,6 +465,7 @@ def chat(request: schemas.ChatRequest, db: Session = Depends(get_db)):
         user_message_id=user_msg.id,
         content=generated_content,
         cached=False,
+        model=model_name,
     )
 
 
@@ -259,15 +474,16 @@ def chat(request: schemas.ChatRequest, db: Session = Depends(get_db)):
 # ======================
 @router.post("/sessions", response_model=schemas.SessionResponse)
 def create_session(
-    session: schemas.SessionCreate, db: Session = Depends(get_db)
+    session: schemas.SessionCreate,
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
 ):
     """
     Create a new chat session for a given user.
+    The user must be the authenticated caller.
     """
-    # Optionally, you can enforce user existence check here:
-    # user = db.query(models.User).filter(models.User.id == session.user_id).first()
-    # if not user:
-    #     raise HTTPException(status_code=404, detail="User not found")
+    if session.user_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Cannot create sessions for another user")
 
     new_session = models.Session(
         user_id=session.user_id,
@@ -280,30 +496,61 @@ def create_session(
 
 
 @router.get("/sessions", response_model=List[schemas.SessionResponse])
-def list_sessions(user_id: uuid.UUID, db: Session = Depends(get_db)):
+def list_sessions(
+    user_id: uuid.UUID,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
-    List all sessions belonging to a given user.
+    List sessions belonging to a given user, most recently active first, with message counts
+    and a preview of the last message (one query on idx_sessions_user_activity).
+    The user must be the authenticated caller.
+    Pass `limit` to page: the next page's cursor is returned in the X-Next-Cursor header.
     """
-    sessions = (
-        db.query(models.Session)
-        .filter(models.Session.user_id == user_id)
-        .all()
-    )
+    if user_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Cannot list another user's sessions")
+    query = db.query(models.Session).filter(models.Session.user_id == user_id)
+    if cursor:
+        try:
+            activity, last_id = cursor.split("|", 1)
+            activity, last_id = datetime.fromisoformat(activity), uuid.UUID(last_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            tuple_(models.Session.last_activity_at, models.Session.id) < tuple_(activity, last_id)
+        )
+    query = query.order_by(models.Session.last_activity_at.desc(), models.Session.id.desc())
+    if limit is None:
+        return query.all()
+
+    limit = max(1, min(limit, SESSIONS_PAGE_MAX))
+    sessions = query.limit(limit + 1).all()
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        response.headers["X-Next-Cursor"] = f"{last.last_activity_at.isoformat()}|{last.id}"
     return sessions
 
 
 @router.get("/sessions/{session_id}", response_model=schemas.SessionDetail)
-def get_session(session_id: uuid.UUID, db: Session = Depends(get_db)):
+def get_session(
+    session_id: uuid.UUID,
+    http_request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
     Retrieve a single session by its ID.
+    Supports If-None-Match: returns 304 when the session and its messages are unchanged.
     """
-    session = (
-        db.query(models.Session)
-        .filter(models.Session.id == session_id)
-        .first()
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_owned_session(db, session_id, current_user_id)
+    not_modified = _not_modified(http_request, response, _history_etag(session, session.title or ""))
+    if not_modified is not None:
+        return not_modified
     return session
 
 
@@ -311,21 +558,17 @@ def get_session(session_id: uuid.UUID, db: Session = Depends(get_db)):
 def update_session(
     session_id: uuid.UUID,
     update: schemas.SessionUpdate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
 ):
     """
     Update a session's title.
     """
-    session = (
-        db.query(models.Session)
-        .filter(models.Session.id == session_id)
-        .first()
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_owned_session(db, session_id, current_user_id)
     
     if update.title is not None:
         session.title = update.title
+        session.updated_at = datetime.utcnow()
     
     db.commit()
     db.refresh(session)
@@ -333,20 +576,19 @@ def update_session(
 
 
 @router.delete("/sessions/{session_id}")
-def delete_session(session_id: uuid.UUID, db: Session = Depends(get_db)):
+def delete_session(
+    session_id: uuid.UUID,
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
     Delete a session by its ID.
     """
-    session = (
-        db.query(models.Session)
-        .filter(models.Session.id == session_id)
-        .first()
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_owned_session(db, session_id, current_user_id)
 
     db.delete(session)
     db.commit()
+    embedding_store.forget_session(session_id)
     return {"status": "deleted", "id": str(session_id)}
 
 
@@ -358,18 +600,20 @@ def delete_session(session_id: uuid.UUID, db: Session = Depends(get_db)):
     response_model=List[schemas.MessageResponse],
 )
 def list_session_messages(
-    session_id: uuid.UUID, db: Session = Depends(get_db)
+    session_id: uuid.UUID,
+    http_request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
 ):
     """
     List all messages under a given session, ordered by creation time (ascending).
+    Supports If-None-Match: returns 304 without reading any message when nothing changed.
     """
-    session = (
-        db.query(models.Session)
-        .filter(models.Session.id == session_id)
-        .first()
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    session = _get_owned_session(db, session_id, current_user_id)
+    not_modified = _not_modified(http_request, response, _history_etag(session))
+    if not_modified is not None:
+        return not_modified
 
     messages = (
         db.query(models.Message)
@@ -387,47 +631,45 @@ def list_session_messages(
 def create_message_for_session(
     session_id: uuid.UUID,
     body: schemas.MessageCreate,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
 ):
     """
     Create a new message under a given session.
     Can be used to import messages with any role.
     """
-    session = (
-        db.query(models.Session)
-        .filter(models.Session.id == session_id)
-        .first()
-    )
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    _get_owned_session(db, session_id, current_user_id)
 
     # Validate role
     if body.role not in ["user", "assistant"]:
         raise HTTPException(status_code=400, detail="Role must be 'user' or 'assistant'")
 
-    msg = models.Message(
-        session_id=session_id,
-        role=body.role,
-        content=body.content,
-    )
+    if body.role == "assistant":
+        msg = assistant_message(db, session_id, body.content)
+    else:
+        msg = models.Message(
+            session_id=session_id,
+            role=body.role,
+            content=body.content,
+        )
     db.add(msg)
+    record_messages(db, session_id, [(body.role, body.content)])
     db.commit()
     db.refresh(msg)
+    _index_messages(db, [msg])
     return msg
 
 
 @router.get("/messages/{message_id}", response_model=schemas.MessageResponse)
-def get_message(message_id: uuid.UUID, db: Session = Depends(get_db)):
+def get_message(
+    message_id: uuid.UUID,
+    db: Session = Depends(get_read_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
     Retrieve a single message by its ID.
     """
-    message = (
-        db.query(models.Message)
-        .filter(models.Message.id == message_id)
-        .first()
-    )
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    message = _get_owned_message(db, message_id, current_user_id)
     return message
 
 
@@ -435,34 +677,16 @@ def get_message(message_id: uuid.UUID, db: Session = Depends(get_db)):
 def rate_message(
     message_id: uuid.UUID,
     rating: schemas.RatingRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
 ):
     """
     Rate a message with a score between 1 and 5.
     """
-    message = (
-        db.query(models.Message)
-        .filter(models.Message.id == message_id)
-        .first()
-    )
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    message = _get_owned_message(db, message_id, current_user_id)
 
-    # Support both numeric (1-5) and string ('up'/'down') ratings for compatibility.
-    val = rating.rating
-    if isinstance(val, int):
-        if not (1 <= val <= 5):
-            raise HTTPException(status_code=400, detail="Invalid numeric rating. Must be 1-5")
-        # Map numeric scale to 'up'/'down' for storage (>=4 => up, <=2 => down, 3 => up)
-        mapped = 'up' if val >= 3 else 'down'
-    elif isinstance(val, str):
-        if val not in ['up', 'down']:
-            raise HTTPException(status_code=400, detail="Invalid rating. Use 'up' or 'down'")
-        mapped = val
-    else:
-        raise HTTPException(status_code=400, detail="Invalid rating type")
-
-    message.rating = mapped
+    message.rating = _map_rating(rating.rating)
+    touch_sessions(db, [message.session_id])
     db.commit()
     db.refresh(message)
 
@@ -470,42 +694,108 @@ def rate_message(
 
 
 @router.post("/messages/{message_id}/pin")
-def pin_message(message_id: uuid.UUID, db: Session = Depends(get_db)):
+def pin_message(
+    message_id: uuid.UUID,
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
     Toggle the 'pinned' state of a message.
     """
-    message = (
-        db.query(models.Message)
-        .filter(models.Message.id == message_id)
-        .first()
-    )
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    message = _get_owned_message(db, message_id, current_user_id)
 
     # Toggle pinned flag
     message.pinned = not message.pinned
+    touch_sessions(db, [message.session_id])
     db.commit()
     return {"status": "toggled", "pinned": message.pinned}
 
 
 @router.post("/messages/{message_id}/delete")
-def delete_message(message_id: uuid.UUID, db: Session = Depends(get_db)):
+def delete_message(
+    message_id: uuid.UUID,
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
     """
     Delete a message by its ID.
     """
-    message = (
-        db.query(models.Message)
-        .filter(models.Message.id == message_id)
-        .first()
-    )
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    message = _get_owned_message(db, message_id, current_user_id)
 
+    session_id = message.session_id
     db.delete(message)
+    db.flush()
+    embedding_store.delete_messages(db, [message_id])
+    refresh_sessions(db, [session_id])
     db.commit()
     return {"status": "deleted", "id": str(message_id)}
 
 
+@router.post("/messages/bulk", response_model=schemas.BulkMessageResponse)
+def bulk_message_operation(
+    body: schemas.BulkMessageRequest,
+    db: Session = Depends(get_user_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
+    """
+    Rate, pin, unpin or delete many messages with one set-based UPDATE / DELETE ... RETURNING.
+    Messages are addressed by `message_ids` (any of the caller's sessions) or by `filter`
+    (one session); messages of other users are never matched.
+    """
+    if (body.message_ids is None) == (body.filter is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of message_ids or filter")
+
+    if body.message_ids is not None:
+        if len(body.message_ids) > BULK_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_IDS} message ids per request")
+        owned_sessions = select(models.Session.id).where(models.Session.user_id == current_user_id)
+        conditions = [
+            models.Message.session_id.in_(owned_sessions),
+            models.Message.id.in_(body.message_ids),
+        ]
+    else:
+        f = body.filter
+        _get_owned_session(db, f.session_id, current_user_id)
+        conditions = [models.Message.session_id == f.session_id]
+        if f.role is not None:
+            conditions.append(models.Message.role == f.role)
+        if f.pinned is not None:
+            # pinned may be NULL on old rows, which counts as not pinned
+            conditions.append(models.Message.pinned.is_(True) if f.pinned else models.Message.pinned.isnot(True))
+        if f.rating == "none":
+            conditions.append(models.Message.rating.is_(None))
+        elif f.rating is not None:
+            conditions.append(models.Message.rating == f.rating)
+        if f.before is not None:
+            conditions.append(models.Message.created_at < f.before)
+        if f.after is not None:
+            conditions.append(models.Message.created_at > f.after)
+
+    if body.action == "delete":
+        stmt = delete(models.Message).where(*conditions)
+    else:
+        if body.action == "rate":
+            if body.rating is None:
+                raise HTTPException(status_code=400, detail="rating is required for action 'rate'")
+            values = {"rating": _map_rating(body.rating)}
+        else:
+            values = {"pinned": body.action == "pin"}
+        stmt = update(models.Message).where(*conditions).values(**values)
+
+    rows = db.execute(
+        stmt.returning(models.Message.id, models.Message.session_id),
+        execution_options={"synchronize_session": False},
+    ).all()
+    ids = [row[0] for row in rows]
+    if body.action == "delete":
+        embedding_store.delete_messages(db, ids)
+        refresh_sessions(db, [row[1] for row in rows])
+    else:
+        touch_sessions(db, [row[1] for row in rows])
+    db.commit()
+    return schemas.BulkMessageResponse(action=body.action, affected=len(ids), ids=ids)
+
+
 # ======================
 # 4. Search
 # ======================
@@ -514,13 +804,24 @@ def delete_message(message_id: uuid.UUID, db: Session = Depends(get_db)):
     response_model=schemas.SearchResponse,
 )
 def search_messages(
-    session_id: uuid.UUID, q: str, db: Session = Depends(get_db)
+    session_id: uuid.UUID,
+    q: str,
+    http_request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
 ):
     """
     Search messages within a session for exact keyword matches.
     Searches both user and assistant messages.
     Returns a list of matching Message objects.
+    Supports If-None-Match (the ETag covers the session history and the query).
     """
+    session = _get_owned_session(db, session_id, current_user_id)
+    not_modified = _not_modified(http_request, response, _history_etag(session, q))
+    if not_modified is not None:
+        return not_modified
+
     if not q or not q.strip():
         # Empty or whitespace-only query returns no results.
         return schemas.SearchResponse(results=[])
@@ -555,6 +856,12 @@ def get_system_stats():
     hits = STATS["cache_hits"]
     rate = (hits / total) if total > 0 else 0.0
     avg_lat = (STATS["total_latency_ms"] / total) if total > 0 else 0.0
+    default_model = model_registry.get(load=False)
+    try:
+        cache_tiers = cache_service.tier_stats()
+    except redis.RedisError as e:
+        print(f"Failed to read cache tier stats: {e}")
+        cache_tiers = {}
     
     return schemas.SystemStats(
         uptime_seconds=uptime,
@@ -563,20 +870,220 @@ def get_system_stats():
         cache_misses=STATS["cache_misses"],
         cache_hit_rate=rate,
         total_tokens_generated=STATS["total_tokens"],
+        cancelled_requests=STATS["cancelled_requests"],
+        tokens_saved=STATS["tokens_saved"],
+        rate_limited_requests=STATS["rate_limited_requests"],
+        shed_requests=STATS["shed_requests"],
+        compacted_sessions=compaction_worker.stats["compacted_sessions"],
+        summarized_messages=compaction_worker.stats["summarized_messages"],
+        archived_sessions=archive_worker.stats["archived_sessions"],
+        rehydrated_sessions=archive_worker.stats["rehydrated_sessions"],
+        cache_tiers=cache_tiers,
+        db_pools=pool_stats(),
         avg_latency_ms=avg_lat,
-        model_loaded=(llm is not None),
-        model_path=MODEL_PATH
+        model_loaded=default_model.ready,
+        model_path=default_model.model_path,
+        model_state=default_model.state,
+        model_load_seconds=default_model.load_seconds,
+        models=[schemas.ModelStats(**m) for m in model_registry.stats()],
     )
 
 
+@router.get("/models", response_model=schemas.ModelList)
+def list_models():
+    """
+    List the models that can be selected in ChatRequest.model.
+    """
+    return schemas.ModelList(
+        default=model_registry.default_model,
+        models=list(model_registry.available().keys()),
+    )
+
+
+def _model_file(name_or_path: str) -> str:
+    """
+    Resolve a reload target to a known model's file or a .gguf file inside MODELS_DIR.
+    """
+    known = model_registry.available()
+    if name_or_path in known:
+        return known[name_or_path]
+    models_dir = os.path.realpath(model_registry.models_dir)
+    path = os.path.realpath(os.path.join(models_dir, name_or_path))
+    if os.path.commonpath([models_dir, path]) != models_dir or not path.endswith(".gguf"):
+        raise HTTPException(status_code=400, detail="model_path must be a model name or a .gguf file in MODELS_DIR")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Model file not found: {name_or_path}")
+    return path
+
+
+@router.post("/admin/model/reload", status_code=202)
+def reload_model(req: schemas.ModelReloadRequest, _admin_id: uuid.UUID = Depends(get_admin_user_id)):
+    """
+    Hot-reload the model from a new MODEL_PATH without restarting the process (admins only).
+    The current model keeps serving until the new one is loaded and warmed up.
+    """
+    model_path = _model_file(req.model_path) if req.model_path is not None else None
+    if not model_registry.reload(model_path):
+        raise HTTPException(status_code=409, detail="A model load is already in progress")
+    return {"status": "reloading", "model": model_registry.default_model}
+
+
+@router.get("/admin/usage", response_model=List[schemas.UserUsage])
+def get_user_usage(limit: int = 50, _admin_id: uuid.UUID = Depends(get_admin_user_id)):
+    """
+    Per-user usage counters (requests, generations, cache hits, tokens, rejections),
+    heaviest token users first. Admins only.
+    """
+    return admission.usage(limit)
+
+
 @router.post("/admin/cache/clear")
-def clear_cache():
+def clear_cache(_admin_id: uuid.UUID = Depends(get_admin_user_id)):
     """
-    Clear the entire Redis cache.
+    Clear the response cache (rate limits and usage counters are kept). The popular entries are snapshotted first and then
+    regenerated in the background (never reloaded, since a clear usually means stale answers).
     """
     try:
+        cache_warmer.snapshot()
         cache_service.clear_all()
-        return {"status": "success", "message": "Cache cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    cache_warmer.trigger(reason="clear", reload=False)
+    return {"status": "success", "message": "Cache cleared"}
+
+
+@router.get("/admin/cache/warm", response_model=schemas.CacheWarmStatus)
+def get_cache_warm_status(_admin_id: uuid.UUID = Depends(get_admin_user_id)):
+    """
+    Progress of the current (or last) cache warming run.
+    """
+    return schemas.CacheWarmStatus(**cache_warmer.progress, last_snapshot_at=cache_warmer.last_snapshot_at)
+
+
+@router.post("/admin/cache/warm", response_model=schemas.CacheWarmStatus, status_code=202)
+def warm_cache(reload: bool = True, _admin_id: uuid.UUID = Depends(get_admin_user_id)):
+    """
+    Re-create the popular cache entries from the local snapshot in the background.
+    With reload=false every missing entry is regenerated instead of reloaded from the snapshot.
+    """
+    if not cache_warmer.trigger(reason="manual", reload=reload):
+        raise HTTPException(status_code=409, detail="Cache warming is already running")
+    return schemas.CacheWarmStatus(**cache_warmer.progress, last_snapshot_at=cache_warmer.last_snapshot_at)
+
+
+# ======================
+# 6. Batch Jobs
+# ======================
+def _get_owned_batch(db: Session, batch_id: uuid.UUID, user_id: uuid.UUID) -> models.BatchJob:
+    """
+    Load a batch job submitted by the current user.
+    """
+    job = (
+        db.query(models.BatchJob)
+        .filter(models.BatchJob.id == batch_id, models.BatchJob.user_id == user_id)
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return job
+
+
+def _batch_response(job: models.BatchJob) -> schemas.BatchJobResponse:
+    return schemas.BatchJobResponse.model_validate(job).model_copy(update=batches.job_progress(job))
+
+
+@router.post("/batches", response_model=schemas.BatchJobResponse, status_code=202)
+def create_batch(
+    body: bytes = Body(..., media_type="application/x-ndjson"),
+    model: Optional[str] = None,
+    max_tokens: int = 256,
+    db: Session = Depends(get_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
+    """
+    Submit an offline batch of prompts as NDJSON (Content-Type: application/x-ndjson),
+    one {"prompt": "...", "custom_id": "optional"} object per line.
+    Prompts are answered without conversation history, at lower priority than chat:
+    the worker only uses the model while no interactive request is waiting for it.
+    """
+    try:
+        items = batches.parse_ndjson(body)
+        model_name = model_registry.resolve(model)
+    except (batches.BatchInputError, UnicodeDecodeError, UnknownModelError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not (1 <= max_tokens <= MAX_TOKENS):
+        raise HTTPException(status_code=400, detail=f"max_tokens must be between 1 and {MAX_TOKENS}")
+
+    job = batches.create_job(db, current_user_id, model_name, max_tokens, items)
+    return _batch_response(job)
+
+
+@router.get("/batches/{batch_id}", response_model=schemas.BatchJobResponse)
+def get_batch(
+    batch_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
+    """
+    Poll a batch job: progress counters, throughput and ETA.
+    """
+    return _batch_response(_get_owned_batch(db, batch_id, current_user_id))
+
 
+@router.get("/batches/{batch_id}/results")
+def stream_batch_results(
+    batch_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
+    """
+    Stream the finished items of a batch as NDJSON, in submission order.
+    Can be called while the job is still running; pending items are not included yet.
+    """
+    _get_owned_batch(db, batch_id, current_user_id)
+
+    def _generate():
+        # The request's DB session is closed once the response starts, so stream with our own.
+        stream_db = SessionLocal()
+        try:
+            rows = (
+                stream_db.query(models.BatchItem)
+                .filter(
+                    models.BatchItem.job_id == batch_id,
+                    models.BatchItem.status.in_(["done", "failed"]),
+                )
+                .order_by(models.BatchItem.idx.asc())
+                .yield_per(500)
+            )
+            for item in rows:
+                yield json.dumps({
+                    "idx": item.idx,
+                    "custom_id": item.custom_id,
+                    "status": item.status,
+                    "result": item.result,
+                    "error": item.error,
+                    "cached": item.cached,
+                    "tokens": item.tokens,
+                }) + "\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(_generate(), media_type="application/x-ndjson")
+
+
+@router.post("/batches/{batch_id}/cancel", response_model=schemas.BatchJobResponse)
+def cancel_batch(
+    batch_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user_id: uuid.UUID = Depends(get_current_user_id),
+):
+    """
+    Stop a batch job; items already answered stay available in the results.
+    """
+    job = _get_owned_batch(db, batch_id, current_user_id)
+    if job.status in ("queued", "running"):
+        job.status = "cancelled"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(job)
+    return _batch_response(job)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List, Union
+from pydantic import BaseModel, Field
+from typing import Dict, Literal, Optional, List, Union
 from uuid import UUID
 from datetime import datetime
 
@@ -10,6 +10,11 @@ class ChatRequest(BaseModel):
     """
     session_id: UUID
     prompt: str
+    model: Optional[str] = None  # model name from GET /models; None uses the default model
+    # Abort generation after this long; None uses CHAT_TIMEOUT_MS. Capped at nginx's proxy_read_timeout.
+    timeout_ms: Optional[int] = Field(None, gt=0, le=600_000)
+    # "full": every turn after the rolling summary; "retrieval": recent turns + most similar older turns
+    context_mode: Literal["full", "retrieval"] = "full"
 
 
 class ChatResponse(BaseModel):
@@ -21,6 +26,7 @@ class ChatResponse(BaseModel):
     user_message_id: UUID
     content: str
     cached: bool
+    model: Optional[str] = None
 
 
 class SessionCreate(BaseModel):
@@ -40,16 +46,89 @@ class SessionUpdate(BaseModel):
 
 class SessionResponse(BaseModel):
     """
-    Basic session information returned in list and creation responses.
+    Basic session information returned in list and creation responses,
+    with the activity summary (message count, last message preview) kept on the session row.
     """
     id: UUID
     title: Optional[str]
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_role: Optional[str] = None
+    last_message_preview: Optional[str] = None
+    last_activity_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
 
+class ModelStats(BaseModel):
+    """
+    Per-model residency, load time and decode throughput.
+    """
+    name: str
+    path: str
+    size_mb: float
+    state: str
+    resident: bool
+    is_default: bool
+    load_seconds: Optional[float] = None
+    tokens_generated: int
+    tokens_per_second: float
+    n_threads: Optional[int] = None
+    n_batch: Optional[int] = None
+    speculative_mode: str = "off"
+    draft_acceptance_rate: Optional[float] = None
+    prefix_snapshots: int = 0  # shared prompt prefixes with a saved KV state
+    prefix_restores: int = 0
+
+
+class ModelList(BaseModel):
+    """
+    Models available for per-request selection.
+    """
+    default: str
+    models: List[str]
+
+
+class CacheTierStats(BaseModel):
+    """
+    Hit rate of one response cache tier ("global" or "session").
+    """
+    hits: int
+    misses: int
+    hit_rate: float
+
+
+class DbPoolStats(BaseModel):
+    """
+    Connection pool usage of one database engine ("primary" or "replica").
+    """
+    size: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    capacity: int
+
+
+class CacheWarmStatus(BaseModel):
+    """
+    Progress of a cache warming run (entries from the local top-N snapshot).
+    """
+    state: str  # idle | running | done | failed
+    reason: Optional[str] = None  # startup | flush | clear | manual
+    total: int
+    done: int
+    reloaded: int
+    regenerated: int
+    skipped: int
+    failed: int
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    last_snapshot_at: Optional[float] = None
+
+
 class SystemStats(BaseModel):
     """
     System monitoring statistics.
@@ -60,9 +139,43 @@ class SystemStats(BaseModel):
     cache_misses: int
     cache_hit_rate: float
     total_tokens_generated: int
+    cancelled_requests: int = 0
+    tokens_saved: int = 0  # max_tokens budget not spent on cancelled generations
+    rate_limited_requests: int = 0
+    shed_requests: int = 0
+    compacted_sessions: int = 0  # compaction passes written by the background summarizer
+    summarized_messages: int = 0
+    archived_sessions: int = 0  # idle sessions moved to the cold store by this process
+    rehydrated_sessions: int = 0
+    cache_tiers: Dict[str, CacheTierStats] = {}  # shared across workers and batch jobs
+    db_pools: Dict[str, DbPoolStats] = {}
     avg_latency_ms: float
     model_loaded: bool
     model_path: str
+    model_state: str
+    model_load_seconds: Optional[float] = None
+    models: List[ModelStats] = []
+
+
+class ModelReloadRequest(BaseModel):
+    """
+    Request body for hot-reloading the model.
+    model_path is a model name or a .gguf file in MODELS_DIR (relative or absolute);
+    omit it to reload the currently configured file.
+    """
+    model_path: Optional[str] = None
+
+
+class UserUsage(BaseModel):
+    """
+    Per-user usage counters for the admin dashboard.
+    """
+    user_id: str
+    requests: int
+    generations: int
+    cache_hits: int
+    tokens: int
+    rejected: int
 
 
 class MessageCreate(BaseModel):
@@ -106,6 +219,37 @@ class RatingRequest(BaseModel):
     rating: Union[int, str]
 
 
+class MessageFilter(BaseModel):
+    """
+    Selects messages of one session for a bulk operation; unset fields match everything.
+    """
+    session_id: UUID
+    role: Optional[str] = None
+    pinned: Optional[bool] = None
+    rating: Optional[str] = None  # "up", "down" or "none" for unrated
+    before: Optional[datetime] = None
+    after: Optional[datetime] = None
+
+
+class BulkMessageRequest(BaseModel):
+    """
+    One operation over many messages, addressed by ids or by a filter (exactly one of them).
+    """
+    action: Literal["rate", "pin", "unpin", "delete"]
+    rating: Optional[Union[int, str]] = None  # required for "rate"; same values as RatingRequest
+    message_ids: Optional[List[UUID]] = None
+    filter: Optional[MessageFilter] = None
+
+
+class BulkMessageResponse(BaseModel):
+    """
+    Ids of the messages the bulk operation changed.
+    """
+    action: str
+    affected: int
+    ids: List[UUID]
+
+
 class SearchResponse(BaseModel):
     """
     Response structure for search results.
@@ -137,3 +281,27 @@ class AuthResponse(BaseModel):
     email: str
     token: str
 
+
+
+class BatchJobResponse(BaseModel):
+    """
+    Status of a batch completion job, including throughput and ETA.
+    """
+    id: UUID
+    status: str
+    model: str
+    max_tokens: int
+    total_items: int
+    completed_items: int
+    failed_items: int
+    cached_items: int
+    tokens_generated: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    items_per_second: float = 0.0
+    tokens_per_second: float = 0.0
+    eta_seconds: Optional[float] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,79 @@
+from typing import Iterable, List
+from uuid import UUID
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Characters of the last message kept on the session row for list previews.
+PREVIEW_CHARS = 120
+
+# Recompute the summary columns of the given sessions from their messages (after deletes).
+REFRESH_SQL = text("""
+    UPDATE sessions s SET
+        message_count = (SELECT count(*) FROM messages m WHERE m.session_id = s.id),
+        last_message_at = last.created_at,
+        last_message_role = last.role,
+        last_message_preview = left(last.content, :chars),
+        last_activity_at = coalesce(last.created_at, s.created_at, CURRENT_TIMESTAMP),
+        updated_at = CURRENT_TIMESTAMP
+    FROM sessions s2
+    LEFT JOIN LATERAL (
+        SELECT m.created_at, m.role, coalesce(b.content, m.content) AS content
+        FROM messages m
+        LEFT JOIN response_bodies b ON b.hash = m.body_hash
+        WHERE m.session_id = s2.id
+        ORDER BY m.created_at DESC
+        LIMIT 1
+    ) last ON true
+    WHERE s.id = s2.id AND s.id = ANY(CAST(:ids AS uuid[]))
+""")
+
+
+def _preview(content: str) -> str:
+    return (content or "")[:PREVIEW_CHARS]
+
+
+def record_messages(db: Session, session_id: UUID, contents: List[tuple]) -> None:
+    """
+    Account for messages just added to a session, given as (role, content) in insertion order.
+    Runs in the caller's transaction, so the counters commit together with the messages.
+    Messages get CURRENT_TIMESTAMP as created_at, which is also the last activity time here.
+    """
+    if not contents:
+        return
+    role, content = contents[-1]
+    db.query(models.Session).filter(models.Session.id == session_id).update(
+        {
+            models.Session.message_count: func.coalesce(models.Session.message_count, 0) + len(contents),
+            models.Session.last_message_at: func.current_timestamp(),
+            models.Session.last_message_role: role,
+            models.Session.last_message_preview: _preview(content),
+            models.Session.last_activity_at: func.current_timestamp(),
+            models.Session.updated_at: func.current_timestamp(),
+        },
+        synchronize_session=False,
+    )
+
+
+def touch_sessions(db: Session, session_ids: Iterable[UUID]) -> None:
+    """
+    Bump updated_at of sessions whose messages changed in place (rating, pin), so their history
+    ETags change too.
+    """
+    ids = list(set(session_ids))
+    if ids:
+        db.query(models.Session).filter(models.Session.id.in_(ids)).update(
+            {models.Session.updated_at: func.current_timestamp()},
+            synchronize_session=False,
+        )
+
+
+def refresh_sessions(db: Session, session_ids: Iterable[UUID]) -> None:
+    """
+    Recompute counters and last message of sessions that lost messages (in the caller's transaction).
+    """
+    ids = [str(session_id) for session_id in set(session_ids)]
+    if ids:
+        db.execute(REFRESH_SQL, {"ids": ids, "chars": PREVIEW_CHARS})
@@ -0,0 +1,128 @@
+import os
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+# off | prompt_lookup | draft
+# prompt_lookup proposes tokens by matching the last n-gram against the prompt and history,
+# which pays off when replies quote the user. draft runs a small GGUF (same tokenizer family,
+# e.g. qwen2.5-0.5b-instruct for qwen2.5-1.5b-instruct) to propose tokens greedily.
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off")
+SPECULATIVE_NUM_PRED_TOKENS = int(os.getenv("SPECULATIVE_NUM_PRED_TOKENS", "10"))
+SPECULATIVE_MAX_NGRAM_SIZE = int(os.getenv("SPECULATIVE_MAX_NGRAM_SIZE", "2"))
+DRAFT_MODEL_PATH = os.getenv("DRAFT_MODEL_PATH", "")
+DRAFT_N_THREADS = int(os.getenv("DRAFT_N_THREADS", os.getenv("N_THREADS", "4")))
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Draft model backed by a smaller GGUF: greedily decodes num_pred_tokens after the current input.
+    The draft keeps its own KV cache, so only tokens that changed since the last call are evaluated.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int, num_pred_tokens: int = 10):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=DRAFT_N_THREADS,
+            verbose=False,
+        )
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        draft = []
+        # reset=True lets Llama.generate reuse the longest matching prefix of its KV cache.
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+    def close(self) -> None:
+        self.llm.close()
+
+
+class CountingDraftModel(LlamaDraftModel):
+    """
+    Wraps a draft model to count verification passes and proposed tokens.
+    llama.cpp calls the draft once per forward pass of the target model, and each pass yields
+    one token of its own plus every accepted draft token, so
+    accepted = generated tokens - draft calls.
+    """
+
+    def __init__(self, inner: LlamaDraftModel, mode: str):
+        self.inner = inner
+        self.mode = mode
+        self.calls = 0
+        self.drafted_tokens = 0
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        draft = self.inner(input_ids, **kwargs)
+        self.calls += 1
+        self.drafted_tokens += len(draft)
+        return draft
+
+    def acceptance_rate(self, generated_tokens: int) -> float:
+        if self.drafted_tokens == 0:
+            return 0.0
+        accepted = max(generated_tokens - self.calls, 0)
+        return min(accepted / self.drafted_tokens, 1.0)
+
+    def reset(self) -> None:
+        """
+        Forget calls made outside counted generations (warmup, prefix snapshots).
+        """
+        self.calls = 0
+        self.drafted_tokens = 0
+
+    def close(self) -> None:
+        if isinstance(self.inner, GGUFDraftModel):
+            self.inner.close()
+
+
+def draft_model_file(
+    model_path: str,
+    mode: str = SPECULATIVE_MODE,
+    draft_model_path: str = DRAFT_MODEL_PATH,
+) -> Optional[str]:
+    """
+    The separate GGUF file loaded next to a target model as its draft, or None.
+    """
+    if mode != "draft" or not draft_model_path or not os.path.exists(draft_model_path):
+        return None
+    if os.path.abspath(draft_model_path) == os.path.abspath(model_path):
+        return None
+    return draft_model_path
+
+
+def build_draft_model(
+    model_path: str,
+    n_ctx: int,
+    mode: str = SPECULATIVE_MODE,
+    draft_model_path: str = DRAFT_MODEL_PATH,
+    num_pred_tokens: int = SPECULATIVE_NUM_PRED_TOKENS,
+) -> Optional[CountingDraftModel]:
+    """
+    Build the draft model for a target model according to SPECULATIVE_MODE, or None when disabled.
+    """
+    if mode == "prompt_lookup":
+        inner = LlamaPromptLookupDecoding(
+            max_ngram_size=SPECULATIVE_MAX_NGRAM_SIZE,
+            num_pred_tokens=num_pred_tokens,
+        )
+    elif mode == "draft":
+        if not draft_model_path or not os.path.exists(draft_model_path):
+            print(f"Warning: draft model not found at {draft_model_path!r}, speculative decoding disabled")
+            return None
+        if os.path.abspath(draft_model_path) == os.path.abspath(model_path):
+            # The draft model itself is served without a draft.
+            return None
+        inner = GGUFDraftModel(draft_model_path, n_ctx, num_pred_tokens)
+    elif mode == "off":
+        return None
+    else:
+        raise ValueError(f"Unknown SPECULATIVE_MODE '{mode}'")
+    return CountingDraftModel(inner, mode)
@@ -1,4 +1,5 @@
 # app/tests/conftest.py
+import inspect
 import os
 import sys
 import uuid
@@ -6,6 +7,7 @@ from typing import Generator
 
 import pytest
 from fastapi.testclient import TestClient
+from llama_cpp import Llama
 from sqlalchemy.orm import Session
 
 # ------------------ Import path configuration ------------------
@@ -24,6 +26,7 @@ if ROOT_DIR not in sys.path:
 from app.main import app
 from app.database import get_db
 from app.models import User, Session as ChatSession
+from app.auth import create_token
 # --------------------------------------------------------------
 
 
@@ -87,3 +90,84 @@ def setup_test_session(
     db_session.commit()
     db_session.refresh(s)
     return s.id
+
+
+@pytest.fixture(scope="function")
+def auth_headers(setup_test_user: uuid.UUID) -> dict:
+    """
+    Authorization header carrying a JWT for the test user.
+    Session and message routes require it.
+    """
+    return {"Authorization": f"Bearer {create_token(str(setup_test_user))}"}
+
+
+@pytest.fixture(scope="function")
+def admin_headers(db_session: Session) -> dict:
+    """
+    Authorization header for a freshly created user with role 'admin'.
+    """
+    admin = User(
+        email=f"admin_{uuid.uuid4()}@example.com",
+        password_hash="dummy-hash",
+        role="admin",
+    )
+    db_session.add(admin)
+    db_session.commit()
+    db_session.refresh(admin)
+    return {"Authorization": f"Bearer {create_token(str(admin.id))}"}
+
+
+class SignatureCheckedLlama:
+    """
+    Stand-in for llama_cpp.Llama whose methods bind their arguments against the real
+    signatures, so an unsupported keyword argument fails in tests as it would in production.
+    Tokens are bytes; chat completions reply with `reply`, streamed one word per chunk when stream=True.
+    """
+
+    reply = "Hello there, friend"
+
+    def __init__(self, *args, **kwargs):
+        inspect.signature(Llama.__init__).bind(self, *args, **kwargs)
+        self.n_tokens = 0
+        self.chat_calls = []
+
+    def tokenize(self, *args, **kwargs):
+        text = inspect.signature(Llama.tokenize).bind(self, *args, **kwargs).arguments["text"]
+        return list(text)  # one token per byte
+
+    def detokenize(self, *args, **kwargs):
+        return bytes(inspect.signature(Llama.detokenize).bind(self, *args, **kwargs).arguments["tokens"])
+
+    def create_completion(self, *args, **kwargs):
+        inspect.signature(Llama.create_completion).bind(self, *args, **kwargs)
+        return {"choices": [{"text": "ok"}], "usage": {"completion_tokens": 1, "total_tokens": 2}}
+
+    def create_chat_completion(self, *args, **kwargs):
+        arguments = inspect.signature(Llama.create_chat_completion).bind(self, *args, **kwargs).arguments
+        self.chat_calls.append(arguments)
+        words = self.reply.split(" ")
+        self.n_tokens = 10 + len(words)
+        if not arguments.get("stream"):
+            return {
+                "choices": [{"message": {"role": "assistant", "content": self.reply}}],
+                "usage": {"completion_tokens": len(words), "total_tokens": self.n_tokens},
+            }
+
+        def _chunks():
+            yield {"choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]}
+            for i, word in enumerate(words):
+                yield {"choices": [{"delta": {"content": word if i == 0 else f" {word}"}, "finish_reason": None}]}
+            yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+        return _chunks()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="function")
+def signature_checked_llama():
+    """
+    The SignatureCheckedLlama class (patch it in for llama_cpp.Llama).
+    """
+    return SignatureCheckedLlama
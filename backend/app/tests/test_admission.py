@@ -0,0 +1,84 @@
+# app/tests/test_admission.py
+import uuid
+
+import pytest
+import redis
+from fastapi.testclient import TestClient
+
+from app import admission as admission_module
+from app.admission import AdmissionController, AdmissionRejected
+from app.cache import CacheService
+
+API_PREFIX = "/api/v1"
+
+
+@pytest.fixture
+def controller() -> AdmissionController:
+    return AdmissionController(CacheService().redis_client)
+
+
+def test_request_bucket_limits_per_user_and_session(controller, monkeypatch):
+    """
+    The request bucket rejects with 429 and a Retry-After once the per-user budget is spent;
+    another user is unaffected.
+    """
+    monkeypatch.setattr(admission_module, "RATE_USER_RPM", 2)
+    user_id, session_id = uuid.uuid4(), uuid.uuid4()
+    controller.admit(user_id, session_id)
+    controller.admit(user_id, session_id)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.admit(user_id, session_id)
+    assert exc.value.status_code == 429
+    assert 1 <= exc.value.retry_after <= 60
+
+    controller.admit(uuid.uuid4(), uuid.uuid4())
+    usage = {row["user_id"]: row for row in controller.usage(limit=10000)}[str(user_id)]
+    assert (usage["requests"], usage["rejected"]) == (2, 1)
+
+
+def test_token_bucket_blocks_after_generation_overdraws_it(controller, monkeypatch):
+    """
+    Generated tokens are debited after the fact; an overdrawn token bucket blocks the next request.
+    """
+    monkeypatch.setattr(admission_module, "RATE_SESSION_TPM", 100)
+    user_id, session_id = uuid.uuid4(), uuid.uuid4()
+    controller.admit(user_id, session_id)
+    controller.record_generation(user_id, session_id, 150)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.admit(user_id, session_id)
+    assert exc.value.status_code == 429
+    controller.admit(user_id, uuid.uuid4())  # the user's own budget is not exhausted
+
+
+def test_check_load_sheds_only_past_the_wait_threshold(controller, monkeypatch):
+    monkeypatch.setattr(admission_module, "SHED_WAIT_SECONDS", 10)
+    controller.check_load(10)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.check_load(12.5)
+    assert (exc.value.status_code, exc.value.retry_after) == (503, 3)
+
+
+def test_admission_fails_open_without_redis():
+    unreachable = redis.Redis(host="localhost", port=1, socket_connect_timeout=0.1)
+    AdmissionController(unreachable).admit(uuid.uuid4(), uuid.uuid4())
+
+
+def test_cache_clear_keeps_rate_limits_and_usage(controller):
+    cache = CacheService()
+    user_id, session_id = uuid.uuid4(), uuid.uuid4()
+    controller.admit(user_id, session_id)
+    cache.set("m", [{"role": "user", "content": f"hello {user_id}"}], {"max_tokens": 1}, "hi")
+
+    cache.clear_all()
+    assert cache.get("m", [{"role": "user", "content": f"hello {user_id}"}], {"max_tokens": 1}) is None
+    assert cache.redis_client.exists(f"rl:req:user:{user_id}")
+    assert cache.redis_client.exists(f"usage:user:{user_id}")
+
+
+def test_usage_requires_admin(test_client: TestClient, auth_headers, admin_headers):
+    """
+    /admin/usage is refused to anonymous and regular users.
+    """
+    assert test_client.get(f"{API_PREFIX}/admin/usage").status_code == 401
+    assert test_client.get(f"{API_PREFIX}/admin/usage", headers=auth_headers).status_code == 403
+    assert test_client.get(f"{API_PREFIX}/admin/usage", headers=admin_headers).status_code == 200
@@ -0,0 +1,107 @@
+# app/tests/test_archive.py
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import models
+from app.archive import ArchiveWorker, archive_session, rehydrate_session
+from app.content_store import assistant_message
+from app.embeddings import embedding_store
+
+API_PREFIX = "/api/v1"
+
+
+def test_idle_session_is_archived_and_rehydrated_on_access(
+    test_client: TestClient, db_session, setup_test_session, auth_headers
+):
+    """
+    Archiving moves an idle session's messages to the cold store; listing the session's
+    messages transparently brings them back unchanged.
+    """
+    old = datetime.utcnow() - timedelta(days=90)
+    user_msg = models.Message(session_id=setup_test_session, role="user", content="old question", created_at=old)
+    bot_msg = assistant_message(db_session, setup_test_session, "old answer")
+    bot_msg.created_at = old + timedelta(seconds=1)
+    bot_msg.pinned = True
+    db_session.add_all([user_msg, bot_msg])
+    db_session.commit()
+
+    assert archive_session(db_session, setup_test_session, datetime.utcnow() - timedelta(days=30)) == 2
+    assert db_session.query(models.Message).filter(models.Message.session_id == setup_test_session).count() == 0
+
+    resp = test_client.get(f"{API_PREFIX}/sessions/{setup_test_session}/messages", headers=auth_headers)
+    assert resp.status_code == 200
+    msgs = resp.json()
+    assert [m["content"] for m in msgs] == ["old question", "old answer"]
+    assert msgs[1]["pinned"] is True
+
+    db_session.expire_all()
+    session = db_session.get(models.Session, setup_test_session)
+    assert session.archived_at is None
+    assert db_session.get(models.ArchivedSession, setup_test_session) is None
+
+
+def test_active_session_is_not_archived(db_session, setup_test_session):
+    db_session.add(models.Message(session_id=setup_test_session, role="user", content="recent"))
+    db_session.commit()
+    assert archive_session(db_session, setup_test_session, datetime.utcnow() - timedelta(days=30)) == 0
+
+
+def test_candidates_come_from_session_activity(db_session, setup_test_user):
+    """
+    Idle sessions are found through sessions.last_activity_at; empty or recently active sessions
+    are not candidates.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=30)
+    old = cutoff - timedelta(days=1)
+    idle = models.Session(user_id=setup_test_user, message_count=3, last_activity_at=old)
+    empty = models.Session(user_id=setup_test_user, message_count=0, last_activity_at=old)
+    active = models.Session(user_id=setup_test_user, message_count=3, last_activity_at=datetime.utcnow())
+    db_session.add_all([idle, empty, active])
+    db_session.commit()
+
+    candidates = ArchiveWorker.find_candidates(db_session, cutoff, limit=10000)
+    assert idle.id in candidates
+    assert empty.id not in candidates and active.id not in candidates
+
+
+def test_rehydrated_session_is_not_archived_again(db_session, setup_test_session):
+    """
+    Rehydrating counts as activity, so the next archive run does not pick the session again.
+    """
+    old = datetime.utcnow() - timedelta(days=90)
+    db_session.add(models.Message(session_id=setup_test_session, role="user", content="old", created_at=old))
+    db_session.commit()
+    cutoff = datetime.utcnow() - timedelta(days=30)
+    assert archive_session(db_session, setup_test_session, cutoff) == 1
+
+    session = db_session.get(models.Session, setup_test_session)
+    assert rehydrate_session(db_session, session)
+    db_session.expire_all()
+    assert db_session.get(models.Session, setup_test_session).message_count == 1
+    assert setup_test_session not in ArchiveWorker.find_candidates(db_session, cutoff, limit=10000)
+
+
+def test_archived_and_deleted_sessions_leave_the_embedding_cache(
+    test_client: TestClient, db_session, setup_test_session, auth_headers
+):
+    """
+    Archiving or deleting a session drops its cached embedding matrix.
+    """
+    msg = models.Message(
+        session_id=setup_test_session, role="user", content="old", created_at=datetime.utcnow() - timedelta(days=90)
+    )
+    db_session.add(msg)
+    db_session.commit()
+    embedding_store.add_messages(db_session, [msg])
+    embedding_store.search(db_session, setup_test_session, "old", 1)
+    assert setup_test_session in embedding_store._matrices
+
+    assert archive_session(db_session, setup_test_session, datetime.utcnow() - timedelta(days=30)) == 1
+    assert setup_test_session not in embedding_store._matrices
+
+    embedding_store.search(db_session, setup_test_session, "old", 1)
+    assert setup_test_session in embedding_store._matrices
+    resp = test_client.delete(f"{API_PREFIX}/sessions/{setup_test_session}", headers=auth_headers)
+    assert resp.status_code == 200
+    assert setup_test_session not in embedding_store._matrices
@@ -0,0 +1,36 @@
+# app/tests/test_auth.py
+import uuid
+
+from fastapi.testclient import TestClient
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from app import routes
+from app.auth import AttemptThrottle
+from app.main import app
+
+API_PREFIX = "/api/v1"
+
+
+def _login(client: TestClient, forwarded_for: str):
+    return client.post(
+        f"{API_PREFIX}/auth/login",
+        json={"email": f"nobody_{uuid.uuid4()}@example.com", "password": "wrong-password"},
+        headers={"X-Forwarded-For": forwarded_for},
+    )
+
+
+def test_auth_throttle_is_per_client_ip_behind_proxy(monkeypatch):
+    """
+    Behind nginx every request comes from the proxy; uvicorn's --proxy-headers restores the
+    client address from X-Forwarded-For, so one client hitting the limit does not lock out others.
+    """
+    monkeypatch.setattr(routes, "auth_throttle", AttemptThrottle(max_attempts=2, window_seconds=60))
+    client = TestClient(ProxyHeadersMiddleware(app, trusted_hosts="*"))
+
+    assert _login(client, "203.0.113.7").status_code == 401
+    assert _login(client, "203.0.113.7").status_code == 401
+    blocked = _login(client, "203.0.113.7")
+    assert blocked.status_code == 429
+    assert int(blocked.headers["Retry-After"]) > 0
+
+    assert _login(client, "198.51.100.20").status_code == 401
@@ -0,0 +1,79 @@
+# app/tests/test_autotune.py
+from app import autotune
+from app import llm as llm_module
+from app.llm import ModelManager
+
+
+def _result(n_threads, n_batch, turn_seconds):
+    return {
+        "n_threads": n_threads,
+        "n_batch": n_batch,
+        "prompt_tokens_per_second": 100.0,
+        "decode_tokens_per_second": 10.0,
+        "turn_seconds": turn_seconds,
+    }
+
+
+def test_config_is_saved_and_loaded_per_model(tmp_path, monkeypatch):
+    """
+    Stored configs round-trip through AUTOTUNE_FILE, are keyed by model file and ignored with AUTOTUNE=off.
+    """
+    monkeypatch.setattr(autotune, "AUTOTUNE_FILE", str(tmp_path / ".autotune.json"))
+    monkeypatch.setattr(autotune, "AUTOTUNE", "use")
+    model = tmp_path / "a.gguf"
+    model.write_bytes(b"gguf")
+    other = tmp_path / "b.gguf"
+    other.write_bytes(b"gguf")
+
+    assert autotune.load_config(str(model)) is None
+    autotune.save_config(str(model), {"n_threads": 6, "n_batch": 256})
+    assert autotune.load_config(str(model)) == {"n_threads": 6, "n_batch": 256}
+    assert autotune.load_config(str(other)) is None
+
+    model.write_bytes(b"gguf, but re-quantized")  # a different file invalidates the config
+    assert autotune.load_config(str(model)) is None
+
+    (tmp_path / ".autotune.json").write_text("not json")
+    assert autotune.load_config(str(model)) is None
+
+    monkeypatch.setattr(autotune, "AUTOTUNE", "off")
+    autotune.save_config(str(model), {"n_threads": 6, "n_batch": 256})
+    assert autotune.load_config(str(model)) is None
+
+
+def test_autotune_picks_fastest_turn_and_survives_unwritable_file(tmp_path, monkeypatch):
+    """
+    The fastest combination wins; failing combinations are skipped and a config that cannot be
+    saved is still returned.
+    """
+    monkeypatch.setattr(autotune, "AUTOTUNE_FILE", str(tmp_path / "missing-dir" / ".autotune.json"))
+    timings = {(2, 256): 3.0, (4, 256): 1.5, (4, 512): 2.0}
+
+    def fake_benchmark(model_path, n_threads, n_batch):
+        if (n_threads, n_batch) not in timings:
+            raise RuntimeError("out of memory")
+        return _result(n_threads, n_batch, timings[(n_threads, n_batch)])
+
+    monkeypatch.setattr(autotune, "benchmark", fake_benchmark)
+    config = autotune.autotune("model.gguf", threads=[2, 4], batches=[256, 512])
+    assert (config["n_threads"], config["n_batch"]) == (4, 256)
+
+
+def test_failed_startup_autotune_falls_back_to_env(tmp_path, monkeypatch):
+    """
+    With AUTOTUNE=startup, a benchmark that fails does not fail the model load.
+    """
+    monkeypatch.setattr(autotune, "AUTOTUNE_FILE", str(tmp_path / ".autotune.json"))
+    monkeypatch.setattr(autotune, "AUTOTUNE", "startup")
+    monkeypatch.setattr(autotune, "benchmark", lambda *args: (_ for _ in ()).throw(RuntimeError("no model")))
+
+    params = ModelManager(str(tmp_path / "model.gguf"))._runtime_params(str(tmp_path / "model.gguf"))
+    assert params == {"n_threads": llm_module.N_THREADS, "n_batch": llm_module.N_BATCH, "source": "env"}
+
+
+def test_benchmark_prompt_exceeds_largest_batch():
+    """
+    n_batch only changes prompt evaluation when the prompt spans more than one batch.
+    """
+    assert autotune.BENCH_PROMPT_TOKENS > max(autotune.DEFAULT_BATCH_GRID)
+    assert autotune.BENCH_PROMPT_TOKENS + autotune.BENCH_DECODE_TOKENS <= autotune.BENCH_N_CTX
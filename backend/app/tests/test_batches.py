@@ -0,0 +1,112 @@
+# app/tests/test_batches.py
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import batches
+from app import llm as llm_module
+from app import prefix_cache
+from app.llm import ModelRegistry
+from app.batches import BatchInputError, parse_ndjson
+
+API_PREFIX = "/api/v1"
+
+
+def test_parse_ndjson_skips_blank_lines_and_validates():
+    """
+    One object per line; blank lines are ignored and bad lines are reported by number.
+    """
+    body = b'{"prompt": "a", "custom_id": 1}\n\n{"prompt": "b"}\n'
+    assert parse_ndjson(body) == [
+        {"prompt": "a", "custom_id": "1"},
+        {"prompt": "b", "custom_id": None},
+    ]
+
+    with pytest.raises(BatchInputError, match="Line 2"):
+        parse_ndjson(b'{"prompt": "a"}\n{"text": "no prompt"}\n')
+    with pytest.raises(BatchInputError):
+        parse_ndjson(b"\n\n")
+
+
+def test_batch_submit_and_poll(test_client: TestClient, auth_headers):
+    """
+    A submitted batch is queued with one item per line and can be polled and streamed.
+    """
+    lines = "\n".join(json.dumps({"prompt": f"summarize {i}", "custom_id": f"c{i}"}) for i in range(3))
+    resp = test_client.post(
+        f"{API_PREFIX}/batches",
+        content=lines,
+        headers={**auth_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 202
+    job = resp.json()
+    assert job["total_items"] == 3
+    assert job["status"] in ("queued", "running", "completed")
+
+    resp = test_client.get(f"{API_PREFIX}/batches/{job['id']}", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["id"] == job["id"]
+
+    resp = test_client.get(f"{API_PREFIX}/batches/{job['id']}/results", headers=auth_headers)
+    assert resp.status_code == 200
+
+    resp = test_client.post(f"{API_PREFIX}/batches/{job['id']}/cancel", headers=auth_headers)
+    assert resp.status_code == 200
+
+
+def test_failing_item_does_not_block_the_queue(db_session, setup_test_user, monkeypatch):
+    """
+    A generation error (e.g. a prompt longer than the context window) fails that item only,
+    and the worker moves on to the next one.
+    """
+    def _generate(messages, **kwargs):
+        if "too long" in messages[-1]["content"]:
+            raise ValueError("Requested tokens exceed context window")
+        return "ok", 1
+
+    monkeypatch.setattr(batches.model_registry, "generate_background", _generate)
+    monkeypatch.setattr(batches.cache_service, "get", lambda *args, **kwargs: None)
+    monkeypatch.setattr(batches.cache_service, "set", lambda *args, **kwargs: True)
+    job = batches.create_job(
+        db_session, setup_test_user, "m", 16,
+        [{"prompt": "too long " * 10, "custom_id": "a"}, {"prompt": "short", "custom_id": "b"}],
+    )
+
+    for _ in range(50):
+        db_session.refresh(job)
+        if job.status == "completed" or not batches.batch_worker.process_next():
+            break
+
+    db_session.refresh(job)
+    items = sorted(job.items, key=lambda item: item.idx)
+    assert job.status == "completed"
+    assert (items[0].status, items[1].status) == ("failed", "done")
+    assert "context window" in items[0].error
+    assert items[0].completed_at is not None
+    assert items[1].result == "ok"
+
+
+def test_batch_item_is_generated_through_the_model_registry(
+    db_session, setup_test_user, signature_checked_llama, tmp_path, monkeypatch
+):
+    """
+    Items are answered by ModelRegistry.generate_background calling llama-cpp with its real
+    signature, so they complete instead of failing on the generation call.
+    """
+    monkeypatch.setattr(llm_module, "Llama", signature_checked_llama)
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", False)
+    (tmp_path / "batch-model.gguf").write_bytes(b"gguf")
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "batch-model.gguf"), ram_budget_mb=64)
+    monkeypatch.setattr(batches, "model_registry", registry)
+    monkeypatch.setattr(batches.cache_service, "get", lambda *args, **kwargs: None)
+    monkeypatch.setattr(batches.cache_service, "set", lambda *args, **kwargs: True)
+    assert registry.get().wait_ready(5)
+
+    job = batches.create_job(db_session, setup_test_user, "batch-model", 16, [{"prompt": "hi", "custom_id": "a"}])
+    assert batches.batch_worker.process_next()
+
+    db_session.refresh(job)
+    item = job.items[0]
+    assert (item.status, item.result, item.error) == ("done", signature_checked_llama.reply, None)
+    assert item.tokens == 3
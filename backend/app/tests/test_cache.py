@@ -0,0 +1,116 @@
+# app/tests/test_cache.py
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import cache_warming
+from app.cache import CacheService, GLOBAL_TIER, SESSION_TIER, cache_tier
+from app.cache_warming import CacheWarmer
+
+PARAMS = {"max_tokens": 512, "temperature": 0.2}
+
+
+def test_context_free_prompts_share_the_global_tier():
+    """
+    A first-turn prompt maps to the same key in every session; once there is history the key
+    depends on the session and on the history itself.
+    """
+    cache = CacheService()  # key generation does not touch Redis
+    first_turn = [{"role": "user", "content": "what is X? "}]
+    assert cache_tier(first_turn) == GLOBAL_TIER
+    assert cache._generate_key("m", first_turn, PARAMS, uuid.uuid4()) == \
+        cache._generate_key("m", [{"role": "user", "content": "what is X?"}], PARAMS, uuid.uuid4())
+
+    session_id = uuid.uuid4()
+    history_a = [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": "what is X?"},
+    ]
+    history_b = history_a[:1] + [{"role": "assistant", "content": "hey there"}] + history_a[2:]
+    assert cache_tier(history_a) == SESSION_TIER
+    key_a = cache._generate_key("m", history_a, PARAMS, session_id)
+    assert key_a != cache._generate_key("m", history_b, PARAMS, session_id)
+    assert key_a != cache._generate_key("m", history_a, PARAMS, uuid.uuid4())
+    assert key_a != cache._generate_key("m", history_a, {**PARAMS, "temperature": 0.7}, session_id)
+    assert key_a != cache._generate_key("other", history_a, PARAMS, session_id)
+
+
+class FakeCache:
+    """
+    In-memory stand-in for the CacheService methods the warmer uses.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.values = {}
+        self.warm = False
+
+    def top_entries(self, n):
+        return self.entries[:n]
+
+    def trim_popular(self, keep):
+        pass
+
+    def exists(self, key):
+        return key in self.values
+
+    def restore_entry(self, entry, value):
+        self.values[entry["key"]] = value
+
+    def mark_warm(self):
+        self.warm = True
+
+
+def test_warmer_reloads_and_regenerates_snapshot_entries(tmp_path, monkeypatch):
+    """
+    After a flush, snapshot entries with a value are reloaded, the others regenerated from
+    their recipe; a clear (reload=False) regenerates everything. An entry whose regeneration
+    fails is counted as failed without ending the run.
+    """
+    monkeypatch.setattr(cache_warming, "CACHE_WARM_FILE", str(tmp_path / "warm.json"))
+    recipe = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "params": PARAMS}
+    entries = [
+        {"key": "cache:global:a", "hits": 9, "value": "cached a", "recipe": recipe},
+        {"key": "cache:session:s", "hits": 5, "value": "private", "recipe": recipe},
+        {"key": "cache:global:b", "hits": 3, "value": None, "recipe": recipe},
+        {"key": "cache:global:d", "hits": 2, "value": None, "recipe": {**recipe, "messages": [{"role": "user", "content": "too long"}]}},
+        {"key": "cache:global:c", "hits": 1, "value": None, "recipe": None},
+    ]
+    generated = []
+
+    def _generate(messages, **kwargs):
+        if messages[0]["content"] == "too long":
+            raise ValueError("Requested tokens exceed context window")
+        generated.append(messages)
+        return "fresh", 1
+
+    monkeypatch.setattr(cache_warming.model_registry, "generate_background", _generate)
+
+    warmer = CacheWarmer(FakeCache(entries))
+    # Entries with neither value nor recipe are not kept, session-tier entries never are.
+    assert warmer.snapshot() == 3
+
+    flushed = FakeCache([])
+    warmer.cache = flushed
+    assert warmer.snapshot() == 0  # an empty ranking keeps the previous snapshot
+    progress = warmer.warm("flush")
+    assert (progress["reloaded"], progress["regenerated"], progress["failed"], progress["state"]) == (1, 1, 1, "done")
+    assert flushed.values == {"cache:global:a": "cached a", "cache:global:b": "fresh"}
+    assert flushed.warm
+
+    cleared = FakeCache([])
+    warmer.cache = cleared
+    progress = warmer.warm("clear", reload=False)
+    assert (progress["regenerated"], progress["failed"]) == (2, 1)
+    assert set(cleared.values.values()) == {"fresh"}
+
+
+def test_cache_admin_endpoints_require_admin(test_client: TestClient, auth_headers):
+    """
+    Clearing and warming the cache can start model generations, so only admins may call them.
+    """
+    for method, path in (("post", "/admin/cache/clear"), ("post", "/admin/cache/warm"), ("get", "/admin/cache/warm")):
+        url = f"/api/v1{path}"
+        assert getattr(test_client, method)(url).status_code == 401
+        assert getattr(test_client, method)(url, headers=auth_headers).status_code == 403
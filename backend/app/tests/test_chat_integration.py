@@ -2,6 +2,10 @@
 import uuid
 from fastapi.testclient import TestClient
 from app.main import app
+from app.auth import create_token
+from app import llm as llm_module
+from app import database, prefix_cache, routes
+from app.llm import ModelRegistry
 
 client = TestClient(app)
 API_PREFIX = "/api/v1"
@@ -10,7 +14,7 @@ API_PREFIX = "/api/v1"
 # -----------------------
 # 1. End-to-end chat flow
 # -----------------------
-def test_chat_flow(test_client: TestClient, setup_test_user, db_session):
+def test_chat_flow(test_client: TestClient, setup_test_user, auth_headers, db_session):
     """
     Full chat flow:
     1) Create a session
@@ -23,6 +27,7 @@ def test_chat_flow(test_client: TestClient, setup_test_user, db_session):
     resp = test_client.post(
         f"{API_PREFIX}/sessions",
         json={"user_id": user_id, "title": "My Chat Session"},
+        headers=auth_headers,
     )
     assert resp.status_code == 200
     session_data = resp.json()
@@ -32,11 +37,14 @@ def test_chat_flow(test_client: TestClient, setup_test_user, db_session):
     resp_msg = test_client.post(
         f"{API_PREFIX}/sessions/{session_id}/messages",
         json={"user_id": user_id, "content": "hello world"},
+        headers=auth_headers,
     )
     assert resp_msg.status_code == 200
 
     # Fetch messages and verify
-    resp_list = test_client.get(f"{API_PREFIX}/sessions/{session_id}/messages")
+    resp_list = test_client.get(
+        f"{API_PREFIX}/sessions/{session_id}/messages", headers=auth_headers
+    )
     assert resp_list.status_code == 200
     msgs = resp_list.json()
     assert len(msgs) == 1
@@ -46,7 +54,7 @@ def test_chat_flow(test_client: TestClient, setup_test_user, db_session):
 # -----------------------
 # 2. Session CRUD & detail
 # -----------------------
-def test_sessions_crud_and_detail(test_client: TestClient, setup_test_user):
+def test_sessions_crud_and_detail(test_client: TestClient, setup_test_user, auth_headers):
     """
     Test creating multiple sessions, listing them by user_id,
     and fetching a single session's detail.
@@ -58,20 +66,23 @@ def test_sessions_crud_and_detail(test_client: TestClient, setup_test_user):
         resp = test_client.post(
             f"{API_PREFIX}/sessions",
             json={"user_id": user_id, "title": f"Chat {i}"},
+            headers=auth_headers,
         )
         assert resp.status_code == 200
         ids.append(resp.json()["id"])
 
     # List sessions for the user
     resp_list = test_client.get(
-        f"{API_PREFIX}/sessions", params={"user_id": user_id}
+        f"{API_PREFIX}/sessions", params={"user_id": user_id}, headers=auth_headers
     )
     assert resp_list.status_code == 200
     data = resp_list.json()
     assert len(data) >= 2
 
     # Get session detail
-    resp_detail = test_client.get(f"{API_PREFIX}/sessions/{ids[0]}")
+    resp_detail = test_client.get(
+        f"{API_PREFIX}/sessions/{ids[0]}", headers=auth_headers
+    )
     assert resp_detail.status_code == 200
     detail = resp_detail.json()
     assert detail["id"] == ids[0]
@@ -81,7 +92,7 @@ def test_sessions_crud_and_detail(test_client: TestClient, setup_test_user):
 # 3. Message: rate / pin / search
 # -------------------------------
 def test_message_rate_pin_and_search(
-    test_client: TestClient, setup_test_user, setup_test_session
+    test_client: TestClient, setup_test_user, setup_test_session, auth_headers
 ):
     """
     For a given session:
@@ -97,34 +108,320 @@ def test_message_rate_pin_and_search(
     m1 = test_client.post(
         f"{API_PREFIX}/sessions/{session_id}/messages",
         json={"user_id": user_id, "content": "hello world"},
+        headers=auth_headers,
     ).json()
 
     m2 = test_client.post(
         f"{API_PREFIX}/sessions/{session_id}/messages",
         json={"user_id": user_id, "content": "fastapi testing"},
+        headers=auth_headers,
     ).json()
 
     # Rate a message
     resp_rate = test_client.post(
         f"{API_PREFIX}/messages/{m1['id']}/rate",
         json={"rating": 5},
+        headers=auth_headers,
     )
     assert resp_rate.status_code == 200
 
     # Toggle pin state twice
-    resp_pin1 = test_client.post(f"{API_PREFIX}/messages/{m1['id']}/pin")
+    resp_pin1 = test_client.post(
+        f"{API_PREFIX}/messages/{m1['id']}/pin", headers=auth_headers
+    )
     assert resp_pin1.status_code == 200
 
-    resp_pin2 = test_client.post(f"{API_PREFIX}/messages/{m1['id']}/pin")
+    resp_pin2 = test_client.post(
+        f"{API_PREFIX}/messages/{m1['id']}/pin", headers=auth_headers
+    )
     assert resp_pin2.status_code == 200
 
     # Search messages in the session
     resp_search = test_client.get(
         f"{API_PREFIX}/sessions/{session_id}/search",
         params={"q": "fastapi"},
+        headers=auth_headers,
     )
     assert resp_search.status_code == 200
     data = resp_search.json()
     # Search endpoint returns {"results": [...]}
     results = data.get("results", [])
     assert any("fastapi" in m["content"] for m in results)
+
+
+# -----------------------------
+# 4. Authentication & ownership
+# -----------------------------
+def test_routes_require_token_and_ownership(
+    test_client: TestClient, setup_test_session, auth_headers
+):
+    """
+    Session and message routes reject missing/invalid tokens,
+    and hide sessions that belong to another user.
+    """
+    session_id = str(setup_test_session)
+
+    resp = test_client.get(f"{API_PREFIX}/sessions/{session_id}/messages")
+    assert resp.status_code == 401
+
+    resp = test_client.get(
+        f"{API_PREFIX}/sessions/{session_id}/messages",
+        headers={"Authorization": "Bearer not-a-jwt"},
+    )
+    assert resp.status_code == 401
+
+    other_user = {"Authorization": f"Bearer {create_token(str(uuid.uuid4()))}"}
+    resp = test_client.get(f"{API_PREFIX}/sessions/{session_id}", headers=other_user)
+    assert resp.status_code == 404
+
+    resp = test_client.get(f"{API_PREFIX}/sessions/{session_id}", headers=auth_headers)
+    assert resp.status_code == 200
+
+
+# ---------------------------------------
+# 5. Content-addressed assistant responses
+# ---------------------------------------
+def test_identical_assistant_responses_share_one_body(
+    test_client: TestClient, setup_test_session, auth_headers, db_session
+):
+    """
+    Assistant messages with the same text reference one stored body, while the API still
+    returns the full content for each message (listing and search).
+    """
+    from app import models
+
+    session_id = str(setup_test_session)
+    answer = f"The answer is 42 ({uuid.uuid4()})"
+    ids = []
+    for _ in range(2):
+        resp = test_client.post(
+            f"{API_PREFIX}/sessions/{session_id}/messages",
+            json={"role": "assistant", "content": answer},
+            headers=auth_headers,
+        )
+        assert resp.status_code == 200
+        assert resp.json()["content"] == answer
+        ids.append(resp.json()["id"])
+
+    rows = db_session.query(models.Message).filter(models.Message.id.in_(ids)).all()
+    assert len({row.body_hash for row in rows}) == 1
+    assert all(row.inline_content is None for row in rows)
+    assert db_session.query(models.ResponseBody).filter(models.ResponseBody.content == answer).count() == 1
+
+    msgs = test_client.get(f"{API_PREFIX}/sessions/{session_id}/messages", headers=auth_headers).json()
+    assert [m["content"] for m in msgs] == [answer, answer]
+
+    found = test_client.get(
+        f"{API_PREFIX}/sessions/{session_id}/search", params={"q": "answer is 42"}, headers=auth_headers
+    ).json()["results"]
+    assert len(found) == 2
+
+
+# -----------------------
+# 6. Bulk message actions
+# -----------------------
+def test_bulk_pin_and_delete(test_client: TestClient, setup_test_session, auth_headers):
+    """
+    Bulk operations change exactly the addressed messages of the caller, by ids or by filter.
+    """
+    session_id = str(setup_test_session)
+    ids = [
+        test_client.post(
+            f"{API_PREFIX}/sessions/{session_id}/messages",
+            json={"content": f"note {i}"},
+            headers=auth_headers,
+        ).json()["id"]
+        for i in range(4)
+    ]
+
+    resp = test_client.post(
+        f"{API_PREFIX}/messages/bulk",
+        json={"action": "pin", "message_ids": ids[:2] + [str(uuid.uuid4())]},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200
+    assert sorted(resp.json()["ids"]) == sorted(ids[:2])
+
+    # Another user cannot touch these messages
+    other = {"Authorization": f"Bearer {create_token(str(uuid.uuid4()))}"}
+    resp = test_client.post(
+        f"{API_PREFIX}/messages/bulk", json={"action": "delete", "message_ids": ids}, headers=other
+    )
+    assert resp.json()["affected"] == 0
+
+    resp = test_client.post(
+        f"{API_PREFIX}/messages/bulk",
+        json={"action": "delete", "filter": {"session_id": session_id, "pinned": False}},
+        headers=auth_headers,
+    )
+    assert sorted(resp.json()["ids"]) == sorted(ids[2:])
+
+    msgs = test_client.get(f"{API_PREFIX}/sessions/{session_id}/messages", headers=auth_headers).json()
+    assert sorted(m["id"] for m in msgs) == sorted(ids[:2])
+    assert all(m["pinned"] for m in msgs)
+
+    resp = test_client.post(
+        f"{API_PREFIX}/messages/bulk",
+        json={"action": "rate", "message_ids": ids, "filter": {"session_id": session_id}},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 400
+
+
+# -----------------------------------
+# 7. Session list with activity summary
+# -----------------------------------
+def test_session_list_is_sorted_by_activity_with_counts(
+    test_client: TestClient, setup_test_user, auth_headers
+):
+    """
+    list_sessions returns message counts and the last message preview, most recently active
+    first, and pages with a cursor.
+    """
+    user_id = str(setup_test_user)
+    first, second = [
+        test_client.post(
+            f"{API_PREFIX}/sessions", json={"user_id": user_id, "title": title}, headers=auth_headers
+        ).json()["id"]
+        for title in ("first", "second")
+    ]
+    for content in ("hello", "latest words"):
+        test_client.post(
+            f"{API_PREFIX}/sessions/{first}/messages", json={"content": content}, headers=auth_headers
+        )
+
+    resp = test_client.get(f"{API_PREFIX}/sessions", params={"user_id": user_id}, headers=auth_headers)
+    sessions = resp.json()
+    assert [s["id"] for s in sessions] == [first, second]
+    assert sessions[0]["message_count"] == 2
+    assert sessions[0]["last_message_preview"] == "latest words"
+    assert sessions[1]["message_count"] == 0
+
+    page = test_client.get(
+        f"{API_PREFIX}/sessions", params={"user_id": user_id, "limit": 1}, headers=auth_headers
+    )
+    assert [s["id"] for s in page.json()] == [first]
+    cursor = page.headers["X-Next-Cursor"]
+    page = test_client.get(
+        f"{API_PREFIX}/sessions",
+        params={"user_id": user_id, "limit": 1, "cursor": cursor},
+        headers=auth_headers,
+    )
+    assert [s["id"] for s in page.json()] == [second]
+    assert "X-Next-Cursor" not in page.headers
+
+    msg_id = test_client.get(f"{API_PREFIX}/sessions/{first}/messages", headers=auth_headers).json()[1]["id"]
+    test_client.post(f"{API_PREFIX}/messages/{msg_id}/delete", headers=auth_headers)
+    sessions = test_client.get(f"{API_PREFIX}/sessions", params={"user_id": user_id}, headers=auth_headers).json()
+    assert sessions[0]["message_count"] == 1
+    assert sessions[0]["last_message_preview"] == "hello"
+
+
+# ---------------------------------------
+# 8. Conditional GET and compression
+# ---------------------------------------
+def test_history_etag_and_compression(test_client: TestClient, setup_test_session, auth_headers):
+    """
+    History endpoints answer 304 to a matching If-None-Match until the session changes
+    (new message, pin), and large responses are compressed.
+    """
+    url = f"{API_PREFIX}/sessions/{setup_test_session}/messages"
+    for content in ("x" * 800, "y" * 800):
+        test_client.post(url, json={"content": content}, headers=auth_headers)
+
+    resp = test_client.get(url, headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] in ("br", "gzip")
+    etag = resp.headers["ETag"]
+    assert test_client.get(url, headers={**auth_headers, "If-None-Match": etag}).status_code == 304
+
+    detail_url = f"{API_PREFIX}/sessions/{setup_test_session}"
+    detail_etag = test_client.get(detail_url, headers=auth_headers).headers["ETag"]
+    assert test_client.get(detail_url, headers={**auth_headers, "If-None-Match": detail_etag}).status_code == 304
+
+    search_url = f"{API_PREFIX}/sessions/{setup_test_session}/search"
+    search_etag = test_client.get(search_url, params={"q": "x"}, headers=auth_headers).headers["ETag"]
+    assert test_client.get(search_url, params={"q": "y"}, headers={**auth_headers, "If-None-Match": search_etag}).status_code == 200
+
+    message_id = resp.json()[0]["id"]
+    test_client.post(f"{API_PREFIX}/messages/{message_id}/pin", headers=auth_headers)
+    resp = test_client.get(url, headers={**auth_headers, "If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert resp.json()[0]["pinned"] is True
+
+    test_client.post(url, json={"content": "new"}, headers=auth_headers)
+    assert test_client.get(detail_url, headers={**auth_headers, "If-None-Match": detail_etag}).status_code == 200
+
+
+def test_chat_rejects_out_of_range_timeout(test_client: TestClient, setup_test_session, auth_headers):
+    """
+    timeout_ms must be positive and at most 600000 (nginx's proxy_read_timeout).
+    """
+    for timeout_ms in (0, -5, 600_001):
+        resp = test_client.post(
+            f"{API_PREFIX}/chat",
+            json={"session_id": str(setup_test_session), "prompt": "hi", "timeout_ms": timeout_ms},
+            headers=auth_headers,
+        )
+        assert resp.status_code == 422
+
+
+def test_chat_generates_through_the_real_llama_signature(
+    test_client: TestClient, setup_test_session, auth_headers, signature_checked_llama, tmp_path, monkeypatch
+):
+    """
+    A cache miss generates with llama-cpp's actual create_chat_completion signature (streamed,
+    so it can be cancelled between tokens) and returns the model's reply, not an error fallback.
+    """
+    monkeypatch.setattr(llm_module, "Llama", signature_checked_llama)
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", False)
+    (tmp_path / "model.gguf").write_bytes(b"gguf")
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "model.gguf"), ram_budget_mb=64)
+    monkeypatch.setattr(routes, "model_registry", registry)
+    assert registry.get().wait_ready(5)
+
+    resp = test_client.post(
+        f"{API_PREFIX}/chat",
+        json={"session_id": str(setup_test_session), "prompt": f"hello {uuid.uuid4()}"},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["cached"] is False
+    assert body["content"] == signature_checked_llama.reply
+    assert registry.get(load=False).tokens_generated == 3
+
+
+def test_chat_releases_its_db_connection_while_generating(
+    test_client: TestClient, setup_test_session, auth_headers, signature_checked_llama, tmp_path, monkeypatch
+):
+    """
+    The request's pooled connection goes back to the pool before generation and the reply is
+    still saved afterwards.
+    """
+    checked_out = []
+
+    class RecordingLlama(signature_checked_llama):
+        def create_chat_completion(self, *args, **kwargs):
+            checked_out.append(database.engine.pool.checkedout())
+            return super().create_chat_completion(*args, **kwargs)
+
+    monkeypatch.setattr(llm_module, "Llama", RecordingLlama)
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", False)
+    (tmp_path / "model.gguf").write_bytes(b"gguf")
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "model.gguf"), ram_budget_mb=64)
+    monkeypatch.setattr(routes, "model_registry", registry)
+    assert registry.get().wait_ready(5)
+
+    before = database.engine.pool.checkedout()
+    resp = test_client.post(
+        f"{API_PREFIX}/chat",
+        json={"session_id": str(setup_test_session), "prompt": f"hello {uuid.uuid4()}"},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200
+    assert checked_out == [before]
+
+    msgs = test_client.get(f"{API_PREFIX}/sessions/{setup_test_session}/messages", headers=auth_headers).json()
+    assert msgs[-1]["content"] == signature_checked_llama.reply
@@ -0,0 +1,95 @@
+# app/tests/test_compaction.py
+from datetime import datetime, timedelta
+
+from app import compaction, models
+from app import llm as llm_module
+from app import prefix_cache
+from app.compaction import CompactionWorker, plan_chunk, summarization_messages
+from app.llm import ModelRegistry
+
+
+class WordTokenizer:
+    """
+    Stand-in for llama_cpp.Llama tokenization: one token per whitespace-separated word.
+    """
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        return text.decode("utf-8").split()
+
+    def detokenize(self, tokens) -> bytes:
+        return " ".join(tokens).encode("utf-8")
+
+
+def _messages(word_counts):
+    base = datetime.utcnow() - timedelta(hours=1)
+    return [
+        models.Message(
+            role="user" if i % 2 == 0 else "assistant",
+            content=" ".join(["word"] * n),
+            created_at=base + timedelta(seconds=i),
+        )
+        for i, n in enumerate(word_counts)
+    ]
+
+
+def _prompt_tokens(llm, lines):
+    return sum(
+        len(llm.tokenize(m["content"].encode())) + compaction.MESSAGE_OVERHEAD_TOKENS
+        for m in summarization_messages("previous summary", lines)
+    )
+
+
+def test_chunk_of_long_messages_fits_the_context_window(monkeypatch):
+    """
+    Long messages are folded only as far as the summarization prompt plus its output fits in
+    N_CTX, the newest turns stay verbatim, and a single oversized message is cut to fit.
+    """
+    monkeypatch.setattr(compaction, "N_CTX", 512)
+    monkeypatch.setattr(compaction, "COMPACTION_SUMMARY_TOKENS", 128)
+    monkeypatch.setattr(compaction, "COMPACTION_TRIGGER_TOKENS", 192)
+    monkeypatch.setattr(compaction, "COMPACTION_KEEP_RECENT_TOKENS", 128)
+    monkeypatch.setattr(compaction, "COMPACTION_MAX_CHARS_PER_MESSAGE", 100000)
+    llm = WordTokenizer()
+    limit = compaction.N_CTX - compaction.COMPACTION_SUMMARY_TOKENS
+
+    pending = _messages([60] * 10)
+    chunk = plan_chunk(llm, "previous summary", pending)
+    assert 0 < len(chunk) < len(pending) - 1
+    assert [m for m, _ in chunk] == pending[: len(chunk)]
+    assert _prompt_tokens(llm, [line for _, line in chunk]) <= limit
+
+    pending = _messages([2000, 10, 10, 10])
+    chunk = plan_chunk(llm, "previous summary", pending)
+    assert [m for m, _ in chunk] == pending[:1]
+    assert chunk[0][1].endswith("[...]")
+    assert _prompt_tokens(llm, [chunk[0][1]]) <= limit
+
+    assert plan_chunk(llm, None, _messages([20, 20])) == []  # under the trigger
+
+
+def test_compaction_summarizes_through_the_model_registry(
+    db_session, setup_test_session, signature_checked_llama, tmp_path, monkeypatch
+):
+    """
+    compact_session plans and generates through ModelRegistry (acquire_background and
+    generate_background) with llama-cpp's real signatures, and stores the summary.
+    """
+    monkeypatch.setattr(llm_module, "Llama", signature_checked_llama)
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", False)
+    monkeypatch.setattr(compaction, "COMPACTION_TRIGGER_TOKENS", 300)
+    monkeypatch.setattr(compaction, "COMPACTION_KEEP_RECENT_TOKENS", 200)
+    (tmp_path / "model.gguf").write_bytes(b"gguf")
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "model.gguf"), ram_budget_mb=64)
+    monkeypatch.setattr(compaction, "model_registry", registry)
+    assert registry.get().wait_ready(5)
+
+    pending = _messages([20] * 10)
+    for msg in pending:
+        msg.session_id = setup_test_session
+    db_session.add_all(pending)
+    db_session.commit()
+
+    assert CompactionWorker().compact_session(db_session, setup_test_session) is True
+    summary = db_session.get(models.SessionSummary, setup_test_session)
+    assert summary.summary == signature_checked_llama.reply
+    assert 0 < summary.summarized_count < len(pending)
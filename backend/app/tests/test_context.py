@@ -0,0 +1,75 @@
+# app/tests/test_context.py
+from datetime import datetime, timedelta
+
+from app import models
+from app.context import build_messages
+
+
+def test_prompt_uses_summary_plus_recent_turns(db_session, setup_test_session):
+    """
+    Once a session has a rolling summary, prompt assembly replaces the summarized turns
+    with the summary while the stored messages stay untouched.
+    """
+    base = datetime.utcnow() - timedelta(hours=1)
+    for i in range(6):
+        db_session.add(models.Message(
+            session_id=setup_test_session,
+            role="user" if i % 2 == 0 else "assistant",
+            content=f"turn {i}",
+            created_at=base + timedelta(minutes=i),
+        ))
+    db_session.add(models.SessionSummary(
+        session_id=setup_test_session,
+        summary="The user said turns 0 to 3.",
+        summarized_until=base + timedelta(minutes=3),
+        summarized_count=4,
+    ))
+    db_session.commit()
+
+    payload = build_messages(db_session, setup_test_session, "next")
+    assert payload[0]["role"] == "system"
+    assert "turns 0 to 3" in payload[0]["content"]
+    assert [m["content"] for m in payload[1:]] == ["turn 4", "turn 5", "next"]
+
+    stored = db_session.query(models.Message).filter(models.Message.session_id == setup_test_session).count()
+    assert stored == 6
+
+
+def test_retrieval_mode_keeps_recent_and_similar_turns(db_session, setup_test_session, monkeypatch):
+    """
+    Retrieval mode sends the recent window plus the older turns most similar to the prompt,
+    in chronological order, instead of the whole history.
+    """
+    from app import context
+    from app.embeddings import embedding_store
+
+    monkeypatch.setattr(context, "RETRIEVAL_RECENT_MESSAGES", 2)
+    monkeypatch.setattr(context, "RETRIEVAL_TOP_K", 1)
+    base = datetime.utcnow() - timedelta(hours=1)
+    contents = [
+        "my cat is called Miso",
+        "the weather is sunny today",
+        "I like green tea",
+        "recent one",
+        "recent two",
+    ]
+    msgs = []
+    for i, content in enumerate(contents):
+        msg = models.Message(
+            session_id=setup_test_session,
+            role="user",
+            content=content,
+            created_at=base + timedelta(minutes=i),
+        )
+        db_session.add(msg)
+        msgs.append(msg)
+    db_session.commit()
+    embedding_store.add_messages(db_session, msgs)
+
+    payload = build_messages(db_session, setup_test_session, "what is my cat called?", mode="retrieval")
+    assert [m["content"] for m in payload] == [
+        "my cat is called Miso",
+        "recent one",
+        "recent two",
+        "what is my cat called?",
+    ]
@@ -0,0 +1,37 @@
+# app/tests/test_database.py
+import uuid
+
+from sqlalchemy import create_engine, select
+
+from app import database, models
+
+
+def test_read_sessions_use_replica_until_the_user_writes(monkeypatch):
+    """
+    Read-only sessions go to the replica; a session that writes, or any session of a user who
+    wrote moments ago, goes to the primary.
+    """
+    replica = create_engine("postgresql://replica.invalid/pocketllm")  # never connected
+    monkeypatch.setattr(database, "replica_engine", replica)
+    user_key = str(uuid.uuid4())
+
+    reader = database.open_session(sticky_key=user_key, read_only=True)
+    writer = database.open_session(sticky_key=user_key)
+    try:
+        assert reader.get_bind(clause=select(models.Message.id)) is replica
+        assert writer.get_bind(clause=select(models.Message.id)) is database.engine
+        assert reader.get_bind(clause=select(models.Session).with_for_update()) is database.engine
+        assert reader.get_bind(clause=select(models.Message.id)) is database.engine  # stays on primary
+    finally:
+        reader.close()
+        writer.close()
+
+    database._mark_written(user_key)
+    fresh = database.open_session(sticky_key=user_key, read_only=True)
+    other = database.open_session(sticky_key=str(uuid.uuid4()), read_only=True)
+    try:
+        assert fresh.get_bind(clause=select(models.Message.id)) is database.engine
+        assert other.get_bind(clause=select(models.Message.id)) is replica
+    finally:
+        fresh.close()
+        other.close()
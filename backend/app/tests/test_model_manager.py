@@ -0,0 +1,342 @@
+# app/tests/test_model_manager.py
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app import llm as llm_module
+from app import prefix_cache
+from app.cancellation import CancelToken, GenerationCancelled
+from app.llm import ModelManager, ModelNotReadyError, ModelRegistry, UnknownModelError
+from app.prefix_cache import PrefixCache
+from app.speculative import CountingDraftModel
+
+API_PREFIX = "/api/v1"
+
+
+class FakeLlama:
+    """
+    Minimal stand-in for llama_cpp.Llama so the lifecycle can be tested without a GGUF file.
+    """
+
+    def __init__(self, model_path, **kwargs):
+        self.model_path = model_path
+        self.kwargs = kwargs
+        self.closed = False
+
+    def create_completion(self, prompt, **kwargs):
+        return {"choices": [{"text": "ok"}]}
+
+    def close(self):
+        self.closed = True
+
+
+def _wait_until_idle(manager: ModelManager, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while manager.state in ("tuning", "loading", "warming") and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_ready_probe_before_model_loaded(test_client: TestClient):
+    """
+    The startup hook does not run without a lifespan context, so no model is loaded:
+    /health stays ok while /ready reports 503.
+    """
+    assert test_client.get(f"{API_PREFIX}/health").status_code == 200
+    resp = test_client.get(f"{API_PREFIX}/ready")
+    assert resp.status_code == 503
+    assert resp.json()["ready"] is False
+
+
+def test_background_load_and_hot_reload(tmp_path, monkeypatch):
+    """
+    Loading happens off the calling thread, and a reload swaps models only once the new one is warm.
+    """
+    monkeypatch.setattr(llm_module, "Llama", FakeLlama)
+    first = tmp_path / "first.gguf"
+    second = tmp_path / "second.gguf"
+    first.write_bytes(b"gguf")
+    second.write_bytes(b"gguf")
+
+    manager = ModelManager(str(first))
+    try:
+        with manager.acquire():
+            assert False, "acquire() must fail before the model is loaded"
+    except ModelNotReadyError:
+        pass
+
+    manager.start()
+    _wait_until_idle(manager)
+    assert manager.ready and manager.state == "ready"
+    with manager.acquire() as llm:
+        old_llm = llm
+        assert llm.kwargs["use_mmap"] == llm_module.USE_MMAP
+
+    assert manager.reload(str(second))
+    _wait_until_idle(manager)
+    assert manager.model_path == str(second)
+    assert old_llm.closed
+
+    # A failed reload keeps the previous model serving.
+    assert manager.reload(str(tmp_path / "missing.gguf"))
+    _wait_until_idle(manager)
+    assert manager.ready and manager.model_path == str(second)
+    assert manager.error
+
+
+def test_registry_lru_eviction_under_ram_budget(tmp_path, monkeypatch):
+    """
+    Models are discovered from the directory, loaded on demand, and the least recently
+    used one is unloaded when the next one would not fit the RAM budget.
+    """
+    monkeypatch.setattr(llm_module, "Llama", FakeLlama)
+    for name in ("tiny", "large"):
+        (tmp_path / f"{name}.gguf").write_bytes(b"0" * 1024 * 1024)
+
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "tiny.gguf"), ram_budget_mb=1)
+    assert set(registry.available()) == {"tiny", "large"}
+
+    with registry.acquire("tiny") as (manager, llm):
+        assert manager.name == "tiny"
+        manager.record_generation(10, 0.5)
+    with registry.acquire("large") as (manager, llm):
+        assert manager.name == "large"
+
+    stats = {m["name"]: m for m in registry.stats()}
+    assert stats["large"]["resident"] is True
+    assert stats["tiny"]["resident"] is False
+    assert stats["tiny"]["tokens_per_second"] == 20.0
+
+    try:
+        registry.resolve("missing")
+        assert False, "unknown models must be rejected"
+    except UnknownModelError:
+        pass
+
+
+def test_registry_budget_counts_draft_models_and_keeps_pinned_models(tmp_path, monkeypatch):
+    """
+    A draft model's weights count towards the RAM budget, and a pinned model is never evicted.
+    """
+    monkeypatch.setattr(llm_module, "Llama", FakeLlama)
+    for name in ("tiny", "large"):
+        (tmp_path / f"{name}.gguf").write_bytes(b"0" * 400 * 1024)
+    draft = tmp_path / "drafts" / "draft.gguf"
+    draft.parent.mkdir()
+    draft.write_bytes(b"0" * 300 * 1024)
+
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "tiny.gguf"), ram_budget_mb=1)
+    with registry.acquire("tiny"):
+        pass
+    with registry.acquire("large"):
+        pass
+    assert registry.get("tiny", load=False).ready  # 2 x 400 KB fit in 1 MB
+
+    monkeypatch.setattr(llm_module, "draft_model_file", lambda model_path: str(draft))
+    pinned = registry.get("tiny", pin=True)
+    registry.get("large", load=False).unload()
+    with registry.acquire("large"):
+        pass
+    assert pinned.ready  # over budget with the drafts, but pinned
+    registry.release(pinned)
+
+    registry.get("large", load=False).unload()
+    with registry.acquire("large"):
+        pass
+    assert not registry.get("tiny", load=False).ready  # 2 x 700 KB do not fit in 1 MB
+
+
+def test_speculative_decoding_counts_logits_buffer_and_skips_warmup_drafts(tmp_path, monkeypatch):
+    """
+    With a draft model, the n_ctx x n_vocab logits buffer counts towards the model's size, and
+    draft calls made during warmup do not lower the acceptance rate.
+    """
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"gguf")
+    manager = ModelManager(str(path))
+    assert manager.size_bytes == 4
+    monkeypatch.setattr(llm_module, "SPECULATIVE_MODE", "prompt_lookup")
+    assert manager.size_bytes == 4 + llm_module.N_CTX * llm_module.N_VOCAB_ESTIMATE * 4
+
+    draft = CountingDraftModel(lambda input_ids: np.array([1, 2], dtype=np.intc), "prompt_lookup")
+    draft(np.array([0], dtype=np.intc))  # warmup
+    draft.reset()
+    draft(np.array([0], dtype=np.intc))
+    assert draft.acceptance_rate(generated_tokens=3) == 1.0
+
+
+def test_queued_request_is_cancelled_at_deadline(tmp_path, monkeypatch):
+    """
+    A request waiting behind another generation gives up once its deadline passes,
+    and the per-token check ends generation for a disconnected client.
+    """
+    monkeypatch.setattr(llm_module, "Llama", FakeLlama)
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"gguf")
+    manager = ModelManager(str(path))
+    manager.start()
+    _wait_until_idle(manager)
+
+    with manager.acquire():
+        start = time.time()
+        try:
+            with manager.acquire(CancelToken(timeout_ms=300)):
+                assert False, "the model is busy, acquire must not succeed"
+        except GenerationCancelled as e:
+            assert e.reason == "timeout"
+        assert time.time() - start < 2
+
+    disconnected = CancelToken(is_disconnected=lambda: True)
+    assert disconnected.on_token() is True
+    assert disconnected.reason == "disconnected"
+    assert disconnected.tokens_generated == 1
+
+
+class FakeStateLlama:
+    """
+    Stand-in for llama_cpp.Llama with a token context: one token per character of a flat chat
+    template, and save_state / load_state copying the context.
+    """
+
+    def __init__(self):
+        self.input_ids = np.zeros(0, dtype=np.intc)
+        self.n_tokens = 0
+        self.evaluations = 0
+
+    def create_chat_completion(self, messages, **kwargs):
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in messages) + "<assistant>"
+        self.evaluations += 1
+        self.input_ids = np.array([ord(c) for c in prompt], dtype=np.intc)
+        self.n_tokens = len(self.input_ids)
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    def save_state(self):
+        return SimpleNamespace(
+            input_ids=self.input_ids.copy(),
+            scores=np.zeros((4, 8), dtype=np.single),
+            n_tokens=self.n_tokens,
+            llama_state=b"kv-cache",
+            llama_state_size=8,
+            seed=0,
+        )
+
+    def load_state(self, state):
+        self.input_ids = state.input_ids.copy()
+        self.n_tokens = state.n_tokens
+
+    def reset(self):
+        self.n_tokens = 0
+
+
+def test_prefix_snapshot_restored_and_reloaded_from_disk(tmp_path, monkeypatch):
+    """
+    A shared prefix is evaluated once, restored into a cold context, and after a restart loaded
+    from its snapshot file without being evaluated again.
+    """
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", True)
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE_DIR", str(tmp_path / "prefix"))
+    model_path = tmp_path / "model.gguf"
+    model_path.write_bytes(b"gguf")
+    system = [{"role": "system", "content": "Be terse."}]
+
+    llm = FakeStateLlama()
+    cache = PrefixCache.build(llm, str(model_path), prefixes=[system])
+    assert len(cache.snapshots) == 1
+    assert cache.snapshots[0].n_tokens == len("<system>Be terse.<user>")
+    assert cache.snapshots[0].state.scores.shape == (1, 8)  # only the last logits row is kept
+    assert cache.nbytes == llm.input_ids.nbytes + 8 * 4 + 8
+    assert [p.suffix for p in (tmp_path / "prefix").iterdir()] == [".npz"]
+
+    llm.reset()
+    messages = system + [{"role": "user", "content": "hello"}]
+    assert cache.restore(llm, messages) is True
+    assert cache.restore(llm, messages) is False  # context already starts with the prefix
+    assert cache.restore(llm, [{"role": "user", "content": "hello"}]) is False
+
+    restarted = FakeStateLlama()
+    reloaded = PrefixCache.build(restarted, str(model_path), prefixes=[system])
+    assert restarted.evaluations == 0
+    assert reloaded.snapshots[0].n_tokens == cache.snapshots[0].n_tokens
+    assert reloaded.snapshots[0].state.llama_state == b"kv-cache"
+    assert reloaded.snapshots[0].state.scores.shape == (1, 8)
+
+
+def test_prefix_snapshots_are_capped_and_never_unpickled(tmp_path, monkeypatch):
+    """
+    Only PREFIX_CACHE_MAX_SNAPSHOTS prefixes are kept, and a snapshot file that needs unpickling
+    is rejected (the prefix is evaluated again) instead of being executed.
+    """
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", True)
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE_DIR", str(tmp_path / "prefix"))
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE_MAX_SNAPSHOTS", 2)
+    model_path = tmp_path / "model.gguf"
+    model_path.write_bytes(b"gguf")
+    prefixes = [[{"role": "system", "content": f"Preamble {i}"}] for i in range(3)]
+
+    llm = FakeStateLlama()
+    assert len(PrefixCache.build(llm, str(model_path), prefixes=prefixes).snapshots) == 2
+
+    path = PrefixCache._file_path(str(model_path), prefixes[0])
+    with open(path, "wb") as f:
+        np.save(f, np.array([{"n_tokens": 1}], dtype=object), allow_pickle=True)
+    restarted = FakeStateLlama()
+    PrefixCache.build(restarted, str(model_path), prefixes=prefixes[:1])
+    assert restarted.evaluations == 2
+
+
+def test_reload_endpoint_requires_admin_and_models_dir(test_client: TestClient, auth_headers, admin_headers, tmp_path, monkeypatch):
+    """
+    Only admins may reload, and only models from MODELS_DIR (by name or path inside it).
+    """
+    monkeypatch.setattr(llm_module.model_registry, "models_dir", str(tmp_path))
+    reloaded = []
+    monkeypatch.setattr(llm_module.model_registry, "reload", lambda path=None: reloaded.append(path) or True)
+    url = f"{API_PREFIX}/admin/model/reload"
+
+    assert test_client.post(url, json={}).status_code == 401
+    assert test_client.post(url, json={}, headers=auth_headers).status_code == 403
+
+    outside = tmp_path.parent / "outside.gguf"
+    outside.write_bytes(b"x")
+    for path in (str(outside), "../outside.gguf", "/etc/passwd"):
+        assert test_client.post(url, json={"model_path": path}, headers=admin_headers).status_code == 400
+    assert test_client.post(url, json={"model_path": "missing.gguf"}, headers=admin_headers).status_code == 404
+
+    (tmp_path / "small.gguf").write_bytes(b"x")
+    assert test_client.post(url, json={"model_path": "small"}, headers=admin_headers).status_code == 202
+    assert test_client.post(url, json={"model_path": "small.gguf"}, headers=admin_headers).status_code == 202
+    assert [os.path.realpath(p) for p in reloaded] == [os.path.realpath(tmp_path / "small.gguf")] * 2
+
+
+def test_background_generation_yields_to_interactive_requests(signature_checked_llama, tmp_path, monkeypatch):
+    """
+    generate_background streams the completion and abandons it (returning None) as soon as an
+    interactive request wants the model.
+    """
+    monkeypatch.setattr(prefix_cache, "PREFIX_CACHE", False)
+    (tmp_path / "model.gguf").write_bytes(b"gguf")
+    registry = ModelRegistry(str(tmp_path), str(tmp_path / "model.gguf"), ram_budget_mb=64)
+    interrupt = []
+
+    class InterruptedLlama(signature_checked_llama):
+        def create_chat_completion(self, *args, **kwargs):
+            chunks = super().create_chat_completion(*args, **kwargs)
+
+            def _chunks():
+                for i, chunk in enumerate(chunks):
+                    if interrupt and i == 2:
+                        registry.get(load=False).interactive += 1
+                    yield chunk
+
+            return _chunks()
+
+    monkeypatch.setattr(llm_module, "Llama", InterruptedLlama)
+    assert registry.get().wait_ready(5)
+    messages = [{"role": "user", "content": "hi"}]
+
+    assert registry.generate_background(messages, max_tokens=16) == (signature_checked_llama.reply, 3)
+    interrupt.append(True)
+    assert registry.generate_background(messages, max_tokens=16) is None
+    assert registry.get(load=False).tokens_generated == 3
@@ -0,0 +1,113 @@
+# benchmarks/bench_context.py
+"""
+Compare full-history and retrieval context modes on a synthetic long session.
+
+Usage (from the backend directory, with the database reachable):
+    python benchmarks/bench_context.py --turns 400
+    python benchmarks/bench_context.py --turns 400 --generate   # also time generation
+
+Creates a throwaway session, reports prompt tokens and assembly (and optionally generation)
+latency per mode, then deletes the session.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import models
+from app.context import build_messages
+from app.database import SessionLocal
+from app.embeddings import embedding_store
+from app.llm import MODEL_PATH, N_CTX, N_THREADS
+
+TOPICS = [
+    "database indexes", "cooking pasta", "a trip to Kyoto", "python decorators", "marathon training",
+    "mortgage rates", "houseplants", "the french revolution", "guitar chords", "kubernetes pods",
+]
+QUESTIONS = [
+    "What did we say earlier about {topic}?",
+    "Can you remind me of the key point on {topic}?",
+    "Summarize our discussion of {topic} in one line.",
+]
+
+
+def make_session(db, turns: int) -> uuid.UUID:
+    session = models.Session(user_id=uuid.uuid4(), title="bench_context")
+    db.add(session)
+    db.commit()
+    base = datetime.utcnow() - timedelta(hours=turns)
+    msgs = []
+    for i in range(turns):
+        topic = random.choice(TOPICS)
+        msgs.append(models.Message(
+            session_id=session.id,
+            role="user" if i % 2 == 0 else "assistant",
+            content=f"Turn {i} about {topic}: " + " ".join(random.sample(topic.split() * 20, 20)),
+            created_at=base + timedelta(minutes=i),
+        ))
+    db.add_all(msgs)
+    db.commit()
+    embedding_store.add_messages(db, msgs)
+    return session.id
+
+
+def count_tokens(llm, payload) -> int:
+    text = "\n".join(f"{m['role']}: {m['content']}" for m in payload)
+    if llm is None:
+        return len(text) // 4  # rough estimate without a tokenizer
+    return len(llm.tokenize(text.encode("utf-8")))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--generate", action="store_true", help="load the model and time generation")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    llm = None
+    if args.generate:
+        from llama_cpp import Llama
+        llm = Llama(model_path=MODEL_PATH, n_ctx=N_CTX, n_threads=N_THREADS, verbose=False)
+
+    db = SessionLocal()
+    session_id = make_session(db, args.turns)
+    try:
+        prompts = [random.choice(QUESTIONS).format(topic=random.choice(TOPICS)) for _ in range(args.queries)]
+        for mode in ("full", "retrieval"):
+            tokens, assembly_ms, generation_ms = [], [], []
+            for prompt in prompts:
+                t0 = time.time()
+                payload = build_messages(db, session_id, prompt, mode=mode)
+                assembly_ms.append((time.time() - t0) * 1000)
+                tokens.append(count_tokens(llm, payload))
+                if llm is not None and tokens[-1] < N_CTX - args.max_tokens:
+                    t0 = time.time()
+                    llm.create_chat_completion(messages=payload, max_tokens=args.max_tokens)
+                    generation_ms.append((time.time() - t0) * 1000)
+            line = (
+                f"{mode:>9}: prompt tokens {statistics.mean(tokens):8.0f}  "
+                f"assembly {statistics.median(assembly_ms):7.1f} ms"
+            )
+            if generation_ms:
+                line += f"  generation {statistics.median(generation_ms):8.0f} ms"
+            elif llm is not None:
+                line += "  generation skipped (prompt exceeds N_CTX)"
+            print(line)
+    finally:
+        db.query(models.Session).filter(models.Session.id == session_id).delete()
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
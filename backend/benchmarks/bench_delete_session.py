@@ -0,0 +1,66 @@
+# benchmarks/bench_delete_session.py
+"""
+Time deleting a large session: ORM cascade (load every message, delete one by one) vs
+database-side ON DELETE CASCADE (what delete_session does now, via passive_deletes).
+
+Usage (from the backend directory, with the database reachable):
+    python benchmarks/bench_delete_session.py --messages 10000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app import models
+from app.database import SessionLocal
+
+
+def make_session(db, count: int) -> uuid.UUID:
+    session = models.Session(user_id=uuid.uuid4(), title="bench_delete_session")
+    db.add(session)
+    db.commit()
+    db.bulk_insert_mappings(models.Message, [
+        {"id": uuid.uuid4(), "session_id": session.id, "role": "user", "inline_content": f"message {i}"}
+        for i in range(count)
+    ])
+    db.commit()
+    return session.id
+
+
+def delete_orm_cascade(db, session_id) -> None:
+    session = db.get(models.Session, session_id)
+    for message in list(session.messages):
+        db.delete(message)
+    db.delete(session)
+    db.commit()
+
+
+def delete_db_cascade(db, session_id) -> None:
+    db.delete(db.get(models.Session, session_id))
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    args = parser.parse_args()
+
+    for label, fn in (("ORM cascade", delete_orm_cascade), ("ON DELETE CASCADE", delete_db_cascade)):
+        db = SessionLocal()
+        try:
+            session_id = make_session(db, args.messages)
+            db.expunge_all()
+            t0 = time.time()
+            fn(db, session_id)
+            print(f"{label:>18}: deleted {args.messages} messages in {(time.time() - t0) * 1000:8.0f} ms")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# benchmarks/bench_messages.py
+"""
+Storage and read latency of inline vs content-addressed assistant messages.
+
+Usage (from the backend directory, with the database reachable):
+    python benchmarks/bench_messages.py --messages 2000 --distinct 20
+
+Creates two throwaway sessions with the same assistant answers (a few popular ones repeated,
+as cache hits produce): one storing text inline, one referencing response_bodies. Reports the
+bytes of text stored and the median latency of the list_session_messages query + serialization,
+then deletes both sessions.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from sqlalchemy import func
+
+from app import models, schemas
+from app.content_store import assistant_message, collect_garbage
+from app.database import SessionLocal
+
+
+def make_session(db, answers, content_addressed: bool) -> uuid.UUID:
+    session = models.Session(user_id=uuid.uuid4(), title="bench_messages")
+    db.add(session)
+    db.commit()
+    for answer in answers:
+        if content_addressed:
+            db.add(assistant_message(db, session.id, answer))
+        else:
+            db.add(models.Message(session_id=session.id, role="assistant", content=answer))
+    db.commit()
+    return session.id
+
+
+def stored_bytes(db, session_id) -> int:
+    inline = (
+        db.query(func.coalesce(func.sum(func.octet_length(models.Message.inline_content)), 0))
+        .filter(models.Message.session_id == session_id)
+        .scalar()
+    )
+    hashes = (
+        db.query(models.Message.body_hash)
+        .filter(models.Message.session_id == session_id, models.Message.body_hash.isnot(None))
+        .distinct()
+    )
+    bodies = (
+        db.query(func.coalesce(func.sum(func.octet_length(models.ResponseBody.content)), 0))
+        .filter(models.ResponseBody.hash.in_(hashes))
+        .scalar()
+    )
+    return int(inline) + int(bodies)
+
+
+def time_list(session_id, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        db = SessionLocal()
+        try:
+            t0 = time.time()
+            messages = (
+                db.query(models.Message)
+                .filter(models.Message.session_id == session_id)
+                .order_by(models.Message.created_at.asc())
+                .all()
+            )
+            [schemas.MessageResponse.model_validate(m) for m in messages]
+            timings.append((time.time() - t0) * 1000)
+        finally:
+            db.close()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=20)
+    parser.add_argument("--answer-chars", type=int, default=1500)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    pool = [f"Answer {i}: " + "lorem ipsum dolor sit amet " * (args.answer_chars // 27) for i in range(args.distinct)]
+    answers = [random.choice(pool) for _ in range(args.messages)]
+
+    db = SessionLocal()
+    sessions = {}
+    try:
+        for label, content_addressed in (("inline", False), ("content-addressed", True)):
+            sessions[label] = make_session(db, answers, content_addressed)
+        for label, session_id in sessions.items():
+            print(
+                f"{label:>17}: text stored {stored_bytes(db, session_id) / 1e6:8.2f} MB  "
+                f"list {time_list(session_id, args.repeats):7.1f} ms"
+            )
+    finally:
+        for session_id in sessions.values():
+            db.query(models.Session).filter(models.Session.id == session_id).delete()
+        db.commit()
+        collect_garbage(db)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/bench_prefix.py
+"""
+Measure time-to-first-token of first-turn prompts with and without the shared-prefix snapshot.
+
+Usage (from the backend directory):
+    python benchmarks/bench_prefix.py --model /app/models/qwen2.5-1.5b-instruct-q4_k_m.gguf
+    python benchmarks/bench_prefix.py --system-prompt "$(cat system_prompt.txt)"
+
+Before each prompt the context is filled with an unrelated conversation (as after serving
+another session), so "cold" evaluates the whole prompt while "snapshot" restores the prefix first.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from llama_cpp import Llama
+
+from app import prefix_cache
+from app.llm import MODEL_PATH, N_CTX, N_THREADS
+from app.prefix_cache import PrefixCache
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are PocketLLM, a concise and friendly assistant running fully offline. "
+    "Answer in plain language, prefer short paragraphs and bullet lists, say when you are unsure, "
+    "never invent facts, and keep code examples minimal and runnable."
+)
+PROMPTS = [
+    "What is a hash table?",
+    "Give me three tips for better sleep.",
+    "Translate 'good morning' into French and Spanish.",
+    "How do I reverse a list in Python?",
+    "Why is the sky blue?",
+]
+OTHER_SESSION = [{"role": "user", "content": "Tell me a long story about a lighthouse keeper and a storm."}]
+
+
+def first_token_seconds(llm: Llama, messages) -> float:
+    start = time.perf_counter()
+    llm.create_chat_completion(messages=messages, max_tokens=1, temperature=0.0)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--system-prompt", default=prefix_cache.SYSTEM_PROMPT or DEFAULT_SYSTEM_PROMPT)
+    args = parser.parse_args()
+
+    system = [{"role": "system", "content": args.system_prompt}]
+    llm = Llama(model_path=args.model, n_ctx=N_CTX, n_threads=N_THREADS, verbose=False)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        prefix_cache.PREFIX_CACHE_DIR = cache_dir
+        start = time.perf_counter()
+        cache = PrefixCache.build(llm, args.model, prefixes=[system])
+        print(f"Prefix snapshot: {cache.snapshots[0].n_tokens} tokens in {time.perf_counter() - start:.2f}s")
+
+        results = {"cold": [], "snapshot": []}
+        for prompt in PROMPTS:
+            messages = system + [{"role": "user", "content": prompt}]
+            for mode in results:
+                llm.create_chat_completion(messages=OTHER_SESSION, max_tokens=16, temperature=0.0)
+                if mode == "snapshot":
+                    start = time.perf_counter()
+                    cache.restore(llm, messages)
+                    restore_seconds = time.perf_counter() - start
+                else:
+                    restore_seconds = 0.0
+                results[mode].append(restore_seconds + first_token_seconds(llm, messages))
+    llm.close()
+
+    print(f"{'mode':<10} {'mean TTFT ms':>13} {'p50 ms':>8} {'max ms':>8}")
+    for mode, samples in results.items():
+        ms = [s * 1000 for s in samples]
+        print(f"{mode:<10} {statistics.mean(ms):>13.1f} {statistics.median(ms):>8.1f} {max(ms):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
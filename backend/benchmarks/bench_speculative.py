@@ -0,0 +1,87 @@
+# benchmarks/bench_speculative.py
+"""
+Compare plain decoding with speculative decoding on a fixed prompt set.
+
+Usage (from the backend directory):
+    python benchmarks/bench_speculative.py --model /app/models/qwen2.5-1.5b-instruct-q4_k_m.gguf
+    python benchmarks/bench_speculative.py --modes off,draft --draft-model /app/models/qwen2.5-0.5b-instruct-q4_k_m.gguf
+
+Reports decode tokens/s per mode and the draft acceptance rate.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from llama_cpp import Llama
+
+from app.llm import MODEL_PATH, N_CTX, N_THREADS
+from app.speculative import DRAFT_MODEL_PATH, build_draft_model
+
+# Mix of replies that quote the prompt (where prompt lookup shines) and free-form ones.
+PROMPTS = [
+    [{"role": "user", "content": "Fix the typos and repeat the sentence: 'The quick brwn fox jumpd over the lazy dog near the rivr bank.'"}],
+    [{"role": "user", "content": "Convert this list to a markdown table with columns name and age: Alice 31, Bob 27, Carol 45, Dave 38."}],
+    [{"role": "user", "content": "Rewrite this function with type hints:\ndef add(a, b):\n    return a + b\n\ndef mul(a, b):\n    return a * b"}],
+    [
+        {"role": "user", "content": "My shopping list is: eggs, milk, flour, sugar, butter, apples."},
+        {"role": "assistant", "content": "Got it. Your shopping list is: eggs, milk, flour, sugar, butter, apples."},
+        {"role": "user", "content": "Add bananas and repeat the full list."},
+    ],
+    [{"role": "user", "content": "Explain in three sentences what a hash table is."}],
+]
+
+
+def run_mode(model_path: str, mode: str, draft_model_path: str, max_tokens: int) -> dict:
+    draft = build_draft_model(model_path, N_CTX, mode=mode, draft_model_path=draft_model_path)
+    llm = Llama(model_path=model_path, n_ctx=N_CTX, n_threads=N_THREADS, draft_model=draft, verbose=False)
+    # Warm up once so the first prompt does not include page-in cost.
+    llm.create_completion("Hello", max_tokens=4, temperature=0.0)
+    if draft is not None:
+        draft.reset()
+
+    tokens = 0
+    seconds = 0.0
+    for messages in PROMPTS:
+        start = time.perf_counter()
+        completion = llm.create_chat_completion(messages=messages, max_tokens=max_tokens, temperature=0.0)
+        seconds += time.perf_counter() - start
+        tokens += completion["usage"]["completion_tokens"]
+
+    result = {
+        "mode": mode,
+        "tokens": tokens,
+        "seconds": seconds,
+        "tokens_per_second": tokens / seconds if seconds > 0 else 0.0,
+        "acceptance_rate": draft.acceptance_rate(tokens) if draft else None,
+    }
+    llm.close()
+    if draft is not None:
+        draft.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--draft-model", default=DRAFT_MODEL_PATH)
+    parser.add_argument("--modes", default="off,prompt_lookup")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    results = [run_mode(args.model, mode, args.draft_model, args.max_tokens) for mode in args.modes.split(",")]
+    baseline = results[0]["tokens_per_second"]
+
+    print(f"{'mode':<15}{'tokens':>8}{'seconds':>10}{'tok/s':>10}{'speedup':>10}{'accept':>10}")
+    for r in results:
+        speedup = r["tokens_per_second"] / baseline if baseline > 0 else 0.0
+        accept = f"{r['acceptance_rate']:.1%}" if r["acceptance_rate"] is not None else "-"
+        print(f"{r['mode']:<15}{r['tokens']:>8}{r['seconds']:>10.2f}{r['tokens_per_second']:>10.1f}{speedup:>9.2f}x{accept:>10}")
+
+
+if __name__ == "__main__":
+    main()
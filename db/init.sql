@@ -1,3 +1,15 @@
+-- Migrations already reflected in this file (see backend/app/migrations.py for existing databases)
+CREATE TABLE schema_migrations (
+    version VARCHAR(255) PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO schema_migrations (version) VALUES
+    ('0000_feature_tables'),
+    ('0001_response_bodies'),
+    ('0002_partition_messages'),
+    ('0003_session_archive'),
+    ('0004_session_activity');
+
 CREATE TABLE users (
     id UUID PRIMARY KEY,
     email VARCHAR(255) UNIQUE NOT NULL,
@@ -11,22 +23,133 @@ CREATE TABLE sessions (
     user_id UUID,  -- 移除外键约束，支持任意 user_id
     title VARCHAR(255),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    archived_at TIMESTAMP,  -- set while the session's messages live in archived_sessions
+    -- Activity summary, updated in the same transaction as message inserts / deletes
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_message_at TIMESTAMP,
+    last_message_role VARCHAR(20),
+    last_message_preview VARCHAR(255),
+    last_activity_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Session list: a user's sessions, most recently active first
+CREATE INDEX idx_sessions_user_activity ON sessions (user_id, last_activity_at DESC, id DESC);
+
+-- Assistant responses are content-addressed: each distinct text is stored once,
+-- and messages reference it by SHA-256 (content stays NULL on those rows).
+CREATE TABLE response_bodies (
+    hash CHAR(64) PRIMARY KEY,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Range-partitioned by month on created_at (messages_pYYYYMM). Upcoming partitions are created
+-- by the archive worker / python -m app.migrations --partitions; anything outside them lands in
+-- messages_default and is moved when its month's partition is created.
 CREATE TABLE messages (
-    id UUID PRIMARY KEY,
+    id UUID NOT NULL,
     session_id UUID REFERENCES sessions(id) ON DELETE CASCADE,
     role VARCHAR(20),
     content TEXT,
+    body_hash CHAR(64) REFERENCES response_bodies(hash),
     rating VARCHAR(10),
     pinned BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+DO $$
+DECLARE
+    month DATE := date_trunc('month', CURRENT_DATE);
+BEGIN
+    FOR i IN 0..3 LOOP
+        EXECUTE format(
+            'CREATE TABLE messages_p%s PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, 'YYYYMM'), month, month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+
+-- History queries filter by session and order by time
+CREATE INDEX idx_messages_session_created ON messages (session_id, created_at);
+
+-- Garbage collection of unreferenced bodies
+CREATE INDEX idx_messages_body_hash ON messages (body_hash);
+
+-- Rolling summary of older turns per session, written by the background compaction worker.
+-- Prompts use summary + messages after summarized_until; messages themselves stay intact.
+CREATE TABLE session_summaries (
+    session_id UUID PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,
+    summary TEXT,
+    summarized_until TIMESTAMP,
+    summarized_count INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Cold store: messages of sessions idle for ARCHIVE_AFTER_DAYS, as one zlib-compressed JSON
+-- document per session; moved back into messages when the session is opened again.
+CREATE TABLE archived_sessions (
+    session_id UUID PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,
+    payload BYTEA NOT NULL,
+    message_count INTEGER NOT NULL,
+    raw_bytes BIGINT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-message embeddings for retrieval over long sessions (float32 vectors, see app/embeddings.py).
+-- No FK to messages: rows go away with their session, or explicitly when a message is deleted.
+CREATE TABLE message_embeddings (
+    message_id UUID PRIMARY KEY,
+    session_id UUID NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    model VARCHAR(255) NOT NULL,
+    vector BYTEA NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE INDEX idx_message_embeddings_session ON message_embeddings(session_id);
+
 -- Create an index for full-text search on message content
 CREATE INDEX idx_messages_content_search ON messages USING GIN (to_tsvector('english', content));
 
+-- Batch completion jobs: a persistent queue drained at low priority when the model is idle
+CREATE TABLE batch_jobs (
+    id UUID PRIMARY KEY,
+    user_id UUID,
+    model VARCHAR(255),
+    max_tokens INTEGER DEFAULT 256,
+    status VARCHAR(20) DEFAULT 'queued',
+    total_items INTEGER DEFAULT 0,
+    completed_items INTEGER DEFAULT 0,
+    failed_items INTEGER DEFAULT 0,
+    cached_items INTEGER DEFAULT 0,
+    tokens_generated INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE batch_items (
+    id SERIAL PRIMARY KEY,
+    job_id UUID REFERENCES batch_jobs(id) ON DELETE CASCADE,
+    idx INTEGER,
+    custom_id VARCHAR(255),
+    prompt TEXT,
+    status VARCHAR(20) DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    cached BOOLEAN DEFAULT FALSE,
+    tokens INTEGER DEFAULT 0,
+    completed_at TIMESTAMP
+);
+
+CREATE INDEX idx_batch_jobs_user ON batch_jobs (user_id, created_at);
+-- The worker scans pending items in job order
+CREATE INDEX idx_batch_items_pending ON batch_items (job_id, idx) WHERE status = 'pending';
+
 -- Insert a development user so the hard-coded DEFAULT_USER_ID exists in a fresh DB
 -- (Use ON CONFLICT DO NOTHING to avoid duplicate errors on re-run)
 INSERT INTO users (id, email, password_hash, role) VALUES